@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Content-addressed cache for /process results.
+
+    Keys are a BLAKE2 hash of the decoded pixels plus a fingerprint of the
+    model setup (model tag and a content hash of every weights file, taken once
+    when the models are loaded), so results from other weights never match, even
+    if a retrained `.pth` has the same size and mtime.
+    Two layers: an in-memory LRU in front of an on-disk JSON store, both size bounded.
+    """
+
+    def __init__(self, cache_dir, weights_paths, model_tag="", max_memory_entries=1024, max_disk_entries=100000):
+        self.cache_dir = cache_dir
+        self.weights_paths = list(weights_paths)
+        self.model_tag = model_tag
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._fingerprint = self._compute_fingerprint()
+        self._disk_entries = sum(1 for _ in self._iter_disk_files())
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    # --- KEYS ---
+    def _compute_fingerprint(self):
+        # The cache is built right after the models are loaded, so these are the weights in use
+        # (swapping a file on disk only matters after a restart, which hashes it again)
+        parts = [self.model_tag]
+        for path in self.weights_paths:
+            h = hashlib.blake2b(digest_size=16)
+            try:
+                with open(path, "rb") as f:
+                    for block in iter(lambda: f.read(1 << 20), b""):
+                        h.update(block)
+                parts.append(f"{os.path.basename(path)}:{h.hexdigest()}")
+            except OSError:
+                parts.append(f"{os.path.basename(path)}:missing")
+        return "|".join(parts)
+
+    def key(self, pixels, *extra):
+        """Cache key for a decoded HxWxC uint8 array and any extra discriminators (e.g. pipeline policy)."""
+        h = hashlib.blake2b(digest_size=20)
+        h.update(self._fingerprint.encode())
+        h.update(str(pixels.shape).encode())
+        h.update(pixels.tobytes())
+        for part in extra:
+            h.update(str(part).encode())
+        return h.hexdigest()
+
+    # --- LOOKUP ---
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _iter_disk_files(self):
+        for shard in os.scandir(self.cache_dir):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".json"):
+                        yield entry
+
+    def _valid(self, value):
+        # The cached HR image may have been cleaned up from results/
+        hr_path = value.get("hr_path")
+        return hr_path is None or os.path.exists(hr_path)
+
+    def get(self, key):
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+        if value is not None:
+            if self._valid(value):
+                with self._lock:
+                    self.memory_hits += 1
+                return value
+            with self._lock:
+                self._memory.pop(key, None)
+
+        path = self._disk_path(key)
+        try:
+            with open(path, "r") as f:
+                value = json.load(f)
+            os.utime(path)  # keeps disk eviction roughly LRU
+        except (OSError, ValueError):
+            value = None
+        if value is None or not self._valid(value):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        self._remember(key, value)
+
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        existed = os.path.exists(path)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+        if not existed:
+            self._disk_entries += 1
+            # Evict in chunks so we don't rescan the store on every write
+            if self._disk_entries > self.max_disk_entries * 1.1:
+                self._evict_disk()
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        entries = sorted(self._iter_disk_files(), key=lambda e: e.stat().st_mtime)
+        excess = len(entries) - self.max_disk_entries
+        for entry in entries[:max(excess, 0)]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        self._disk_entries = min(len(entries), self.max_disk_entries)
+
+    def stats(self):
+        with self._lock:
+            memory_hits, disk_hits, misses = self.memory_hits, self.disk_hits, self.misses
+            memory_entries = len(self._memory)
+        hits = memory_hits + disk_hits
+        lookups = hits + misses
+        return {
+            "memory_hits": memory_hits,
+            "disk_hits": disk_hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "fingerprint": self._fingerprint,
+            "memory_entries": memory_entries,
+            "disk_entries": self._disk_entries,
+            "max_memory_entries": self.max_memory_entries,
+            "max_disk_entries": self.max_disk_entries
+        }
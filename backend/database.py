@@ -1,81 +1,290 @@
+import base64
 import json
 import os
+import sqlite3
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 import uuid
 
-DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+DATA_DIR = os.environ.get("SMARTPILL_DATA_DIR", os.path.join(os.path.dirname(__file__), "data"))
 os.makedirs(DATA_DIR, exist_ok=True)
 
+DB_FILE = os.path.join(DATA_DIR, "smartpill.db")
+
+# Legacy whole-file JSON stores, imported once into SQLite on first start
 MISSIONS_FILE = os.path.join(DATA_DIR, "missions.json")
 PATIENTS_FILE = os.path.join(DATA_DIR, "patients.json")
 SETTINGS_FILE = os.path.join(DATA_DIR, "settings.json")
 
-def load_json(path, default):
+DEFAULT_PATIENTS = [
+    {
+        "id": "PX-99284",
+        "name": "John Doe",
+        "age": 45,
+        "status": "In-Progress",
+        "last_exam": "2024-02-20",
+        "findings": "Suspected erosion in duodenum"
+    },
+    {
+        "id": "PX-88123",
+        "name": "Jane Smith",
+        "age": 32,
+        "status": "Completed",
+        "last_exam": "2024-02-15",
+        "findings": "Normal"
+    }
+]
+
+DEFAULT_SETTINGS = {
+    "telemetry_rate": 5,
+    "ai_auto_process": True,
+    "emergency_stop_protocol": "Standard",
+    "operator_id": "SR-472"
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS missions (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL UNIQUE,
+    timestamp TEXT NOT NULL,
+    type TEXT,
+    source TEXT,
+    patient_id TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_missions_timestamp ON missions (timestamp);
+CREATE INDEX IF NOT EXISTS idx_missions_patient ON missions (patient_id, seq);
+CREATE INDEX IF NOT EXISTS idx_missions_type ON missions (type, seq);
+CREATE TABLE IF NOT EXISTS patients (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+_local = threading.local()
+
+def get_connection():
+    """One connection per thread; WAL lets readers run alongside the single writer."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_FILE, timeout=30, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    return conn
+
+@contextmanager
+def transaction():
+    # BEGIN IMMEDIATE takes the write lock up front so read-modify-write
+    # sequences (update_patient, update_settings) can't interleave
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+
+def _mission_row(mission_data):
+    return (
+        mission_data["id"],
+        mission_data["timestamp"],
+        mission_data.get("type"),
+        mission_data.get("source"),
+        mission_data.get("patient_id"),
+        json.dumps(mission_data)
+    )
+
+def _read_legacy(path):
+    """Legacy file contents, or None if it is missing or unreadable (an unreadable file is left in place)."""
     if not os.path.exists(path):
-        return default
-    with open(path, "r") as f:
-        try:
+        return None
+    try:
+        with open(path, "r") as f:
             return json.load(f)
-        except:
-            return default
+    except (OSError, ValueError) as e:
+        print(f"Warning: could not read legacy store {path} ({e}), leaving it for a later start")
+        return None
+
+def _migrate_legacy_json(conn):
+    """
+    Imports the old missions/patients/settings JSON files the first time the database is created.
+    Every insert is idempotent (existing rows win), so an import interrupted before the files
+    were renamed simply runs again on the next start. Returns the files that were imported;
+    the caller renames them only once the transaction has committed.
+    """
+    imported = []
+    missions = _read_legacy(MISSIONS_FILE)
+    if missions is not None:
+        # The JSON file is newest-first, insert oldest-first so seq follows time
+        conn.executemany(
+            "INSERT OR IGNORE INTO missions (id, timestamp, type, source, patient_id, data) VALUES (?, ?, ?, ?, ?, ?)",
+            [_mission_row(m) for m in reversed(missions) if "id" in m and "timestamp" in m]
+        )
+        imported.append(MISSIONS_FILE)
 
-def save_json(path, data):
-    with open(path, "w") as f:
-        json.dump(data, f, indent=4)
+    patients = _read_legacy(PATIENTS_FILE)
+    if patients is not None:
+        conn.executemany("INSERT OR IGNORE INTO patients (id, data) VALUES (?, ?)",
+                         [(p["id"], json.dumps(p)) for p in patients])
+        imported.append(PATIENTS_FILE)
+
+    settings = _read_legacy(SETTINGS_FILE)
+    if settings is not None:
+        # OR IGNORE, not OR REPLACE: a re-run must not undo settings changed since the first import
+        conn.executemany("INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)",
+                         [(k, json.dumps(v)) for k, v in settings.items()])
+        imported.append(SETTINGS_FILE)
+    return imported
+
+def init_db():
+    conn = get_connection()
+    conn.executescript(SCHEMA)
+    with transaction() as conn:
+        imported = _migrate_legacy_json(conn)
+        if conn.execute("SELECT COUNT(*) FROM patients").fetchone()[0] == 0:
+            conn.executemany("INSERT INTO patients (id, data) VALUES (?, ?)",
+                             [(p["id"], json.dumps(p)) for p in DEFAULT_PATIENTS])
+    # Only now that the import is committed can the legacy files be retired
+    for path in imported:
+        os.replace(path, path + ".migrated")
 
 # --- MISSIONS ---
 def get_missions():
-    return load_json(MISSIONS_FILE, [])
+    rows = get_connection().execute("SELECT data FROM missions ORDER BY seq DESC")
+    return [json.loads(data) for (data,) in rows]
+
+def get_mission(mission_id):
+    row = get_connection().execute("SELECT data FROM missions WHERE id = ?", (mission_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+def get_missions_for_patient(patient_id):
+    rows = get_connection().execute("SELECT data FROM missions WHERE patient_id = ? ORDER BY seq DESC", (patient_id,))
+    return [json.loads(data) for (data,) in rows]
+
+def encode_cursor(seq):
+    return base64.urlsafe_b64encode(json.dumps({"seq": seq}).encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        return int(json.loads(base64.urlsafe_b64decode(cursor.encode()))["seq"])
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def _is_date(value):
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+        return True
+    except ValueError:
+        return False
+
+def _mission_filters(mission_type=None, source=None, since=None, until=None, finding=None, min_prob=None):
+    clauses, params = [], []
+    if mission_type:
+        clauses.append("type = ?")
+        params.append(mission_type)
+    if source:
+        clauses.append("source = ?")
+        params.append(source)
+    if since:
+        clauses.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        # A bare date covers that whole day: "2024-05-01T09:30..." sorts after "2024-05-01"
+        clauses.append("timestamp < date(?, '+1 day')" if _is_date(until) else "timestamp <= ?")
+        params.append(until)
+    if min_prob is not None and not finding:
+        raise ValueError("min_prob needs a finding to apply to")
+    if finding:
+        if '"' in finding:
+            raise ValueError("Invalid finding name")
+        clauses.append("json_extract(data, ?) >= ?")
+        params.extend([f'$.results."{finding}"', 0.5 if min_prob is None else min_prob])
+    return clauses, params
+
+def check_mission_filters(**filters):
+    """Raises ValueError for filters query_missions would reject, without running a query."""
+    _mission_filters(**filters)
+
+def query_missions(limit=50, cursor=None, **filters):
+    """
+    Newest-first keyset pagination over missions.
+    Returns (missions, next_cursor); next_cursor is None on the last page.
+    """
+    clauses, params = _mission_filters(**filters)
+    if cursor:
+        clauses.append("seq < ?")
+        params.append(decode_cursor(cursor))
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    
+    # Fetch one extra row to know whether another page exists
+    rows = get_connection().execute(
+        f"SELECT seq, data FROM missions {where} ORDER BY seq DESC LIMIT ?", params + [limit + 1]
+    ).fetchall()
+    next_cursor = encode_cursor(rows[limit - 1][0]) if len(rows) > limit else None
+    return [json.loads(data) for _, data in rows[:limit]], next_cursor
+
+def iter_missions(page_size=500, **filters):
+    """
+    Yields every matching mission, newest first, one page query at a time.
+    Each page is its own short query, so the generator can be resumed from any thread.
+    """
+    cursor = None
+    while True:
+        missions, cursor = query_missions(page_size, cursor, **filters)
+        yield from missions
+        if cursor is None:
+            return
+
+def count_missions(**filters):
+    clauses, params = _mission_filters(**filters)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return get_connection().execute(f"SELECT COUNT(*) FROM missions {where}", params).fetchone()[0]
 
 def add_mission(mission_data):
-    missions = get_missions()
     mission_data["id"] = str(uuid.uuid4())
     mission_data["timestamp"] = datetime.now().isoformat()
-    missions.insert(0, mission_data)
-    save_json(MISSIONS_FILE, missions)
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO missions (id, timestamp, type, source, patient_id, data) VALUES (?, ?, ?, ?, ?, ?)",
+            _mission_row(mission_data)
+        )
     return mission_data
 
 # --- PATIENTS ---
 def get_patients():
-    return load_json(PATIENTS_FILE, [
-        {
-            "id": "PX-99284",
-            "name": "John Doe",
-            "age": 45,
-            "status": "In-Progress",
-            "last_exam": "2024-02-20",
-            "findings": "Suspected erosion in duodenum"
-        },
-        {
-            "id": "PX-88123",
-            "name": "Jane Smith",
-            "age": 32,
-            "status": "Completed",
-            "last_exam": "2024-02-15",
-            "findings": "Normal"
-        }
-    ])
+    rows = get_connection().execute("SELECT data FROM patients ORDER BY rowid")
+    return [json.loads(data) for (data,) in rows]
 
 def update_patient(patient_id, data):
-    patients = get_patients()
-    for p in patients:
-        if p["id"] == patient_id:
-            p.update(data)
-            save_json(PATIENTS_FILE, patients)
-            return p
-    return None
+    with transaction() as conn:
+        row = conn.execute("SELECT data FROM patients WHERE id = ?", (patient_id,)).fetchone()
+        if not row:
+            return None
+        p = json.loads(row[0])
+        p.update(data)
+        p["id"] = patient_id
+        conn.execute("UPDATE patients SET data = ? WHERE id = ?", (json.dumps(p), patient_id))
+    return p
 
 # --- SETTINGS ---
 def get_settings():
-    return load_json(SETTINGS_FILE, {
-        "telemetry_rate": 5,
-        "ai_auto_process": True,
-        "emergency_stop_protocol": "Standard",
-        "operator_id": "SR-472"
-    })
+    settings = dict(DEFAULT_SETTINGS)
+    for key, value in get_connection().execute("SELECT key, value FROM settings"):
+        settings[key] = json.loads(value)
+    return settings
 
 def update_settings(data):
-    settings = get_settings()
-    settings.update(data)
-    save_json(SETTINGS_FILE, settings)
-    return settings
+    with transaction() as conn:
+        conn.executemany("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)",
+                         [(k, json.dumps(v)) for k, v in data.items()])
+    return get_settings()
+
+init_db()
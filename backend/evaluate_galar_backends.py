@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from models.galar_ml_wrapper import GalarMLWrapper
+from models.galar_backends import BACKENDS, load_manifest
+
+# data_pipeline.py column names -> GalarMLWrapper class names, where they differ
+COLUMN_TO_CLASS = {"small intestine": "small_bowel"}
+
+def load_validation(csv_path, image_root, max_frames):
+    df = load_manifest(csv_path).head(max_frames)
+    column = "path" if "path" in df.columns else "filename"
+    frames = [np.asarray(Image.open(os.path.join(image_root, p)).convert("RGB")) for p in df[column]]
+    return df, frames
+
+def run_backend(wrapper, frames, batch_size):
+    start = time.perf_counter()
+    results = wrapper.predict_batch(frames, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    probs = np.array([[r[c] for c in wrapper.classes] for r in results])
+    return probs, elapsed * 1000.0 / max(len(frames), 1)
+
+def label_accuracy(df, probs, classes, threshold=0.5):
+    """Per-class accuracy for every class that has a one-hot column in the validation CSV."""
+    scores = {}
+    for column in df.columns:
+        cls = COLUMN_TO_CLASS.get(column, column)
+        if cls in classes:
+            preds = probs[:, classes.index(cls)] > threshold
+            scores[cls] = round(float(np.mean(preds == (df[column].to_numpy() > 0))), 4)
+    return scores
+
+def evaluate(args):
+    df, frames = load_validation(args.val_csv, args.image_root, args.max_frames)
+    print(f"Loaded {len(frames)} validation frames from {args.val_csv}")
+    report = []
+    
+    for arch in args.archs:
+        weights = os.path.join(args.weights_dir, f"galar_{arch}.pth")
+        print(f"--- {arch} ---")
+        baseline = GalarMLWrapper(arch, weights)
+        base_probs, base_ms = run_backend(baseline, frames, args.batch_size)
+        classes = baseline.classes
+        
+        for backend in args.backends:
+            try:
+                wrapper = baseline if backend == "eager" else GalarMLWrapper(
+                    arch, weights, backend=backend,
+                    calibration_csv=args.calibration_csv if backend == "int8_static" else None,
+                    calibration_root=args.image_root,
+                    onnx_path=os.path.join(args.onnx_dir, f"galar_{arch}.onnx"))
+                probs, ms = (base_probs, base_ms) if backend == "eager" else run_backend(wrapper, frames, args.batch_size)
+            except Exception as e:
+                print(f"{arch}/{backend}: failed ({e})")
+                report.append({"arch": arch, "backend": backend, "error": str(e)})
+                continue
+            
+            delta = np.abs(probs - base_probs)
+            row = {
+                "arch": arch,
+                "backend": backend,
+                "ms_per_frame": round(ms, 3),
+                "speedup_vs_fp32": round(base_ms / ms, 2) if ms > 0 else None,
+                "mean_abs_delta": round(float(delta.mean()), 5),
+                "max_abs_delta": round(float(delta.max()), 5),
+                "decision_agreement": round(float(np.mean((probs > 0.5) == (base_probs > 0.5))), 4),
+                "label_accuracy": label_accuracy(df, probs, classes)
+            }
+            print(f"{arch}/{backend}: {row['ms_per_frame']} ms/frame (x{row['speedup_vs_fp32']}), "
+                  f"max |delta| {row['max_abs_delta']}, agreement {row['decision_agreement']}")
+            report.append(row)
+    
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Backend accuracy/latency report saved to {args.output}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare GalarCapsuleML CPU execution backends against the fp32 baseline")
+    parser.add_argument("--val_csv", type=str, required=True, help="Validation CSV generated by data_pipeline.py / preprocess.py")
+    parser.add_argument("--image_root", type=str, required=True, help="Directory the CSV paths are relative to")
+    parser.add_argument("--archs", nargs="+", default=["resnet50"], help="Architectures to evaluate (resnet18 ... efficientnet_v2_m)")
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS, help="Execution backends to compare")
+    parser.add_argument("--weights_dir", type=str, default="../weights", help="Directory holding galar_<arch>.pth files")
+    parser.add_argument("--calibration_csv", type=str, default=None, help="CSV of calibration frames for int8_static (defaults to --val_csv)")
+    parser.add_argument("--onnx_dir", type=str, default="../weights/onnx", help="Where ONNX exports are written / loaded (keyed by a hash of the weights)")
+    parser.add_argument("--max_frames", type=int, default=512, help="Validation frames to use")
+    parser.add_argument("--batch_size", type=int, default=16, help="Frames per forward pass")
+    parser.add_argument("--output", type=str, default="galar_backend_report.json", help="Report path")
+    
+    args = parser.parse_args()
+    args.calibration_csv = args.calibration_csv or args.val_csv
+    evaluate(args)
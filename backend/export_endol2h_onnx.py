@@ -0,0 +1,59 @@
+import argparse
+import os
+
+import numpy as np
+import torch
+
+from models.endo_l2h_wrapper import build_generator, OnnxGenerator
+
+def export_endol2h(weights, output, input_size=128, opset=17, parity_batch=4, tolerance=1e-3, num_threads=None):
+    """
+    Builds the EndoL2H generator from a .pth (including the DataParallel 'module.'
+    prefix stripping), exports it to ONNX with dynamic batch, height and width axes
+    (tiled SR runs other tile sizes through the same graph) and checks that ONNX
+    Runtime reproduces the PyTorch output.
+    """
+    print(f"--- Exporting EndoL2H generator from {weights} ---")
+    # Strict: an untrained generator would export fine and even pass the parity check
+    netG = build_generator(weights, gpu_ids=[], device='cpu', strict=True)
+    if netG is None:
+        raise RuntimeError("lib/EndoL2H is required to build the generator for export")
+    
+    example = torch.randn(1, 3, input_size, input_size)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    torch.onnx.export(
+        netG, example, output,
+        input_names=['input'], output_names=['output'],
+        dynamic_axes={'input': {0: 'batch', 2: 'height', 3: 'width'}, 'output': {0: 'batch', 2: 'out_height', 3: 'out_width'}},
+        opset_version=opset
+    )
+    print(f"ONNX model written to {output}")
+    
+    # Parity checks on a batch larger than the export example and on a tile twice the
+    # export size, which exercise the dynamic axes; each shape runs twice so both the
+    # first (session.run) and the IO-bound path are compared
+    generator = OnnxGenerator(output, num_threads)
+    max_diff = 0.0
+    for size in (input_size, input_size * 2):
+        batch = torch.rand(parity_batch, 3, size, size) * 2 - 1
+        with torch.no_grad():
+            expected = netG(batch).numpy()
+        for _ in range(2):
+            diff = float(np.abs(expected - generator(batch).numpy()).max())
+            max_diff = max(max_diff, diff)
+        print(f"Parity check (batch={parity_batch}, {size}x{size}): max |torch - onnxruntime| = {diff:.2e}")
+    if max_diff > tolerance:
+        raise RuntimeError(f"ONNX output differs from PyTorch by {max_diff:.2e} (tolerance {tolerance:.0e})")
+    print("Parity check passed.")
+    return max_diff
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the EndoL2H generator to ONNX and validate output parity")
+    parser.add_argument("--weights", type=str, required=True, help="Path to EndoL2H .pth weights")
+    parser.add_argument("--output", type=str, default="../weights/endol2h_v2.onnx", help="Output .onnx path")
+    parser.add_argument("--input_size", type=int, default=128, help="LR input size the generator is exported for")
+    parser.add_argument("--opset", type=int, default=17, help="ONNX opset version")
+    parser.add_argument("--tolerance", type=float, default=1e-3, help="Max allowed absolute difference in the parity check")
+    
+    args = parser.parse_args()
+    export_endol2h(args.weights, args.output, args.input_size, args.opset, tolerance=args.tolerance)
@@ -0,0 +1,135 @@
+import os
+import queue
+import threading
+
+from PIL import Image
+
+from metrics import stage
+
+FORMAT_EXTENSIONS = {"png": "png", "webp": "webp", "jpeg": "jpg"}
+
+
+class ImageWriter:
+    """
+    Background image persistence so /process never waits on encoding or disk.
+    Arrays are encoded with a configurable format: PNG with a low compress level
+    (much faster than PIL's default of 6), or lossy WebP/JPEG at a given quality.
+    Raw upload bytes are written as-is without re-encoding.
+
+    The queue is bounded in bytes, not items (a 1024x1024 HR array is ~3 MB), and
+    once it is full callers write inline. Threads run between start() and stop();
+    anything submitted outside that window is written inline too.
+    """
+
+    def __init__(self, fmt="png", png_compress_level=1, quality=90, max_queue_bytes=64 * 1024 * 1024, num_threads=1):
+        if fmt not in FORMAT_EXTENSIONS:
+            raise ValueError(f"Unsupported image format '{fmt}', expected one of {list(FORMAT_EXTENSIONS)}")
+        self.fmt = fmt
+        self.png_compress_level = png_compress_level
+        self.quality = quality
+        self.max_queue_bytes = max_queue_bytes
+        self.num_threads = num_threads
+        self._queue = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._queued_bytes = 0
+        self.written = 0
+        self.failed = 0
+
+    def start(self):
+        self._threads = [
+            threading.Thread(target=self._run, daemon=True, name=f"image-writer-{i}") for i in range(self.num_threads)
+        ]
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        """Writes out everything still queued, then stops the threads."""
+        threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for t in threads:
+            t.join()
+
+    @property
+    def ext(self):
+        return FORMAT_EXTENSIONS[self.fmt]
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    @property
+    def queued_bytes(self):
+        return self._queued_bytes
+
+    def encode_to(self, path, array):
+        """Synchronous encode + write of an HxWx3 uint8 array."""
+        img = Image.fromarray(array)
+        if self.fmt == "png":
+            img.save(path, format="PNG", compress_level=self.png_compress_level)
+        elif self.fmt == "webp":
+            img.save(path, format="WEBP", quality=self.quality, method=0)
+        else:
+            img.save(path, format="JPEG", quality=self.quality)
+
+    def submit(self, path, array, on_written=None):
+        """
+        Queues an array for encoding; falls back to writing inline if the queue is full.
+        `on_written()` is called once the file is in place (not if the write failed).
+        """
+        self._enqueue(("array", path, array, on_written))
+
+    def submit_bytes(self, path, data, on_written=None):
+        self._enqueue(("bytes", path, data, on_written))
+
+    def _enqueue(self, item):
+        size = item[2].nbytes if item[0] == "array" else len(item[2])
+        with self._lock:
+            # An item larger than the whole budget is still queued when nothing else is
+            accept = bool(self._threads) and (self._queued_bytes == 0 or self._queued_bytes + size <= self.max_queue_bytes)
+            if accept:
+                self._queued_bytes += size
+        if accept:
+            self._queue.put((size, item))
+        else:
+            # Back-pressure: the caller (already off the event loop) does the write itself
+            self._write(item)
+
+    def _write(self, item):
+        kind, path, payload, on_written = item
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            if kind == "bytes":
+                with stage("write_bytes"), open(tmp_path, "wb") as f:
+                    f.write(payload)
+            else:
+                with stage(f"encode_{self.fmt}"), open(tmp_path, "wb") as f:
+                    self.encode_to(f, payload)
+            # Atomic rename so the static file server never serves a half-written image
+            os.replace(tmp_path, path)
+            self.written += 1
+        except Exception as e:
+            self.failed += 1
+            print(f"Failed to write {path}: {e}")
+            return
+        if on_written:
+            try:
+                on_written()
+            except Exception as e:
+                print(f"Post-write callback for {path} failed: {e}")
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                self._queue.task_done()
+                return
+            size, item = entry
+            self._write(item)
+            with self._lock:
+                self._queued_bytes -= size
+            self._queue.task_done()
+
+    def flush(self):
+        self._queue.join()
@@ -0,0 +1,221 @@
+import asyncio
+import itertools
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from models.study_aggregator import StudyAggregator
+
+LANE_INTERACTIVE = "interactive"   # single frames a user is waiting on
+LANE_BULK = "bulk"                 # multi-frame batches / study zips
+LANES = {LANE_INTERACTIVE: 0, LANE_BULK: 1}
+
+
+class Job:
+    def __init__(self, job_id, lane, frames, policy):
+        self.id = job_id
+        self.lane = lane
+        self.policy = policy
+        # frame: {index, job_id, filename, status, result, error}; raw bytes live in _data until processed
+        self.frames = [
+            {"index": i, "job_id": frame_id, "filename": filename, "status": "queued", "result": None, "error": None}
+            for i, (frame_id, filename, _) in enumerate(frames)
+        ]
+        self._data = [data for _, _, data in frames]
+        self.created_at = datetime.now().isoformat()
+        self.finished_at = None
+        self.completed = 0
+        self.failed = 0
+        self.subscribers = set()
+        # Multi-frame jobs are studies: their predictions are aggregated in frame order as they
+        # finish. The aggregator is created with the class names of the first successful frame
+        self.aggregator = None
+        self._next_aggregated = 0
+
+    def aggregate_ready(self):
+        """
+        Feeds the aggregator the run of finished frames following the last one fed.
+        Frames complete out of order across workers, so later frames wait here until
+        the gap before them is filled. Failed frames count as non-diagnostic.
+        """
+        if len(self.frames) < 2:
+            return
+        end = self._next_aggregated
+        while end < len(self.frames) and self.frames[end]["status"] in ("done", "failed"):
+            end += 1
+        ready = self.frames[self._next_aggregated:end]
+        predictions = [(f["result"] or {}).get("results") or {} for f in ready]
+        if self.aggregator is None:
+            classes = next((p for p in predictions if p), None)
+            if classes is None:
+                return
+            self.aggregator = StudyAggregator(list(classes))
+        diagnostic = [bool(p) and not f["result"].get("non_diagnostic") for f, p in zip(ready, predictions)]
+        self.aggregator.update_dicts(predictions, [f["job_id"] for f in ready], diagnostic)
+        self._next_aggregated = end
+
+    @property
+    def status(self):
+        if self.completed + self.failed < len(self.frames):
+            return "running" if self.completed + self.failed or any(f["status"] == "running" for f in self.frames) else "queued"
+        return "failed" if self.failed == len(self.frames) else "partial" if self.failed else "done"
+
+    @property
+    def finished(self):
+        return self.completed + self.failed == len(self.frames)
+
+    def summary(self, include_frames=True):
+        out = {
+            "job_id": self.id,
+            "lane": self.lane,
+            "policy": self.policy,
+            "status": self.status,
+            "frames_total": len(self.frames),
+            "frames_done": self.completed,
+            "frames_failed": self.failed,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at
+        }
+        if self.aggregator is not None:
+            out["aggregation"] = self.aggregator.report()
+        if include_frames:
+            out["frames"] = self.frames
+        return out
+
+
+class JobQueue:
+    """
+    Background executor for /jobs. Frames from every job go through one priority queue,
+    interactive frames ahead of bulk ones, and `max_concurrency` worker tasks feed them to
+    `process_frame(job_id, filename, data, policy)` (the same path /process uses, so the
+    micro-batching scheduler still batches across jobs). Finished frames are pushed to
+    the job's WebSocket subscribers as they complete, and multi-frame jobs carry a running
+    study aggregation (segments, sections, top frames) in their summary; finished jobs are
+    kept for polling up to `max_jobs`, oldest evicted first. Queued uploads are held in
+    memory, so admission is bounded by `max_pending_bytes` as well as `max_pending_frames`.
+    """
+
+    def __init__(self, process_frame, max_concurrency=4, max_pending_frames=10000, max_jobs=1000,
+                 max_pending_bytes=2048 * 1024 * 1024):
+        self.process_frame = process_frame
+        self.max_concurrency = max_concurrency
+        self.max_pending_frames = max_pending_frames
+        self.max_pending_bytes = max_pending_bytes
+        self.pending_bytes = 0
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self._queue = None
+        self._workers = []
+        self._seq = itertools.count()
+        self.frames_processed = 0
+
+    @property
+    def pending_frames(self):
+        return self._queue.qsize() if self._queue else 0
+
+    async def start(self):
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrency)]
+
+    async def stop(self):
+        for w in self._workers:
+            w.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, frames, policy, lane=None):
+        """
+        Queues a job of (filename, bytes) frames and returns it immediately.
+        A single frame job reuses the job id as its frame id, so its files land at
+        results/<job_id>_hr.<ext> exactly like /process; batch frames are <job_id>-<index>.
+        """
+        if self.pending_frames + len(frames) > self.max_pending_frames:
+            raise OverflowError(f"Job queue full ({self.pending_frames} frames pending)")
+        size = sum(len(data) for _, data in frames)
+        if self.pending_bytes + size > self.max_pending_bytes:
+            raise OverflowError(f"Job queue full ({self.pending_bytes / 2**20:.1f} MB pending)")
+        lane = lane or (LANE_INTERACTIVE if len(frames) == 1 else LANE_BULK)
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane '{lane}', expected one of {list(LANES)}")
+
+        job_id = str(uuid.uuid4())
+        if len(frames) == 1:
+            entries = [(job_id, frames[0][0], frames[0][1])]
+        else:
+            entries = [(f"{job_id}-{i:05d}", filename, data) for i, (filename, data) in enumerate(frames)]
+        job = Job(job_id, lane, entries, policy)
+        self.jobs[job_id] = job
+        self._evict()
+        self.pending_bytes += size
+        for i in range(len(entries)):
+            self._queue.put_nowait((LANES[lane], next(self._seq), job, i))
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _evict(self):
+        while len(self.jobs) > self.max_jobs:
+            oldest = next((jid for jid, j in self.jobs.items() if j.finished), None)
+            if oldest is None:
+                return
+            del self.jobs[oldest]
+
+    def subscribe(self, job):
+        """Per-frame event stream for one job; frames already finished are replayed first."""
+        queue = asyncio.Queue()
+        for frame in job.frames:
+            if frame["status"] in ("done", "failed"):
+                queue.put_nowait({"type": "frame", **frame})
+        if job.finished:
+            queue.put_nowait({"type": "job", **job.summary(include_frames=False)})
+        else:
+            job.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, job, queue):
+        job.subscribers.discard(queue)
+
+    def _publish(self, job, event):
+        for queue in job.subscribers:
+            queue.put_nowait(event)
+
+    async def _worker(self):
+        while True:
+            _, _, job, i = await self._queue.get()
+            frame = job.frames[i]
+            data, job._data[i] = job._data[i], None  # release the upload as soon as it is taken
+            self.pending_bytes -= len(data)
+            frame["status"] = "running"
+            start = time.perf_counter()
+            try:
+                frame["result"] = await self.process_frame(frame["job_id"], frame["filename"], data, job.policy)
+                frame["status"] = "done"
+                job.completed += 1
+            except Exception as e:
+                frame["error"] = f"{type(e).__name__}: {e}"
+                frame["status"] = "failed"
+                job.failed += 1
+            frame["elapsed_ms"] = round((time.perf_counter() - start) * 1000.0, 2)
+            self.frames_processed += 1
+            job.aggregate_ready()
+            self._publish(job, {"type": "frame", **frame})
+            if job.finished:
+                job.finished_at = datetime.now().isoformat()
+                self._publish(job, {"type": "job", **job.summary(include_frames=False)})
+                job.subscribers.clear()
+
+    def stats(self):
+        lanes = {lane: 0 for lane in LANES}
+        for job in self.jobs.values():
+            if not job.finished:
+                lanes[job.lane] += 1
+        return {
+            "pending_frames": self.pending_frames,
+            "pending_mb": round(self.pending_bytes / 2**20, 1),
+            "active_jobs": lanes,
+            "tracked_jobs": len(self.jobs),
+            "frames_processed": self.frames_processed,
+            "max_concurrency": self.max_concurrency
+        }
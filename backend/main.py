@@ -1,18 +1,117 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect, Query
+from typing import List
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-import shutil
+from fastapi import Request
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+import io
 import os
+import zipfile
 import uuid
 import json
 import asyncio
 import random
+import torch
+import numpy as np
+from PIL import Image
 from datetime import datetime
 from models.endo_l2h_wrapper import EndoL2HWrapper
 from models.galar_ml_wrapper import GalarMLWrapper
+from models.pipeline import POLICIES, POLICY_FULL, gate_policies, run_policies
+from models.frame_quality import QualityGate
+from scheduler import MicroBatchScheduler
+from worker_pool import InferencePool
+from cache import ResultCache
+from image_writer import ImageWriter
+from telemetry import TelemetryHub
+from jobs import JobQueue, LANES
+import metrics
+from metrics import stage
 import database
 
-app = FastAPI(title="Capsule Endoscopy AI API")
+# Micro-batching knobs for the /process inference scheduler
+INFERENCE_MAX_BATCH = int(os.environ.get("SMARTPILL_MAX_BATCH", 8))
+INFERENCE_MAX_WAIT_MS = float(os.environ.get("SMARTPILL_MAX_WAIT_MS", 10))
+
+# Default SR/classification policy for /process (see models/pipeline.py), overridable per request
+PIPELINE_POLICY = os.environ.get("SMARTPILL_PIPELINE_POLICY", POLICY_FULL)
+TRIAGE_THRESHOLD = float(os.environ.get("SMARTPILL_TRIAGE_THRESHOLD", 0.5))
+
+# Content-addressed result cache (set SMARTPILL_CACHE=0 to disable)
+CACHE_ENABLED = os.environ.get("SMARTPILL_CACHE", "1") != "0"
+CACHE_DIR = os.environ.get("SMARTPILL_CACHE_DIR", "cache")
+CACHE_MEMORY_ENTRIES = int(os.environ.get("SMARTPILL_CACHE_MEMORY_ENTRIES", 1024))
+CACHE_DISK_ENTRIES = int(os.environ.get("SMARTPILL_CACHE_DISK_ENTRIES", 100000))
+
+# Image persistence: raw uploads and HR results are written by a background writer.
+# SMARTPILL_HR_FORMAT is png | webp | jpeg; PNG compress level 1 is far cheaper than PIL's default 6
+PERSIST_UPLOADS = os.environ.get("SMARTPILL_PERSIST_UPLOADS", "1") != "0"
+PERSIST_HR = os.environ.get("SMARTPILL_PERSIST_HR", "1") != "0"
+HR_FORMAT = os.environ.get("SMARTPILL_HR_FORMAT", "png")
+PNG_COMPRESS_LEVEL = int(os.environ.get("SMARTPILL_PNG_COMPRESS_LEVEL", 1))
+IMAGE_QUALITY = int(os.environ.get("SMARTPILL_IMAGE_QUALITY", 90))
+# Bytes of images waiting to be written before callers write inline (~20 HR frames, a few batches)
+WRITER_QUEUE_MB = int(os.environ.get("SMARTPILL_WRITER_QUEUE_MB", 64))
+
+# Process-based inference workers (0 = run the models in the API process) and torch threads per worker
+INFERENCE_WORKERS = int(os.environ.get("SMARTPILL_INFERENCE_WORKERS", 0))
+TORCH_THREADS = int(os.environ.get("SMARTPILL_TORCH_THREADS", 0))
+
+# Warm-up: N dummy batches at each batch size before reporting ready
+WARMUP_BATCHES = int(os.environ.get("SMARTPILL_WARMUP_BATCHES", 1))
+WARMUP_BATCH_SIZES = [int(b) for b in os.environ.get("SMARTPILL_WARMUP_BATCH_SIZES", f"1,{INFERENCE_MAX_BATCH}").split(",") if b]
+
+# Background job queue (/jobs): frames processed concurrently (enough to fill scheduler batches),
+# frames allowed to wait in the queue, and finished jobs kept around for polling
+JOB_CONCURRENCY = int(os.environ.get("SMARTPILL_JOB_CONCURRENCY", 2 * INFERENCE_MAX_BATCH))
+JOB_MAX_PENDING = int(os.environ.get("SMARTPILL_JOB_MAX_PENDING", 10000))
+JOB_MAX_PENDING_MB = int(os.environ.get("SMARTPILL_JOB_MAX_PENDING_MB", 2048))
+# Upload limits, checked against zip central directories before anything is decompressed:
+# largest single frame, total uncompressed size of one job, and zip member compression ratio
+JOB_MAX_FRAME_MB = int(os.environ.get("SMARTPILL_JOB_MAX_FRAME_MB", 64))
+JOB_MAX_UPLOAD_MB = int(os.environ.get("SMARTPILL_JOB_MAX_UPLOAD_MB", 1024))
+JOB_MAX_ZIP_RATIO = float(os.environ.get("SMARTPILL_JOB_MAX_ZIP_RATIO", 200))
+JOB_RETENTION = int(os.environ.get("SMARTPILL_JOB_RETENTION", 1000))
+
+# Technical-quality gate: frames scoring below the threshold (dark, blurred, bubbles, dirt)
+# skip SR, are only classified on the raw frame and are recorded as non-diagnostic
+QUALITY_GATE = os.environ.get("SMARTPILL_QUALITY_GATE", "0") != "0"
+QUALITY_THRESHOLD = float(os.environ.get("SMARTPILL_QUALITY_THRESHOLD", 0.3))
+
+# Per-viewer telemetry queue length; slow viewers drop their oldest pending updates
+TELEMETRY_QUEUE_SIZE = int(os.environ.get("SMARTPILL_TELEMETRY_QUEUE", 8))
+
+endo_model = None
+galar_model = None
+result_cache = None
+scheduler = None
+inference_pool = None
+quality_gate = QualityGate(QUALITY_THRESHOLD) if QUALITY_GATE else None
+
+# Model lifecycle, reported by /health/ready: loading -> ready | simulated | failed (only ready/simulated serve)
+model_state = {"status": "loading", "started_at": None, "ready_at": None, "time_to_ready_s": None, "error": None}
+
+@asynccontextmanager
+async def lifespan(app):
+    # Models load in the background so uvicorn accepts connections (and answers
+    # liveness probes) immediately; readiness flips once warm-up is done
+    image_writer.start()
+    loader = asyncio.create_task(startup_models())
+    telemetry_task = asyncio.create_task(telemetry_hub.run())
+    await job_queue.start()
+    yield
+    loader.cancel()
+    telemetry_task.cancel()
+    await job_queue.stop()
+    if scheduler:
+        await scheduler.stop()
+    if inference_pool:
+        inference_pool.stop()
+    await run_in_threadpool(image_writer.stop)
+
+app = FastAPI(title="Capsule Endoscopy AI API", lifespan=lifespan)
 
 # Enable CORS for Next.js
 app.add_middleware(
@@ -28,121 +127,446 @@ RESULTS_DIR = "results"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(RESULTS_DIR, exist_ok=True)
 
+image_writer = ImageWriter(HR_FORMAT, png_compress_level=PNG_COMPRESS_LEVEL, quality=IMAGE_QUALITY,
+                           max_queue_bytes=WRITER_QUEUE_MB * 1024 * 1024)
+
 # Serve static files for results
 app.mount("/results", StaticFiles(directory=RESULTS_DIR), name="results")
 
 # Initialize models (paths should be configurable)
-try:
-    weights_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "weights")
-    endo_weights = os.path.join(weights_dir, "endol2h_v2.pth")
-    galar_weights = os.path.join(weights_dir, "galar_resnet50.pth")
+weights_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "weights")
+endo_weights = os.path.join(weights_dir, "endol2h_v2.pth")
+galar_weights = os.path.join(weights_dir, "galar_resnet50.pth")
+
+# EndoL2H runtime: torch (eager, needs lib/EndoL2H) or onnx (export with export_endol2h_onnx.py)
+ENDO_RUNTIME = os.environ.get("SMARTPILL_ENDO_RUNTIME", "torch")
+endo_onnx = os.environ.get("SMARTPILL_ENDO_ONNX", os.path.join(weights_dir, "endol2h_v2.onnx"))
+
+def model_tag(spec):
+    """Cache-key description of the model setup (runtime, SR factor, classifier arch and backend)."""
+    endo, galar = spec["endo"], spec["galar"]
+    return f"EndoL2H-{endo['runtime']}-x{endo['scale_factor']}+{galar['model_type']}-{galar['backend']}"
+
+def model_spec():
+    """Wrapper constructor arguments, used here or inside every inference pool worker."""
+    return {
+        "endo": {"model_path": endo_weights, "runtime": ENDO_RUNTIME, "onnx_path": endo_onnx, "scale_factor": 8},
+        "galar": {"model_type": "resnet50", "weights_path": galar_weights, "backend": "eager"}
+    }
+
+def load_models():
+    """Blocking model construction (torch.load, prepare_model, pretrained weights), run off the event loop."""
+    global endo_model, galar_model, result_cache
     
     # Try to load real weights if they exist in the weights folder
-    if os.path.exists(endo_weights) and os.path.exists(galar_weights):
-        endo_model = EndoL2HWrapper(endo_weights)
-        galar_model = GalarMLWrapper('resnet50', galar_weights)
-        print("Models initialized successfully with real weights")
-    else:
+    endo_file = endo_onnx if ENDO_RUNTIME == "onnx" else endo_weights
+    if not (os.path.exists(endo_file) and os.path.exists(galar_weights)):
         print("Weights not found on disk, running models in simulated mode.")
-        endo_model = None
-        galar_model = None
-except Exception as e:
-    print(f"Error loading models: {e}")
-    endo_model = None
-    galar_model = None
+        return False
+    
+    if TORCH_THREADS and not INFERENCE_WORKERS:
+        torch.set_num_threads(TORCH_THREADS)
+    
+    spec = model_spec()
+    if CACHE_ENABLED:
+        result_cache = ResultCache(CACHE_DIR, [endo_file, galar_weights], model_tag=model_tag(spec),
+                                   max_memory_entries=CACHE_MEMORY_ENTRIES, max_disk_entries=CACHE_DISK_ENTRIES)
+    if INFERENCE_WORKERS > 0:
+        # The pool workers hold the models; a set built here would be one more copy of the weights
+        return True
+    
+    endo = EndoL2HWrapper(**spec["endo"], num_threads=TORCH_THREADS or None)
+    galar = GalarMLWrapper(**spec["galar"])
+    print("Models initialized successfully with real weights")
+    
+    # Per-model forward timing by batch size (calls made in this process; pool workers are covered by "pipeline")
+    metrics.instrument(endo, "upscale_batch", "endol2h")
+    metrics.instrument(galar, "predict_batch", "galar")
+    endo_model, galar_model = endo, galar
+    return True
+
+def warm_up_models():
+    """Pays lazy-init and first-kernel costs up front so the first real request doesn't."""
+    frame = np.zeros((EndoL2HWrapper.input_size, EndoL2HWrapper.input_size, 3), dtype=np.uint8)
+    for batch_size in WARMUP_BATCH_SIZES:
+        for _ in range(WARMUP_BATCHES):
+            payloads = [(frame, POLICY_FULL)] * batch_size
+            if inference_pool:
+                # Every worker process pays its own first-kernel costs
+                futures = [inference_pool.submit(payloads, worker_id=i) for i in range(inference_pool.num_workers)]
+                for future in futures:
+                    future.result()
+            else:
+                run_models(payloads)
+    print(f"Warm-up done: {WARMUP_BATCHES} batch(es) at sizes {WARMUP_BATCH_SIZES}")
+
+async def startup_models():
+    global scheduler, inference_pool
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    model_state["started_at"] = datetime.now().isoformat()
+    try:
+        if await run_in_threadpool(load_models):
+            process_batch, concurrent_batches = run_models, 1
+            if INFERENCE_WORKERS > 0:
+                inference_pool = InferencePool(model_spec(), INFERENCE_WORKERS, TORCH_THREADS or 1, TRIAGE_THRESHOLD)
+                await run_in_threadpool(inference_pool.start)
+                process_batch, concurrent_batches = inference_pool.run_batch, INFERENCE_WORKERS
+            await run_in_threadpool(warm_up_models)
+            scheduler = MicroBatchScheduler(timed_batch(process_batch), max_batch_size=INFERENCE_MAX_BATCH,
+                                            max_wait_ms=INFERENCE_MAX_WAIT_MS, max_concurrent_batches=concurrent_batches)
+            await scheduler.start()
+            model_state["status"] = "ready"
+        else:
+            model_state["status"] = "simulated"
+    except Exception as e:
+        print(f"Error loading models: {e}")
+        model_state["status"] = "failed"
+        model_state["error"] = str(e)
+    model_state["ready_at"] = datetime.now().isoformat()
+    model_state["time_to_ready_s"] = round(loop.time() - started, 3)
+    print(f"Model startup finished ({model_state['status']}) in {model_state['time_to_ready_s']}s")
+
+def timed_batch(process_batch):
+    """Times every scheduler micro-batch end to end (in-process models or pool round trip) by batch size."""
+    if not metrics.ENABLED:
+        return process_batch
+    def run(payloads):
+        with metrics.MODEL_BATCH_SECONDS.time("pipeline", str(len(payloads))):
+            return process_batch(payloads)
+    return run
+
+def is_ready():
+    # Simulated is the no-weights dev mode; a failed load must not take traffic
+    return model_state["status"] in ("ready", "simulated")
+
+def not_ready_detail():
+    if model_state["status"] == "failed":
+        return f"Model loading failed: {model_state['error']}"
+    return "Models are still loading"
+
+def decode_frame(data):
+    """Decodes upload bytes once into the HxWx3 uint8 array every later stage works on."""
+    return np.asarray(Image.open(io.BytesIO(data)).convert('RGB'))
+
+def run_models(payloads):
+    """
+    Runs one micro-batch of (frame, policy) payloads through both models.
+    Called by the scheduler off the event loop; frames sharing a policy share a forward pass.
+    """
+    images = [image for image, _ in payloads]
+    policies = [policy for _, policy in payloads]
+    return run_policies(endo_model, galar_model, images, policies, TRIAGE_THRESHOLD, as_numpy=True)
 
 # --- TELEMETRY ENGINE ---
-async def generate_telemetry():
-    """Simulates real-time pill telemetry data."""
-    base_state = {
-        "ph": 6.5,
-        "temperature": 37.0,
-        "pressure": 1013,
-        "location": "Duodenum L2",
-        "battery": 85.0,
-        "uptime": 15120, # seconds
-        "connection_strength": 94
-    }
-    
-    while True:
-        # Add slight variation
-        base_state["ph"] = round(max(1.5, min(8.5, base_state["ph"] + random.uniform(-0.1, 0.1))), 2)
-        base_state["temperature"] = round(36.8 + random.uniform(0, 0.5), 1)
-        base_state["battery"] -= 0.01
-        base_state["uptime"] += 1
-        yield base_state
-        await asyncio.sleep(1)
+# One producer for every /ws/telemetry viewer, at the telemetry_rate setting (samples/s)
+telemetry_hub = TelemetryHub(lambda: database.get_settings().get("telemetry_rate", 1), queue_size=TELEMETRY_QUEUE_SIZE)
 
 @app.websocket("/ws/telemetry")
-async def websocket_telemetry(websocket: WebSocket):
+async def websocket_telemetry(websocket: WebSocket, rate: float = None):
+    # First message is a full snapshot, later ones only carry the fields that changed
     await websocket.accept()
+    sub = telemetry_hub.subscribe(rate)
     try:
-        async for data in generate_telemetry():
-            await websocket.send_json(data)
+        while True:
+            await websocket.send_text(await sub.next_message())
     except WebSocketDisconnect:
         print("Telemetry WebSocket disconnected")
+    finally:
+        telemetry_hub.unsubscribe(sub)
+
+@app.get("/api/telemetry/stats")
+async def telemetry_stats():
+    return telemetry_hub.stats()
 
 # --- AI PROCESSING ---
-@app.post("/process")
-async def process_image(file: UploadFile = File(...)):
-    job_id = str(uuid.uuid4())
-    ext = file.filename.split(".")[-1]
-    input_path = os.path.join(UPLOAD_DIR, f"{job_id}.{ext}")
+def quality_fields(assessment):
+    """Mission / response fields for a quality-gate assessment (nothing when the gate is off)."""
+    if assessment is None:
+        return {}
+    return {"non_diagnostic": assessment["non_diagnostic"], "quality": assessment}
+
+async def process_frame(job_id, filename, data, policy):
+    """
+    Upscale + classify + mission write for one uploaded frame, shared by /process and the job queue.
+    Files are addressed by job_id: uploads/<job_id>.<ext> and results/<job_id>_hr.<ext>.
+    """
+    ext = filename.split(".")[-1]
     
-    with open(input_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # The upload is decoded straight from memory. Decoding, the models and disk
+    # writes all run off the event loop so one slow frame doesn't stall other
+    # requests or the telemetry WebSocket
+    if PERSIST_UPLOADS:
+        with stage("persist_upload"):
+            await run_in_threadpool(image_writer.submit_bytes, os.path.join(UPLOAD_DIR, f"{job_id}.{ext}"), data)
     
-    try:
-        # Use real models
-        if endo_model and galar_model:
-            hr_img = endo_model.upscale(input_path)
-            hr_path = os.path.join(RESULTS_DIR, f"{job_id}_hr.png")
-            hr_img.save(hr_path)
-            predictions = galar_model.predict(hr_img)
-        else:
-            # Fallback if models failed to load: Dynamic simulation based on file properties to return pseudo-real random data
-            # Simulating output for the missing weights issue
-            hr_path = os.path.join(RESULTS_DIR, f"{job_id}_hr.png")
-            shutil.copyfile(input_path, hr_path)  # Bypass upscale
-            
-            # Seed random state by file size to simulate consistent pseudo-results per file
-            random.seed(os.path.getsize(input_path))
-            polyp_val = random.uniform(0.1, 0.85)
-            predictions = {
-                "stomach": random.uniform(0.6, 0.95), 
-                "small_bowel": random.uniform(0.01, 0.3), 
-                "colon": random.uniform(0.0, 0.1),
-                "polyp": polyp_val, 
-                "ulcer": random.uniform(0.01, 0.3), 
-                "blood": random.uniform(0.0, 0.1),
-                "clear": 1.0 - polyp_val, 
-                "bubbles": random.uniform(0.01, 0.15), 
-                "dirt": random.uniform(0.0, 0.1)
-            }
-            # Unseed random to allow dynamic general state
-            random.seed()
+    hr_url = None
+    cached = None
+    assessment = None
+    if scheduler:
+        with stage("decode"):
+            frame = await run_in_threadpool(decode_frame, data)
+        if quality_gate:
+            with stage("quality_gate"):
+                (policy,), (assessment,) = await run_in_threadpool(gate_policies, quality_gate, [frame], [policy])
+        if result_cache:
+            with stage("cache_lookup"):
+                cache_key = await run_in_threadpool(result_cache.key, frame, policy, TRIAGE_THRESHOLD)
+                cached = await run_in_threadpool(result_cache.get, cache_key)
+    
+    if cached:
+        # Same pixels seen before with the same models: no need to touch them
+        predictions = cached["results"]
+        hr_url = cached["image"]
+    # Use real models
+    elif scheduler:
+        # Includes the wait for a micro-batch slot; pure model time is in smartpill_model_batch_seconds
+        with stage("inference"):
+            hr_img, predictions = await scheduler.submit((frame, policy))
+        entry = {"results": predictions, "image": None, "hr_path": None}
+        if PERSIST_HR:
+            hr_name = f"{job_id}_hr.{image_writer.ext}"
+            hr_url = f"/results/{hr_name}"
+            entry.update(image=hr_url, hr_path=os.path.join(RESULTS_DIR, hr_name))
+            # Cached only once the HR file exists, so a hit never points at a missing or half-written image
+            on_written = (lambda: result_cache.put(cache_key, entry)) if result_cache else None
+            # When the policy skipped SR for this frame, serve the raw frame instead
+            with stage("persist_hr"):
+                await run_in_threadpool(image_writer.submit, entry["hr_path"], hr_img if hr_img is not None else frame, on_written)
+        elif result_cache:
+            with stage("cache_store"):
+                await run_in_threadpool(result_cache.put, cache_key, entry)
+    else:
+        # Fallback if models failed to load: Dynamic simulation based on file properties to return pseudo-real random data
+        # Simulating output for the missing weights issue
+        if PERSIST_HR:
+            hr_name = f"{job_id}_hr.{ext}"
+            await run_in_threadpool(image_writer.submit_bytes, os.path.join(RESULTS_DIR, hr_name), data)  # Bypass upscale
+            hr_url = f"/results/{hr_name}"
         
-        # Save to mission history
-        database.add_mission({
+        # Seed random state by file size to simulate consistent pseudo-results per file
+        random.seed(len(data))
+        polyp_val = random.uniform(0.1, 0.85)
+        predictions = {
+            "stomach": random.uniform(0.6, 0.95), 
+            "small_bowel": random.uniform(0.01, 0.3), 
+            "colon": random.uniform(0.0, 0.1),
+            "polyp": polyp_val, 
+            "ulcer": random.uniform(0.01, 0.3), 
+            "blood": random.uniform(0.0, 0.1),
+            "clear": 1.0 - polyp_val, 
+            "bubbles": random.uniform(0.01, 0.15), 
+            "dirt": random.uniform(0.0, 0.1)
+        }
+        # Unseed random to allow dynamic general state
+        random.seed()
+    
+    # Save to mission history
+    with stage("mission_write"):
+        await run_in_threadpool(database.add_mission, {
             "type": "AI_ANALYSIS",
-            "source": file.filename,
+            "source": filename,
             "results": predictions,
-            "image": f"/results/{job_id}_hr.png"
+            "image": hr_url,
+            "policy": policy,
+            **quality_fields(assessment)
         })
-        
-        return {
-            "job_id": job_id,
-            "status": "success",
-            "results": predictions,
-            "hr_image_url": f"/results/{job_id}_hr.png"
-        }
+    
+    return {
+        "job_id": job_id,
+        "status": "success",
+        "results": predictions,
+        "hr_image_url": hr_url,
+        "cached": bool(cached),
+        **quality_fields(assessment)
+    }
+
+@app.post("/process")
+async def process_image(file: UploadFile = File(...), policy: str = Query(None)):
+    policy = policy or PIPELINE_POLICY
+    if policy not in POLICIES:
+        raise HTTPException(status_code=400, detail=f"Unknown policy '{policy}', expected one of {POLICIES}")
+    if not is_ready():
+        raise HTTPException(status_code=503, detail=not_ready_detail())
+    
+    with stage("upload_read"):
+        data = await file.read()
+    try:
+        return await process_frame(str(uuid.uuid4()), file.filename, data, policy)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- JOBS ---
+job_queue = JobQueue(process_frame, max_concurrency=JOB_CONCURRENCY, max_pending_frames=JOB_MAX_PENDING, max_jobs=JOB_RETENTION,
+                     max_pending_bytes=JOB_MAX_PENDING_MB * 1024 * 1024)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp")
+
+class UploadTooLarge(ValueError):
+    pass
+
+def unpack_uploads(uploads, max_frames=JOB_MAX_PENDING, max_frame_bytes=JOB_MAX_FRAME_MB * 1024 * 1024,
+                   max_total_bytes=JOB_MAX_UPLOAD_MB * 1024 * 1024, max_ratio=JOB_MAX_ZIP_RATIO):
+    """
+    (filename, file object) uploads -> (filename, bytes) frames, with .zip uploads expanded to their
+    image members in name order. Zip members are admitted from the central directory (count, declared
+    size, compression ratio) before any of them is read; zipfile never inflates past the declared size.
+    Raises UploadTooLarge when a limit is exceeded.
+    """
+    frames = []
+    count, total = 0, 0
+
+    def admit(name, size, compressed=None):
+        nonlocal count, total
+        count += 1
+        total += size
+        if count > max_frames:
+            raise UploadTooLarge(f"More than {max_frames} frames in upload")
+        if size > max_frame_bytes:
+            raise UploadTooLarge(f"'{name}' exceeds {max_frame_bytes // 2**20} MB")
+        if total > max_total_bytes:
+            raise UploadTooLarge(f"Upload exceeds {max_total_bytes // 2**20} MB uncompressed")
+        if compressed is not None and size > max_ratio * max(compressed, 1):
+            raise UploadTooLarge(f"'{name}' compression ratio exceeds {max_ratio:g}")
+
+    for filename, fileobj in uploads:
+        if not filename.lower().endswith(".zip"):
+            data = fileobj.read(max_frame_bytes + 1)
+            admit(filename, len(data))
+            frames.append((filename, data))
+            continue
+        with zipfile.ZipFile(fileobj) as zf:
+            members = sorted((m for m in zf.infolist()
+                              if m.filename.lower().endswith(IMAGE_EXTENSIONS) and not m.filename.startswith("__MACOSX/")),
+                             key=lambda m: m.filename)
+            for m in members:
+                admit(m.filename, m.file_size, m.compress_size)
+            frames.extend((os.path.basename(m.filename), zf.read(m)) for m in members)
+    return frames
+
+@app.post("/jobs", status_code=202)
+async def submit_job(files: List[UploadFile] = File(...), policy: str = Query(None), priority: str = Query(None)):
+    """
+    Queues one or many frames (multipart batch and/or zip of a study) and returns at once.
+    Poll /jobs/{job_id} or subscribe to /ws/jobs/{job_id} for per-frame results.
+    priority: interactive | bulk (default: interactive for a single frame, bulk otherwise).
+    """
+    policy = policy or PIPELINE_POLICY
+    if policy not in POLICIES:
+        raise HTTPException(status_code=400, detail=f"Unknown policy '{policy}', expected one of {POLICIES}")
+    if priority is not None and priority not in LANES:
+        raise HTTPException(status_code=400, detail=f"Unknown priority '{priority}', expected one of {list(LANES)}")
+    if not is_ready():
+        raise HTTPException(status_code=503, detail=not_ready_detail())
+    
+    # UploadFile spools large bodies to disk; zips are opened from there, not copied into memory
+    uploads = [(f.filename, f.file) for f in files]
+    try:
+        frames = await run_in_threadpool(unpack_uploads, uploads)
+    except zipfile.BadZipFile as e:
+        raise HTTPException(status_code=400, detail=f"Invalid zip upload: {e}")
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if not frames:
+        raise HTTPException(status_code=400, detail="No image frames in upload")
+    try:
+        job = job_queue.submit(frames, policy, priority)
+    except OverflowError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    
+    summary = job.summary(include_frames=False)
+    summary["frames"] = [{"index": f["index"], "job_id": f["job_id"], "filename": f["filename"]} for f in job.frames]
+    return summary
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, include_frames: bool = True):
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.summary(include_frames)
+
+@app.websocket("/ws/jobs/{job_id}")
+async def websocket_job(websocket: WebSocket, job_id: str):
+    """Streams {"type": "frame", ...} per finished frame, then a final {"type": "job", ...} and closes."""
+    await websocket.accept()
+    job = job_queue.get(job_id)
+    if not job:
+        await websocket.close(code=4404)
+        return
+    events = job_queue.subscribe(job)
+    try:
+        while True:
+            event = await events.get()
+            await websocket.send_json(event)
+            if event["type"] == "job":
+                break
+        await websocket.close()
+    except WebSocketDisconnect:
+        print(f"Job WebSocket for {job_id} disconnected")
+    finally:
+        job_queue.unsubscribe(job, events)
+
+@app.get("/api/jobs/stats")
+async def job_stats():
+    return job_queue.stats()
+
+@app.get("/api/quality/stats")
+async def quality_stats():
+    if not quality_gate:
+        return {"enabled": False}
+    return {"enabled": True, **quality_gate.stats()}
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    if not result_cache:
+        return {"enabled": False}
+    return {"enabled": True, **result_cache.stats()}
+
 # --- MISSIONS & PATIENTS ---
+def mission_filters(type, source, since, until, finding, min_prob):
+    return {"mission_type": type, "source": source, "since": since, "until": until,
+            "finding": finding, "min_prob": min_prob}
+
+def project(mission, fields):
+    return {k: mission[k] for k in fields if k in mission} if fields else mission
+
 @app.get("/api/missions")
-async def get_missions():
-    return database.get_missions()
+def get_missions(limit: int = Query(50, ge=1, le=1000), cursor: str = None, type: str = None, source: str = None,
+                 since: str = None, until: str = None, finding: str = None, min_prob: float = None,
+                 fields: str = None, include_total: bool = False):
+    """
+    One page of mission history, newest first. Pass `next_cursor` back as `cursor`
+    for the next page; `fields` is a comma separated projection (e.g. id,timestamp,type).
+    """
+    filters = mission_filters(type, source, since, until, finding, min_prob)
+    field_list = [f for f in fields.split(",") if f] if fields else None
+    try:
+        missions, next_cursor = database.query_missions(limit, cursor, **filters)
+        page = {"items": [project(m, field_list) for m in missions], "next_cursor": next_cursor}
+        if include_total:
+            page["total"] = database.count_missions(**filters)
+        return page
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/missions/export")
+def export_missions(type: str = None, source: str = None, since: str = None, until: str = None,
+                    finding: str = None, min_prob: float = None, fields: str = None):
+    """Streams every matching mission as NDJSON, serialized row by row."""
+    filters = mission_filters(type, source, since, until, finding, min_prob)
+    field_list = [f for f in fields.split(",") if f] if fields else None
+    # Validated up front: once streaming has started the status code can't change
+    try:
+        database.check_mission_filters(**filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    def rows():
+        for mission in database.iter_missions(**filters):
+            yield json.dumps(project(mission, field_list)) + "\n"
+    
+    return StreamingResponse(rows(), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": "attachment; filename=missions.ndjson"})
 
 @app.get("/api/patients")
 async def get_patients():
@@ -163,9 +587,84 @@ async def get_settings():
 async def update_settings(data: dict):
     return database.update_settings(data)
 
+# --- METRICS ---
+# Sampling profiler, toggled per request with an "X-SmartPill-Profile: 1" header when SMARTPILL_PROFILING=1
+PROFILING = os.environ.get("SMARTPILL_PROFILING", "0") != "0"
+PROFILE_DIR = os.environ.get("SMARTPILL_PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.environ.get("SMARTPILL_PROFILE_INTERVAL_MS", 5))
+
+metrics.Gauge("smartpill_scheduler_queue_depth", "Frames waiting for a micro-batch",
+              callback=lambda: scheduler.queue_depth if scheduler else 0)
+metrics.Gauge("smartpill_scheduler_mean_batch_size", "Mean micro-batch size so far",
+              callback=lambda: scheduler.mean_batch_size if scheduler else 0)
+metrics.Gauge("smartpill_job_queue_pending_frames", "Frames queued in the /jobs executor",
+              callback=lambda: job_queue.pending_frames)
+metrics.Gauge("smartpill_job_queue_pending_bytes", "Bytes of uploads queued in the /jobs executor",
+              callback=lambda: job_queue.pending_bytes)
+metrics.Gauge("smartpill_image_writer_queue_depth", "Images waiting to be encoded and written",
+              callback=lambda: image_writer.queue_depth)
+metrics.Gauge("smartpill_image_writer_queue_bytes", "Bytes of images waiting to be encoded and written",
+              callback=lambda: image_writer.queued_bytes)
+metrics.Gauge("smartpill_inference_workers_busy", "Inference worker processes currently running a batch",
+              callback=lambda: sum(w["busy"] for w in inference_pool.stats()) if inference_pool else None)
+metrics.Gauge("smartpill_telemetry_subscribers", "Connected /ws/telemetry viewers",
+              callback=lambda: len(telemetry_hub.subscribers))
+metrics.Counter("smartpill_cache_lookups_total", "Result cache lookups by outcome", ["result"],
+              callback=lambda: {("memory_hit",): result_cache.memory_hits, ("disk_hit",): result_cache.disk_hits,
+                                ("miss",): result_cache.misses} if result_cache else None)
+metrics.Gauge("smartpill_cache_hit_rate", "Result cache hit rate",
+              callback=lambda: result_cache.stats()["hit_rate"] if result_cache else None)
+
+if metrics.ENABLED:
+    @app.middleware("http")
+    async def instrument_requests(request: Request, call_next):
+        profiler = None
+        if PROFILING and request.headers.get("x-smartpill-profile") == "1":
+            profiler = metrics.SamplingProfiler(PROFILE_INTERVAL_MS / 1000.0).start()
+        metrics.IN_FLIGHT.inc()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            metrics.IN_FLIGHT.dec()
+            # Route template, not the raw path, so /jobs/{job_id} stays one series
+            route = request.scope.get("route")
+            metrics.REQUESTS_TOTAL.inc(getattr(route, "path", "unmatched"), str(status))
+            if profiler:
+                profiler.stop()
+        if profiler:
+            name = f"{datetime.now():%Y%m%d_%H%M%S_%f}_{request.url.path.strip('/').replace('/', '_') or 'root'}.folded"
+            response.headers["X-SmartPill-Profile-File"] = await run_in_threadpool(profiler.dump, os.path.join(PROFILE_DIR, name))
+        return response
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 def health():
-    return {"status": "healthy"}
+    return {"status": "healthy", "models": model_state}
+
+@app.get("/health/workers")
+def worker_health():
+    return {
+        "mode": "process_pool" if inference_pool else "in_process",
+        "scheduler_queue_depth": scheduler.queue_depth if scheduler else 0,
+        "mean_batch_size": round(scheduler.mean_batch_size, 2) if scheduler else 0.0,
+        "workers": inference_pool.stats() if inference_pool else []
+    }
+
+@app.get("/health/live")
+def liveness():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+def readiness():
+    if not is_ready():
+        return JSONResponse(status_code=503, content={"status": model_state["status"], "detail": not_ready_detail(),
+                                                      "models": model_state})
+    return {"status": "ready", "models": model_state}
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,244 @@
+"""
+Hot-path instrumentation for the backend: per-stage latency histograms, counters and
+gauges rendered in the Prometheus text exposition format for /metrics, plus an
+opt-in sampling profiler that writes flame-graph "folded stack" files.
+
+Everything is a no-op when SMARTPILL_METRICS=0: `stage()` hands back a shared
+null context and `observe()` returns immediately, so the cost is one attribute check.
+"""
+import collections
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+ENABLED = os.environ.get("SMARTPILL_METRICS", "1") != "0"
+
+# Latency buckets in seconds: sub-ms bookkeeping up to multi-second 8x SR batches
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_REGISTRY = []
+
+def _label_str(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, values)) + "}"
+
+def _fmt(value):
+    return repr(float(value))
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        if not ENABLED:
+            return
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels) if ENABLED else _NULL
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_str(self.labelnames + ('le',), labels + (_fmt(bound),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_str(self.labelnames + ('le',), labels + ('+Inf',))} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_str(self.labelnames, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{_label_str(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+def _read_callback(callback):
+    """Scrape-time value of a callback metric as {label tuple: number}, or None to skip the metric."""
+    try:
+        value = callback()
+    except Exception:
+        return None
+    if value is None:
+        return None
+    return value if isinstance(value, dict) else {(): value}
+
+
+class Counter:
+    """A counter incremented in place, or read from `callback()` at scrape time (a running total kept elsewhere)."""
+
+    def __init__(self, name, help, labelnames=(), callback=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._values = collections.Counter()
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        if self.callback is not None:
+            values = _read_callback(self.callback)
+            if values is None:
+                return []
+            items = list(values.items())
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        lines += [f"{self.name}{_label_str(self.labelnames, labels)} {value}" for labels, value in items]
+        return lines
+
+
+class Gauge:
+    """A settable gauge, or one read from `callback()` at scrape time (returns a number or {label tuple: number})."""
+
+    def __init__(self, name, help, labelnames=(), callback=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._values = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if self.callback is not None:
+            values = _read_callback(self.callback)
+            if values is None:
+                return []
+        else:
+            with self._lock:
+                values = dict(self._values)
+        lines += [f"{self.name}{_label_str(self.labelnames, labels)} {v}" for labels, v in values.items()]
+        return lines
+
+
+class _Timer:
+    __slots__ = ("metric", "labels", "start")
+
+    def __init__(self, metric, labels):
+        self.metric = metric
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metric.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+_NULL = nullcontext()
+
+# --- BACKEND METRICS ---
+STAGE_SECONDS = Histogram("smartpill_stage_seconds", "Latency of each request-path stage (/process, jobs, background image writes)", ["stage"])
+MODEL_BATCH_SECONDS = Histogram("smartpill_model_batch_seconds", "Model forward time per micro-batch", ["model", "batch_size"])
+REQUESTS_TOTAL = Counter("smartpill_requests_total", "HTTP requests served", ["path", "status"])
+IN_FLIGHT = Gauge("smartpill_requests_in_flight", "HTTP requests currently being handled")
+
+def stage(name):
+    """`with stage("decode"): ...` records the block's latency under smartpill_stage_seconds{stage=name}."""
+    return STAGE_SECONDS.time(name) if ENABLED else _NULL
+
+def instrument(obj, method, model):
+    """
+    Wraps obj.method (which takes a list of frames first) so each call is timed under
+    smartpill_model_batch_seconds{model, batch_size}. Only calls made in this process are seen.
+    """
+    if not ENABLED:
+        return
+    inner = getattr(obj, method)
+
+    def timed(images, *args, **kwargs):
+        images = list(images)
+        with MODEL_BATCH_SECONDS.time(model, str(len(images))):
+            return inner(images, *args, **kwargs)
+    setattr(obj, method, timed)
+
+def render():
+    lines = []
+    for metric in _REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# --- SAMPLING PROFILER ---
+class SamplingProfiler:
+    """
+    Samples the Python stacks of every thread (requests run partly on the event loop,
+    partly in threadpool / scheduler threads) every `interval` seconds while active and
+    writes them in the folded format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True, name="sampling-profiler")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def dump(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
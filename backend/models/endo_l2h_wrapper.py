@@ -1,84 +1,376 @@
 import torch
 import sys
 import os
+import threading
+import numpy as np
 from PIL import Image
 import torchvision.transforms as transforms
+import torch.nn.functional as F
+from .pipeline import chunks
 
 # Add EndoL2H to path - robustly find the project root from backend/models/
 backend_models_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.abspath(os.path.join(backend_models_dir, '..', '..'))
 lib_path = os.path.join(project_root, 'lib', 'EndoL2H')
 
-if os.path.exists(lib_path):
-    sys.path.append(lib_path)
+_define_G = None
+
+def load_define_G():
+    """
+    Imports define_G from the vendored lib/EndoL2H on first use, so serving nodes
+    running the ONNX Runtime mode never pay for (or need) the import.
+    """
+    global _define_G
+    if _define_G is not None:
+        return _define_G
+    if not os.path.exists(lib_path):
+        print(f"Warning: EndoL2H lib path not found at {lib_path}")
+        return None
+    if lib_path not in sys.path:
+        sys.path.append(lib_path)
     try:
         from models.networks import define_G
     except ImportError:
         print(f"Warning: Could not import models.networks from {lib_path}")
-        define_G = None
-else:
-    print(f"Warning: EndoL2H lib path not found at {lib_path}")
-    define_G = None
+        return None
+    _define_G = define_G
+    return _define_G
+
+def load_generator_state(model_path, device='cpu'):
+    """Reads an EndoL2H checkpoint into a plain state_dict, with DataParallel 'module.' prefixes stripped."""
+    state_dict = torch.load(model_path, map_location=device)
+    if hasattr(state_dict, '_metadata'):
+        del state_dict._metadata
+    
+    # Fix for DataParallel if saved with it
+    from collections import OrderedDict
+    new_state_dict = OrderedDict()
+    for k, v in state_dict.items():
+        name = k[7:] if k.startswith('module.') else k
+        new_state_dict[name] = v
+    return new_state_dict
+
+def build_generator(model_path, gpu_ids=[], device='cpu', state_dict=None, strict=False):
+    """
+    Builds the EndoL2H UNet-256 generator and loads `model_path` into it. Returns None in dummy mode.
+    A preloaded `state_dict` (the inference pool's shared-memory tensors) is used instead of the
+    file and, on CPU, assigned into the network rather than copied, so its pages stay shared.
+    With `strict`, a missing weights file raises FileNotFoundError instead of leaving the network untrained.
+    """
+    if strict and state_dict is None and not (model_path and os.path.exists(model_path)):
+        raise FileNotFoundError(f"EndoL2H weights not found at {model_path}")
+    define_G = load_define_G()
+    if not define_G:
+        return None
+    
+    # Standard EndoL2H params: unet_256, instance norm, no dropout. 
+    # Note: Actual netG args might differ based on repo fork, assuming standard matching
+    netG = define_G(3, 3, 64, 'unet_256', norm='instance', use_dropout=False, gpu_ids=gpu_ids)
+    
+    if state_dict is not None:
+        netG.load_state_dict(state_dict, assign=torch.device(device).type == 'cpu')
+    # Load weights (like GalarMLWrapper, a missing file leaves the network untrained,
+    # which is still useful for benchmarking the compute path offline)
+    elif model_path and os.path.exists(model_path):
+        netG.load_state_dict(load_generator_state(model_path, device))
+    else:
+        print(f"Warning: EndoL2H weights not found at {model_path}, generator is untrained.")
+    netG.eval()
+    return netG
+
+class OnnxGenerator:
+    """
+    ONNX Runtime execution of an exported EndoL2H generator (see export_endol2h_onnx.py).
+    Input/output buffers are preallocated per input shape and bound once with IO binding,
+    so a forward pass is a copy into the input buffer plus run_with_iobinding. Bindings
+    are per thread: the session itself is thread-safe, the buffers are not.
+    """
+
+    def __init__(self, onnx_path, num_threads=None):
+        import onnxruntime as ort
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_name = self.session.get_outputs()[0].name
+        # Current exports have dynamic batch/height/width; older ones only a dynamic batch
+        spatial = self.session.get_inputs()[0].shape[2:]
+        self.fixed_size = tuple(spatial) if all(isinstance(d, int) for d in spatial) else None
+        self._local = threading.local()
+
+    def _binding_for(self, batch):
+        bindings = getattr(self._local, "bindings", None)
+        if bindings is None:
+            bindings = self._local.bindings = {}  # input shape -> (binding, input buffer, output buffer)
+        shape = batch.shape
+        if shape not in bindings:
+            if self.fixed_size is not None and shape[2:] != self.fixed_size:
+                raise ValueError(f"This ONNX export only accepts {self.fixed_size[0]}x{self.fixed_size[1]} inputs, "
+                                 f"got {shape[2]}x{shape[3]} (re-export with export_endol2h_onnx.py for dynamic sizes)")
+            # The output size of a dynamic export is only known after a run, so the first
+            # call for a shape goes through session.run and sizes the buffers from its result
+            out = self.session.run([self.output_name], {self.input_name: batch})[0]
+            inp = np.empty(shape, dtype=np.float32)
+            binding = self.session.io_binding()
+            binding.bind_cpu_input(self.input_name, inp)
+            binding.bind_output(self.output_name, 'cpu', 0, np.float32, list(out.shape), out.ctypes.data)
+            bindings[shape] = (binding, inp, out)
+            return None, out
+        return bindings[shape], None
+
+    def __call__(self, batch_t):
+        batch = np.ascontiguousarray(batch_t.cpu().numpy(), dtype=np.float32)
+        bound, first = self._binding_for(batch)
+        if first is not None:
+            return torch.from_numpy(first.copy())
+        binding, inp, out = bound
+        np.copyto(inp, batch)
+        self.session.run_with_iobinding(binding)
+        # Copy out: the buffer is reused by this thread's next call of the same shape
+        return torch.from_numpy(out.copy())
+
+def _to_pil(image):
+    """Accepts a file path, a PIL image or an HxWx3 uint8 NumPy array."""
+    if isinstance(image, str):
+        return Image.open(image).convert('RGB')
+    if isinstance(image, np.ndarray):
+        return Image.fromarray(image).convert('RGB')
+    return image.convert('RGB')
 
 class EndoL2HWrapper:
-    def __init__(self, model_path, gpu_ids=[0] if torch.cuda.is_available() else [], scale_factor=8):
-        self.device = torch.device(f'cuda:{gpu_ids[0]}' if gpu_ids else 'cpu')
+    # The EndoL2H paper says LR inputs are 128x128 and sizes up to 1024x1024 for 8x
+    input_size = 128
+    
+    def __init__(self, model_path, gpu_ids=[0] if torch.cuda.is_available() else [], scale_factor=8, batch_size=8,
+                 runtime='torch', onnx_path=None, num_threads=None, state_dict=None):
         self.scale_factor = scale_factor
+        self.batch_size = batch_size
+        self.runtime = runtime
+        self.ort_generator = None
+        self._activation_bytes = {}  # tile size -> probed working set, see _tile_activation_bytes
         
-        # Standard EndoL2H params: unet_256, instance norm, no dropout. 
-        # Note: Actual netG args might differ based on repo fork, assuming standard matching
-        if define_G:
-            self.netG = define_G(3, 3, 64, 'unet_256', norm='instance', use_dropout=False, gpu_ids=gpu_ids)
-            
-            # Load weights
-            state_dict = torch.load(model_path, map_location=self.device)
-            if hasattr(state_dict, '_metadata'):
-                del state_dict._metadata
-            
-            # Fix for DataParallel if saved with it
-            from collections import OrderedDict
-            new_state_dict = OrderedDict()
-            for k, v in state_dict.items():
-                name = k[7:] if k.startswith('module.') else k
-                new_state_dict[name] = v
-                
-            self.netG.load_state_dict(new_state_dict)
-            self.netG.eval()
-        else:
+        if runtime == 'onnx':
+            # ONNX Runtime on CPU; the PyTorch generator and lib/EndoL2H are never loaded
+            self.device = torch.device('cpu')
             self.netG = None
-            print("Running EndoL2HWrapper in dummy mode since 'define_G' is missing.")
+            self.ort_generator = OnnxGenerator(onnx_path, num_threads)
+        elif runtime == 'torch':
+            self.device = torch.device(f'cuda:{gpu_ids[0]}' if gpu_ids else 'cpu')
+            self.netG = build_generator(model_path, gpu_ids, self.device, state_dict)
+            if self.netG is None:
+                print("Running EndoL2HWrapper in dummy mode since 'define_G' is missing.")
+        else:
+            raise ValueError(f"Unknown runtime '{runtime}', expected 'torch' or 'onnx'")
         
-        # The EndoL2H paper says LR inputs are 128x128 and sizes up to 1024x1024 for 8x
-        self.input_size = 128
         self.transform = transforms.Compose([
             transforms.Resize((self.input_size, self.input_size)),
             transforms.ToTensor(),
             transforms.Normalize((0.5, 0.5, 0.5), (0.5, 0.5, 0.5))
         ])
 
-    def upscale(self, image_path):
-        img = Image.open(image_path).convert('RGB')
-        img_t = self.transform(img).unsqueeze(0).to(self.device)
+    def upscale(self, image_path, output_size=None, as_numpy=False):
+        return self.upscale_batch([image_path], batch_size=1, output_size=output_size, as_numpy=as_numpy)[0]
+
+    def upscale_batch(self, images, batch_size=None, output_size=None, as_numpy=False):
+        """
+        Upscales a list (or any iterable) of paths, PIL images or NumPy arrays.
+        Inputs are stacked into tensors of `batch_size` so the forward pass and
+        the transform overhead are amortized. Results are returned in input order.
+        `output_size` renders the result directly at that size instead of
+        input_size * scale_factor (e.g. the classifier's input resolution).
+        `as_numpy` returns HxWx3 uint8 arrays instead of PIL images.
+        """
+        return list(self.iter_upscale(images, batch_size, output_size, as_numpy))
+
+    @property
+    def has_generator(self):
+        return self.netG is not None or self.ort_generator is not None
+
+    def _generate(self, batch_t):
+        if self.ort_generator:
+            return self.ort_generator(batch_t)
+        with torch.no_grad():
+            return self.netG(batch_t)
+
+    def _preprocess(self, image):
+        # Every input type goes through the same PIL resize, so a frame gives the same
+        # tensor (and predictions) whether it arrives as a path, a PIL image or an array
+        return self.transform(_to_pil(image))
+
+    def _resize_output(self, output, target_size):
+        # output: B x 3 x h x w in [0, 1]
+        if output.shape[-2:] != (target_size, target_size):
+            output = F.interpolate(output, size=(target_size, target_size), mode='bicubic', align_corners=False)
+        return output.clamp_(0, 1)
+
+    def _to_outputs(self, output, as_numpy):
+        arrays = output.mul(255).round_().to(torch.uint8).permute(0, 2, 3, 1).numpy()
+        return list(arrays) if as_numpy else [Image.fromarray(a) for a in arrays]
+
+    def iter_upscale(self, images, batch_size=None, output_size=None, as_numpy=False):
+        """Streaming variant of `upscale_batch`: yields HR images one by one."""
+        batch_size = batch_size or self.batch_size
+        target_size = output_size or self.input_size * self.scale_factor
         
-        if self.netG:
-            with torch.no_grad():
-                output = self.netG(img_t)
+        for chunk in chunks(images, batch_size):
+            if not self.has_generator:
+                # Dummy upscale if lib not found
+                for img in chunk:
+                    hr_img = _to_pil(img).resize((target_size, target_size), Image.BICUBIC)
+                    yield np.asarray(hr_img) if as_numpy else hr_img
+                continue
+            
+            batch_t = torch.stack([self._preprocess(img) for img in chunk]).to(self.device)
+            output = self._generate(batch_t)
             
             # Denormalize
-            output = (output.squeeze(0).cpu() + 1) / 2.0
-            output_img = transforms.ToPILImage()(output)
+            output = (output.cpu() + 1) / 2.0
             
             # If the network architecture doesn't natively scale by the scale_factor, 
             # we manually resize the output to the target HR resolution as a fallback/guarantee.
-            target_size = self.input_size * self.scale_factor
-            if output_img.size != (target_size, target_size):
-                output_img = output_img.resize((target_size, target_size), Image.BICUBIC)
-                
-            return output_img
-        else:
-            # Dummy upscale if lib not found
-            target_size = self.input_size * self.scale_factor
-            return img.resize((target_size, target_size), Image.BICUBIC)
+            # Done on the whole batch tensor rather than per PIL image.
+            yield from self._to_outputs(self._resize_output(output, target_size), as_numpy)
+
+    # --- TILED SUPER-RESOLUTION ---
+    # Fallback activation bytes per input-tile byte, used only when the generator can't be
+    # probed (ONNX Runtime). Not a measurement: a deliberately generous allowance for a
+    # pix2pix-style UNet, whose skip connections keep every encoder activation alive.
+    FALLBACK_ACTIVATION_FACTOR = 200
+
+    def _tile_activation_bytes(self, tile_size):
+        """
+        Working set of one tile through the generator: the summed sizes of every leaf
+        module's output for a single probe tile (an upper bound on what is live at once,
+        since no_grad frees intermediates). Measured once per tile size.
+        """
+        cache = self._activation_bytes
+        if tile_size not in cache:
+            if self.netG is None:
+                cache[tile_size] = tile_size * tile_size * 3 * 4 * self.FALLBACK_ACTIVATION_FACTOR
+            else:
+                total = [0]
+                def count(module, inputs, output):
+                    if torch.is_tensor(output):
+                        total[0] += output.numel() * output.element_size()
+                hooks = [m.register_forward_hook(count) for m in self.netG.modules() if not list(m.children())]
+                try:
+                    self._generate(torch.zeros(1, 3, tile_size, tile_size, device=self.device))
+                finally:
+                    for h in hooks:
+                        h.remove()
+                cache[tile_size] = total[0]
+        return cache[tile_size]
+
+    def _tile_batch_size(self, tile_size, scale, strip_bytes, max_memory_mb):
+        tile_bytes = self._tile_activation_bytes(tile_size) + (tile_size * scale) ** 2 * 3 * 4 * 2
+        budget = max_memory_mb * 1024 * 1024 - strip_bytes
+        if budget < tile_bytes:
+            print(f"Warning: max_memory_mb={max_memory_mb} is below one tile + output strip, running one tile at a time.")
+            return 1
+        return int(budget // tile_bytes)
+
+    def _upscale_tiles(self, tiles, out_size):
+        """tiles: B x 3 x t x t float tensor in [0, 1] -> B x 3 x out x out in [0, 1]."""
+        if not self.has_generator:
+            return self._resize_output(tiles, out_size)
+        output = self._generate(tiles.sub(0.5).div_(0.5).to(self.device))
+        return self._resize_output((output.cpu() + 1) / 2.0, out_size)
+
+    @staticmethod
+    def _tile_positions(length, tile_size, stride):
+        positions = list(range(0, max(length - tile_size, 0) + 1, stride))
+        if positions[-1] + tile_size < length:
+            positions.append(length - tile_size)
+        return positions
+
+    def iter_tiled_rows(self, image, tile_size=None, overlap=16, scale_factor=None, max_memory_mb=1024):
+        """
+        Tiled super-resolution at the image's native resolution. The input is split
+        into overlapping tiles, each row of tiles is run through the generator in
+        memory-capped batches, and seams are blended with a feathered weight ramp
+        across the overlap. Yields (hr_y, strip) pairs, where strip is an
+        h x (W * scale) x 3 uint8 array of finished output rows, top to bottom,
+        so callers can write the result row by row.
+        """
+        tile_size = tile_size or self.input_size
+        scale = scale_factor or self.scale_factor
+        if not 0 <= overlap < tile_size:
+            raise ValueError("overlap must be smaller than tile_size")
+        fixed = self.ort_generator.fixed_size if self.ort_generator else None
+        if fixed is not None and fixed != (tile_size, tile_size):
+            raise ValueError(f"The loaded ONNX export is fixed at {fixed[0]}x{fixed[1]}, so tile_size must be {fixed[0]}")
+        stride = tile_size - overlap
+        
+        arr = np.asarray(_to_pil(image)) if not isinstance(image, np.ndarray) else image[..., :3]
+        height, width = arr.shape[:2]
+        # Inputs smaller than one tile are reflect-padded and cropped again on output
+        pad_h, pad_w = max(tile_size - height, 0), max(tile_size - width, 0)
+        if pad_h or pad_w:
+            arr = np.pad(arr, ((0, pad_h), (0, pad_w), (0, 0)), mode='reflect' if min(height, width) > 1 else 'edge')
+        src = torch.from_numpy(np.ascontiguousarray(arr)).permute(2, 0, 1).float().div_(255.0)
+        
+        ys = self._tile_positions(src.shape[1], tile_size, stride)
+        xs = self._tile_positions(src.shape[2], tile_size, stride)
+        out_tile = tile_size * scale
+        out_w = src.shape[2] * scale
+        
+        # Feathered blending weights: linear ramp over the overlap, never zero so
+        # image borders covered by a single tile normalize cleanly
+        ramp_len = max(overlap * scale, 1)
+        idx = torch.arange(out_tile, dtype=torch.float32)
+        ramp = torch.minimum(torch.minimum((idx + 1) / ramp_len, (out_tile - idx) / ramp_len), torch.ones(1))
+        weight = (ramp[:, None] * ramp[None, :])[None]
+        
+        strip_bytes = out_tile * out_w * 4 * 4  # accumulator + weight sum
+        batch_size = self._tile_batch_size(tile_size, scale, strip_bytes, max_memory_mb)
+        
+        acc = torch.zeros(3, 0, out_w)
+        wsum = torch.zeros(1, 0, out_w)
+        origin = 0  # HR row of acc[:, 0]
+        
+        for row, y in enumerate(ys):
+            hr_y = y * scale
+            grow = hr_y + out_tile - origin - acc.shape[1]
+            if grow > 0:
+                acc = torch.cat([acc, torch.zeros(3, grow, out_w)], dim=1)
+                wsum = torch.cat([wsum, torch.zeros(1, grow, out_w)], dim=1)
+            
+            for i in range(0, len(xs), batch_size):
+                row_xs = xs[i:i + batch_size]
+                tiles = torch.stack([src[:, y:y + tile_size, x:x + tile_size] for x in row_xs])
+                for x, out in zip(row_xs, self._upscale_tiles(tiles, out_tile)):
+                    top, left = hr_y - origin, x * scale
+                    acc[:, top:top + out_tile, left:left + out_tile] += out * weight
+                    wsum[:, top:top + out_tile, left:left + out_tile] += weight
+            
+            # Rows above the next tile row's start can't receive more contributions
+            final_end = ys[row + 1] * scale if row + 1 < len(ys) else hr_y + out_tile
+            done = final_end - origin
+            strip = (acc[:, :done] / wsum[:, :done]).clamp_(0, 1)
+            
+            crop_end = min(final_end, height * scale) - origin
+            if crop_end > 0:
+                yield origin, strip[:, :crop_end, :width * scale].mul(255).round_().to(torch.uint8).permute(1, 2, 0).numpy()
+            
+            acc, wsum = acc[:, done:], wsum[:, done:]
+            origin = final_end
+
+    def upscale_tiled(self, image, tile_size=None, overlap=16, scale_factor=None, max_memory_mb=1024, as_numpy=False):
+        """
+        Tiled SR of a whole image; see `iter_tiled_rows`. The whole HR image is returned,
+        so on top of `max_memory_mb` (which bounds the tiling working set) the caller holds
+        (H * scale) x (W * scale) x 3 bytes. Use `iter_tiled_rows` to stream strips instead.
+        """
+        arr = np.asarray(_to_pil(image)) if not isinstance(image, np.ndarray) else image[..., :3]
+        scale = scale_factor or self.scale_factor
+        # Strips are copied into one preallocated array rather than concatenated (no second copy)
+        output = np.empty((arr.shape[0] * scale, arr.shape[1] * scale, 3), dtype=np.uint8)
+        for hr_y, strip in self.iter_tiled_rows(arr, tile_size, overlap, scale, max_memory_mb):
+            output[hr_y:hr_y + len(strip)] = strip
+        return output if as_numpy else Image.fromarray(output)
 
 if __name__ == "__main__":
     # Test stub
@@ -0,0 +1,87 @@
+"""
+Temporal deduplication for capsule studies: consecutive near-identical frames
+(pill lodged or in slow transit) are collapsed to a keyframe that alone goes
+through the models, and the keyframe's predictions are reused for the rest.
+"""
+import numpy as np
+from PIL import Image
+
+DEDUP_METHODS = ["dhash", "diff"]
+
+class KeyframeSelector:
+    """
+    Compares every frame against the current keyframe (not its predecessor, so slow
+    drift can't chain a whole segment onto one keyframe) using a tiny grayscale thumbnail:
+      dhash - 64-bit difference hash, similarity = 1 - hamming distance / 64
+      diff  - mean absolute difference of 16x16 thumbnails, similarity = 1 - diff / 255
+    A frame at or above `threshold` is a duplicate, unless the keyframe already covers
+    `max_skip` duplicates, in which case the frame becomes a new keyframe anyway.
+    """
+
+    def __init__(self, threshold=0.95, max_skip=30, method="dhash", hash_size=8):
+        if method not in DEDUP_METHODS:
+            raise ValueError(f"Unknown dedup method '{method}', expected one of {DEDUP_METHODS}")
+        self.threshold = threshold
+        self.max_skip = max_skip
+        self.method = method
+        self.hash_size = hash_size
+        self._key_signature = None
+        self._skipped = 0
+        self.frames = 0
+        self.keyframes = 0
+
+    def signature(self, image):
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        gray = image.convert('L')
+        if self.method == "dhash":
+            # One extra column so each row yields hash_size left/right comparisons
+            small = np.asarray(gray.resize((self.hash_size + 1, self.hash_size), Image.BOX), dtype=np.int16)
+            return small[:, 1:] > small[:, :-1]
+        return np.asarray(gray.resize((16, 16), Image.BOX), dtype=np.float32)
+
+    def similarity(self, a, b):
+        if self.method == "dhash":
+            return 1.0 - np.count_nonzero(a != b) / a.size
+        return 1.0 - float(np.mean(np.abs(a - b))) / 255.0
+
+    def is_duplicate(self, image):
+        """Feeds the next frame; True if it can reuse the current keyframe's predictions."""
+        self.frames += 1
+        sig = self.signature(image)
+        if (self._key_signature is not None and self._skipped < self.max_skip
+                and self.similarity(sig, self._key_signature) >= self.threshold):
+            self._skipped += 1
+            return True
+        self._key_signature = sig
+        self._skipped = 0
+        self.keyframes += 1
+        return False
+
+    def stats(self):
+        return {
+            "method": self.method,
+            "similarity_threshold": self.threshold,
+            "max_skip": self.max_skip,
+            "frames": self.frames,
+            "keyframes": self.keyframes,
+            "frames_skipped": self.frames - self.keyframes
+        }
+
+def iter_keyframe_groups(frames, selector):
+    """
+    Groups a (frame_id, image) stream into (keyframe_id, keyframe_image, [duplicate ids]).
+    A group is yielded once the next keyframe (or the end of the stream) is seen, so only
+    the keyframe image is held while its duplicates are counted.
+    """
+    group = None
+    for frame_id, image in frames:
+        # The very first frame can never be a duplicate (no keyframe yet)
+        if selector.is_duplicate(image):
+            group[2].append(frame_id)
+            continue
+        if group is not None:
+            yield group
+        group = (frame_id, image, [])
+    if group is not None:
+        yield group
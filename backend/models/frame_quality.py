@@ -0,0 +1,67 @@
+"""
+Early-exit technical-quality gate. Frames that are too dark/overexposed ("no view"),
+blurred, covered in bubble highlights or murky with dirt are scored from cheap
+statistics on a small grayscale thumbnail, before any model runs, so they can skip
+8x super-resolution and be reported as non-diagnostic.
+"""
+import threading
+
+import numpy as np
+from PIL import Image
+
+class QualityGate:
+    """
+    Scores technical quality in [0, 1] as the weakest of four components:
+      exposure  - mean brightness away from black / blown-out
+      sharpness - Laplacian variance relative to `sharpness_ref`
+      specular  - share of near-saturated pixels (bubble / fluid highlights)
+      contrast  - gray-level spread (dirt and turbid fluid flatten it)
+    Frames scoring below `threshold` are non-diagnostic. Counters are thread-safe so
+    one gate can be shared by every request of the API process.
+    """
+
+    def __init__(self, threshold=0.3, size=64, sharpness_ref=40.0, specular_max=0.15, contrast_ref=25.0):
+        self.threshold = threshold
+        self.size = size
+        self.sharpness_ref = sharpness_ref
+        self.specular_max = specular_max
+        self.contrast_ref = contrast_ref
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.non_diagnostic = 0
+        self.sr_skipped = 0
+
+    def assess(self, image):
+        """Returns {"quality", "non_diagnostic", per-component scores} for a PIL image or HxWx3 uint8 array."""
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        gray = image.convert('L')
+        a = np.asarray(gray.resize((self.size, self.size), Image.BOX), dtype=np.float32)
+
+        mean = float(a.mean())
+        lap = 4 * a[1:-1, 1:-1] - a[:-2, 1:-1] - a[2:, 1:-1] - a[1:-1, :-2] - a[1:-1, 2:]
+        components = {
+            "exposure": float(np.clip(min(mean - 20.0, 235.0 - mean) / 40.0, 0.0, 1.0)),
+            "sharpness": float(np.clip(lap.var() / self.sharpness_ref, 0.0, 1.0)),
+            "specular": float(np.clip(1.0 - (a >= 235).mean() / self.specular_max, 0.0, 1.0)),
+            "contrast": float(np.clip(a.std() / self.contrast_ref, 0.0, 1.0)),
+        }
+        quality = min(components.values())
+        return {"quality": round(quality, 4), "non_diagnostic": quality < self.threshold,
+                **{k: round(v, 4) for k, v in components.items()}}
+
+    def record(self, assessment, skipped_sr):
+        with self._lock:
+            self.frames += 1
+            if assessment["non_diagnostic"]:
+                self.non_diagnostic += 1
+                self.sr_skipped += int(skipped_sr)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "threshold": self.threshold,
+                "frames_scored": self.frames,
+                "non_diagnostic_frames": self.non_diagnostic,
+                "sr_frames_skipped": self.sr_skipped
+            }
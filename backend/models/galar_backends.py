@@ -0,0 +1,116 @@
+"""
+CPU execution backends for the GalarCapsuleML classifier.
+
+Every backend is built from the eager fp32 network and returns a callable that
+maps a B x 3 x H x W float tensor to a B x num_classes logits tensor, so
+GalarMLWrapper can switch between them without touching its pre/post-processing.
+"""
+import copy
+import hashlib
+import os
+import sys
+
+import numpy as np
+import torch
+from PIL import Image
+
+# Manifests are read with data_pipeline.load_manifest, which lives at the project root
+project_root = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+from data_pipeline import load_manifest
+
+BACKENDS = ['eager', 'torchscript', 'compile', 'int8_dynamic', 'int8_static', 'onnx']
+
+def load_calibration_batches(csv_path, image_root, transform, num_frames=128, batch_size=16):
+    """
+    Reads frames listed in a data_pipeline.py / preprocess.py manifest ('path' or
+    'filename' column, relative to image_root) and returns transformed batches.
+    """
+    df = load_manifest(csv_path)
+    column = 'path' if 'path' in df.columns else 'filename'
+    paths = [os.path.join(image_root, p) for p in df[column].head(num_frames)]
+
+    batches = []
+    for i in range(0, len(paths), batch_size):
+        tensors = [transform(image=np.asarray(Image.open(p).convert('RGB')))['image'] for p in paths[i:i + batch_size]]
+        batches.append(torch.stack(tensors))
+    return batches
+
+def model_fingerprint(model):
+    """Short content hash of a model's parameters and buffers (names, shapes, dtypes and values)."""
+    h = hashlib.blake2b(digest_size=8)
+    for name, tensor in model.state_dict().items():
+        h.update(f"{name}:{tuple(tensor.shape)}:{tensor.dtype}".encode())
+        h.update(tensor.detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    return h.hexdigest()
+
+def _example_input(img_res, batch_size=2):
+    return torch.randn(batch_size, 3, img_res, img_res)
+
+def build_backend(model, backend, img_res, calibration_batches=None, onnx_path=None, num_threads=None):
+    """Returns a logits callable for `model` executed with `backend` on CPU."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+    model = model.eval()
+
+    if backend == 'eager':
+        return model
+
+    if backend == 'torchscript':
+        with torch.no_grad():
+            traced = torch.jit.trace(model, _example_input(img_res))
+        return torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+    if backend == 'compile':
+        return torch.compile(model)
+
+    if backend == 'int8_dynamic':
+        # Dynamic quantization only covers Linear layers: most of the win is on the ViT heads/blocks,
+        # ResNet/EfficientNet convolutions stay fp32 (use int8_static for those)
+        return torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {torch.nn.Linear}, dtype=torch.qint8)
+
+    if backend == 'int8_static':
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+        if not calibration_batches:
+            raise ValueError("int8_static needs calibration frames (pass a calibration CSV)")
+        torch.backends.quantized.engine = 'x86' if 'x86' in torch.backends.quantized.supported_engines else 'fbgemm'
+        prepared = prepare_fx(copy.deepcopy(model), get_default_qconfig_mapping(torch.backends.quantized.engine),
+                              (_example_input(img_res),))
+        with torch.no_grad():
+            for batch in calibration_batches:
+                prepared(batch)
+        return convert_fx(prepared)
+
+    # onnx
+    import onnxruntime as ort
+
+    if onnx_path is None:
+        raise ValueError("onnx backend needs an onnx_path to export to / load from")
+    # The export is keyed by the weights it was made from (galar_resnet50.onnx -> galar_resnet50.<hash>.onnx),
+    # so retrained weights get a fresh export instead of silently serving the old graph
+    root, ext = os.path.splitext(onnx_path)
+    onnx_path = f"{root}.{model_fingerprint(model)}{ext or '.onnx'}"
+    if not os.path.exists(onnx_path):
+        export_onnx(model, img_res, onnx_path)
+    options = ort.SessionOptions()
+    if num_threads:
+        options.intra_op_num_threads = num_threads
+    session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+    input_name = session.get_inputs()[0].name
+
+    def run(batch):
+        return torch.from_numpy(session.run(None, {input_name: batch.cpu().numpy()})[0])
+    return run
+
+def export_onnx(model, img_res, onnx_path):
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    torch.onnx.export(
+        model.eval(), _example_input(img_res), onnx_path,
+        input_names=['input'], output_names=['logits'],
+        dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+        opset_version=17
+    )
+    print(f"Exported Galar classifier to {onnx_path}")
@@ -6,6 +6,8 @@ from PIL import Image
 import albumentations as A
 from albumentations.pytorch import ToTensorV2
 import numpy as np
+from .galar_backends import build_backend, load_calibration_batches
+from .pipeline import chunks
 
 # Add GalarCapsuleML to path - robustly find the project root from backend/models/
 backend_models_dir = os.path.dirname(os.path.abspath(__file__))
@@ -46,10 +48,24 @@ class SimpleArgs:
         self.learning_rate = 1e-4
         self.weight_decay = 1e-5
 
+def _to_array(image):
+    """Accepts a file path, a PIL image or an HxWx3 uint8 NumPy array and returns the array."""
+    if isinstance(image, str):
+        image = Image.open(image).convert('RGB')
+    return np.asarray(image)
+
 class GalarMLWrapper:
-    def __init__(self, model_type='resnet18', weights_path=None):
-        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    def __init__(self, model_type='resnet18', weights_path=None, batch_size=32, backend='eager',
+                 calibration_csv=None, calibration_root=None, onnx_path=None, state_dict=None):
+        # Anything but eager is a CPU execution backend (see galar_backends.py)
+        self.device = 'cuda' if torch.cuda.is_available() and backend == 'eager' else 'cpu'
+        self.batch_size = batch_size
+        self.backend = backend
         args = SimpleArgs(model_type)
+        self.model_type = args.model  # after the fallback to resnet18
+        has_weights = state_dict is not None or bool(weights_path and os.path.exists(weights_path))
+        # Backbone pretrained weights would only be overwritten by ours, so don't fetch/allocate them
+        args.pretrained = not has_weights
         
         # We assume MULTILABEL for general disease detection mapping all 11 classes simultaneously
         if prepare_model:
@@ -61,7 +77,10 @@ class GalarMLWrapper:
                 device=self.device
             )
             
-            if weights_path and os.path.exists(weights_path):
+            if state_dict is not None:
+                # The inference pool's shared-memory tensors: assigned on CPU, not copied (see worker_pool.py)
+                self.model.load_state_dict(state_dict, assign=self.device == 'cpu')
+            elif weights_path and os.path.exists(weights_path):
                 self.model.load_state_dict(torch.load(weights_path, map_location=self.device))
             self.model.eval()
         else:
@@ -75,6 +94,7 @@ class GalarMLWrapper:
             img_res = 384 if 'm' in args.model else 300 # EffNet scaling, simplifying for wrapper 
         else:
             img_res = 224 # ResNet standard
+        self.img_res = img_res
         
         self.transform = A.Compose([
             A.Resize(img_res, img_res),
@@ -87,25 +107,47 @@ class GalarMLWrapper:
             'polyp', 'ulcer', 'blood', 'erosion',           # abnormalities
             'bubbles', 'dirt', 'clear'                      # technical
         ]
-
-    def predict(self, image):
-        if isinstance(image, str):
-            image = Image.open(image).convert('RGB')
-        
-        image_np = np.array(image)
-        augmented = self.transform(image=image_np)
-        img_t = augmented['image'].unsqueeze(0).to(self.device)
         
+        # Execution backend: eager fp32, TorchScript, torch.compile, INT8 or ONNX Runtime
+        self.runner = None
         if self.model:
-            with torch.no_grad():
-                outputs = self.model(img_t)
-                probs = torch.sigmoid(outputs).cpu().numpy()[0]
-        else:
-            # Dummy predictions if model not loaded
-            np.random.seed(42) # Deterministic dummy
-            probs = np.random.rand(len(self.classes)) * 0.1
-            if np.random.rand() > 0.5:
-                probs[4] = 0.95 # fake polyp
+            calibration = None
+            # Only static INT8 calibrates; decoding frames for any other backend is wasted work
+            if backend == 'int8_static' and calibration_csv:
+                calibration = load_calibration_batches(calibration_csv, calibration_root or os.path.dirname(calibration_csv), self.transform)
+            self.runner = build_backend(self.model, backend, img_res, calibration, onnx_path)
+
+    def predict(self, image):
+        return self.predict_batch([image], batch_size=1)[0]
+
+    def predict_batch(self, images, batch_size=None):
+        """
+        Classifies a list (or any iterable) of paths, PIL images or NumPy arrays.
+        Frames are stacked into batches of `batch_size` for a single forward pass
+        each. Returns one {class: probability} dict per frame, in input order.
+        """
+        return list(self.iter_predict(images, batch_size))
+
+    def iter_predict(self, images, batch_size=None):
+        """Streaming variant of `predict_batch`: yields one result dict per frame."""
+        batch_size = batch_size or self.batch_size
         
-        results = {self.classes[i]: float(probs[i]) for i in range(len(self.classes))}
-        return results
+        for chunk in chunks(images, batch_size):
+            if self.model:
+                batch_t = torch.stack([self.transform(image=_to_array(img))['image'] for img in chunk]).to(self.device)
+                with torch.no_grad():
+                    outputs = self.runner(batch_t)
+                    probs = torch.sigmoid(outputs).cpu().numpy()
+            else:
+                # Dummy predictions if model not loaded
+                probs = [self._dummy_probs() for _ in chunk]
+            
+            for frame_probs in probs:
+                yield {self.classes[i]: float(frame_probs[i]) for i in range(len(self.classes))}
+
+    def _dummy_probs(self):
+        np.random.seed(42) # Deterministic dummy
+        probs = np.random.rand(len(self.classes)) * 0.1
+        if np.random.rand() > 0.5:
+            probs[4] = 0.95 # fake polyp
+        return probs
@@ -0,0 +1,110 @@
+"""
+Shared SR + classification pipeline policies, used by both the FastAPI
+backend (/process) and main_inference.py.
+"""
+import itertools
+
+ABNORMALITY_KEYS = ['polyp', 'ulcer', 'blood', 'erosion']
+
+POLICY_FULL = "full"                                   # 8x SR on every frame, classify the HR output
+POLICY_CLASSIFY_ONLY = "classify_only"                 # classify the raw frame, no SR at all
+POLICY_SR_AT_CLASSIFIER_RES = "sr_at_classifier_res"   # SR rendered directly at the classifier input size
+POLICY_TRIAGE = "triage"                               # classify raw, full SR only for abnormal frames
+POLICIES = [POLICY_FULL, POLICY_CLASSIFY_ONLY, POLICY_SR_AT_CLASSIFIER_RES, POLICY_TRIAGE]
+
+def chunks(iterable, size):
+    """Yields lists of at most `size` items, consuming lazily so iterators/generators work too."""
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+def find_abnormalities(predictions, threshold=0.5):
+    return {k: v for k, v in predictions.items() if k in ABNORMALITY_KEYS and v > threshold}
+
+def first_pass(endo_model, galar_model, images, policy=POLICY_FULL, as_numpy=False):
+    """
+    First model pass of a policy. Returns (images, predictions) where
+    predictions is None unless the policy classifies first (triage).
+    `as_numpy` makes every SR output an HxWx3 uint8 array instead of a PIL image.
+    """
+    images = list(images)
+    if policy == POLICY_FULL:
+        return endo_model.upscale_batch(images, as_numpy=as_numpy), None
+    if policy == POLICY_SR_AT_CLASSIFIER_RES:
+        return endo_model.upscale_batch(images, output_size=galar_model.img_res, as_numpy=as_numpy), None
+    if policy == POLICY_CLASSIFY_ONLY:
+        return images, None
+    if policy == POLICY_TRIAGE:
+        return images, galar_model.predict_batch(images)
+    raise ValueError(f"Unknown pipeline policy '{policy}', expected one of {POLICIES}")
+
+def second_pass(endo_model, galar_model, first, policy=POLICY_FULL, triage_threshold=0.5, as_numpy=False):
+    """
+    Second model pass of a policy. Returns one (enhanced_image, predictions)
+    tuple per frame; enhanced_image is None when the policy skipped SR for that frame.
+    """
+    images, predictions = first
+
+    if policy == POLICY_TRIAGE:
+        # Only frames flagged on the raw pass get full SR and are re-classified on the HR output
+        enhanced = [None] * len(images)
+        flagged = [i for i, preds in enumerate(predictions) if find_abnormalities(preds, triage_threshold)]
+        if flagged:
+            hr_imgs = endo_model.upscale_batch([images[i] for i in flagged], as_numpy=as_numpy)
+            for i, hr_img, preds in zip(flagged, hr_imgs, galar_model.predict_batch(hr_imgs)):
+                enhanced[i] = hr_img
+                predictions[i] = preds
+        return list(zip(enhanced, predictions))
+
+    predictions = galar_model.predict_batch(images)
+    enhanced = [None] * len(images) if policy == POLICY_CLASSIFY_ONLY else images
+    return list(zip(enhanced, predictions))
+
+def run_policy(endo_model, galar_model, images, policy=POLICY_FULL, triage_threshold=0.5, as_numpy=False):
+    """Runs both passes of `policy` over a batch of frames."""
+    first = first_pass(endo_model, galar_model, images, policy, as_numpy)
+    return second_pass(endo_model, galar_model, first, policy, triage_threshold, as_numpy)
+
+def gate_policies(quality_gate, images, policies):
+    """
+    Scores every frame with `quality_gate` (models/frame_quality.py) and downgrades
+    non-diagnostic frames to POLICY_CLASSIFY_ONLY so they skip SR. Returns the
+    effective policies and one assessment per frame (None everywhere without a gate).
+    """
+    if quality_gate is None:
+        return list(policies), [None] * len(policies)
+    assessments = [quality_gate.assess(image) for image in images]
+    effective = []
+    for assessment, policy in zip(assessments, policies):
+        skip = assessment["non_diagnostic"]
+        quality_gate.record(assessment, skipped_sr=skip and policy != POLICY_CLASSIFY_ONLY)
+        effective.append(POLICY_CLASSIFY_ONLY if skip else policy)
+    return effective, assessments
+
+def first_passes(endo_model, galar_model, images, policies, as_numpy=False):
+    """first_pass for each policy group of a mixed batch; feed the result to second_passes."""
+    groups = []
+    for policy in dict.fromkeys(policies):
+        idx = [i for i, p in enumerate(policies) if p == policy]
+        groups.append((policy, idx, first_pass(endo_model, galar_model, [images[i] for i in idx], policy, as_numpy)))
+    return len(images), groups
+
+def second_passes(endo_model, galar_model, state, triage_threshold=0.5, as_numpy=False):
+    """Finishes a first_passes batch; results come back in input order."""
+    n, groups = state
+    results = [None] * n
+    for policy, idx, first in groups:
+        for i, result in zip(idx, second_pass(endo_model, galar_model, first, policy, triage_threshold, as_numpy)):
+            results[i] = result
+    return results
+
+def run_policies(endo_model, galar_model, images, policies, triage_threshold=0.5, as_numpy=False):
+    """
+    Runs a batch where each frame may ask for a different policy.
+    Frames sharing a policy share forward passes; results come back in input order.
+    """
+    state = first_passes(endo_model, galar_model, images, policies, as_numpy)
+    return second_passes(endo_model, galar_model, state, triage_threshold, as_numpy)
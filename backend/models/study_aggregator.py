@@ -0,0 +1,233 @@
+"""
+Study-level aggregation of per-frame predictions into a clinical summary.
+
+Frames are fed in study order, in batches of any size (a whole study, one model
+batch or a single frame), and `report()` can be called at any point, so the same
+engine serves finished studies and studies still being processed. State is a
+handful of arrays sized by the number of classes (plus the smoothing window and
+top-K), never by the number of frames; only the reported segments grow with the study.
+"""
+import numpy as np
+
+from .pipeline import ABNORMALITY_KEYS
+
+# GalarMLWrapper landmark outputs, in transit order
+SECTION_KEYS = ['esophagus', 'stomach', 'small_bowel', 'colon']
+
+class StudyAggregator:
+    """
+    Per finding, probabilities are smoothed with a causal moving average over `window`
+    frames; a contiguous run of smoothed scores above `threshold` is one abnormal
+    segment (start/end frame, peak smoothed score and where it peaked). Frame numbers
+    of segments are shifted back by half the window to undo the averaging lag.
+    Sections are the argmax of the smoothed landmark outputs (same lag correction);
+    transit time per section is the distance from its first frame to the first frame
+    of the next section.
+    The top-K frames per finding are tracked on the raw probabilities.
+    """
+
+    def __init__(self, classes=None, finding_keys=ABNORMALITY_KEYS, section_keys=SECTION_KEYS, threshold=0.5,
+                 window=5, top_k=5, fps=None):
+        self.finding_keys = list(finding_keys)
+        self.section_keys_requested = list(section_keys)
+        self.threshold = threshold
+        self.window = max(1, window)
+        self.lag = (self.window - 1) // 2
+        self.top_k = top_k
+        self.fps = fps
+        self.frames = 0
+        self.non_diagnostic = 0
+        self.classes = None
+        if classes is not None:
+            self._init(list(classes))
+
+    def _init(self, classes):
+        self.classes = classes
+        self.finding_idx = np.array([classes.index(k) for k in self.finding_keys if k in classes], dtype=np.int64)
+        self.findings = [k for k in self.finding_keys if k in classes]
+        self.section_idx = np.array([classes.index(k) for k in self.section_keys_requested if k in classes], dtype=np.int64)
+        self.sections = [k for k in self.section_keys_requested if k in classes]
+        n_f, n_s = len(self.findings), len(self.sections)
+
+        # Smoothing: last window-1 rows of the (findings + sections) columns carried between batches
+        self._tail = np.zeros((0, n_f + n_s), dtype=np.float64)
+        # Segments: per finding, whether one is open, where it started, its peak so far
+        self._open = np.zeros(n_f, dtype=bool)
+        self._start = np.zeros(n_f, dtype=np.int64)
+        self._peak = np.zeros(n_f, dtype=np.float64)
+        self._peak_at = np.zeros(n_f, dtype=np.int64)
+        self._segments = {k: [] for k in self.findings}
+        # Sections: frame counts, first and last frame
+        self._section_frames = np.zeros(n_s, dtype=np.int64)
+        self._section_first = np.full(n_s, -1, dtype=np.int64)
+        self._section_last = np.full(n_s, -1, dtype=np.int64)
+        # Top-K: scores and frame numbers per finding (K x findings), plus caller frame ids
+        self._top_scores = np.full((self.top_k, n_f), -np.inf)
+        self._top_frames = np.full((self.top_k, n_f), -1, dtype=np.int64)
+        self._frame_ids = {}
+
+    def update_dicts(self, predictions, frame_ids=None, diagnostic=None):
+        """Same as update() for a list of {class: probability} dicts (classes taken from the first dict if unset)."""
+        predictions = list(predictions)
+        if not predictions:
+            return
+        if self.classes is None:
+            self._init(list(predictions[0]))
+        probs = np.array([[p.get(c, 0.0) for c in self.classes] for p in predictions], dtype=np.float64)
+        self.update(probs, frame_ids, diagnostic)
+
+    def update(self, probs, frame_ids=None, diagnostic=None):
+        """
+        Feeds the next N frames as an N x len(classes) probability matrix.
+        `diagnostic` (N bools) marks frames to ignore: their finding scores count as 0
+        and they don't vote for a section or enter the top-K.
+        """
+        probs = np.asarray(probs, dtype=np.float64)
+        n = len(probs)
+        if n == 0:
+            return
+        if self.classes is None:
+            raise ValueError("StudyAggregator needs `classes` before update() with a matrix")
+        offset = self.frames
+        frame_no = np.arange(offset, offset + n)
+        valid = np.ones(n, dtype=bool) if diagnostic is None else np.asarray(diagnostic, dtype=bool)
+        self.frames += n
+        self.non_diagnostic += int(n - valid.sum())
+
+        cols = np.concatenate([probs[:, self.finding_idx], probs[:, self.section_idx]], axis=1)
+        cols[~valid, :len(self.findings)] = 0.0
+        smoothed = self._smooth(cols)
+        n_f = len(self.findings)
+        self._update_segments(smoothed[:, :n_f], frame_no)
+        self._update_sections(smoothed[:, n_f:], frame_no, valid)
+        self._update_top_k(cols[:, :n_f], frame_no, valid, frame_ids)
+
+    def _smooth(self, cols):
+        # Causal moving average over [carried tail; batch] with one cumulative sum
+        joined = np.concatenate([self._tail, cols], axis=0)
+        csum = np.cumsum(joined, axis=0)
+        csum = np.concatenate([np.zeros((1, joined.shape[1])), csum], axis=0)
+        t = len(self._tail)
+        ends = np.arange(t + 1, len(joined) + 1)
+        starts = np.maximum(ends - self.window, 0)
+        smoothed = (csum[ends] - csum[starts]) / (ends - starts)[:, None]
+        self._tail = joined[-(self.window - 1):] if self.window > 1 else joined[:0]
+        return smoothed
+
+    def _update_segments(self, scores, frame_no):
+        above = scores > self.threshold
+        for j, key in enumerate(self.findings):
+            col, mask = scores[:, j], above[:, j]
+            # Transitions relative to the state carried from the previous batch
+            padded = np.concatenate([[self._open[j]], mask, [False]]).astype(np.int8)
+            edges = np.diff(padded)
+            starts = np.flatnonzero(edges == 1)
+            ends = np.flatnonzero(edges == -1)  # exclusive, in batch coordinates
+            if self._open[j]:
+                starts = np.concatenate([[-1], starts])  # continuation of the open segment
+            for s, e in zip(starts, ends):
+                lo = max(s, 0)
+                if e > lo:
+                    k = lo + int(np.argmax(col[lo:e]))
+                    peak, peak_at = float(col[k]), int(frame_no[k])
+                else:
+                    peak, peak_at = -np.inf, -1
+                if s == -1:
+                    if peak > self._peak[j]:
+                        self._peak[j], self._peak_at[j] = peak, peak_at
+                else:
+                    self._start[j], self._peak[j], self._peak_at[j] = frame_no[s], peak, peak_at
+                if e < len(mask):
+                    # Closed inside this batch
+                    self._segments[key].append(self._segment(j, int(frame_no[e - 1]) if e > 0 else int(frame_no[0]) - 1))
+                    self._open[j] = False
+                else:
+                    self._open[j] = True
+
+    def _segment(self, j, end_frame):
+        return {
+            "start_frame": max(int(self._start[j]) - self.lag, 0),
+            "end_frame": max(end_frame - self.lag, 0),
+            "peak_score": round(float(self._peak[j]), 4),
+            "peak_frame": max(int(self._peak_at[j]) - self.lag, 0)
+        }
+
+    def _update_sections(self, scores, frame_no, valid):
+        if not len(self.sections):
+            return
+        best = np.argmax(scores, axis=1)[valid]
+        frames = frame_no[valid]
+        if not len(best):
+            return
+        self._section_frames += np.bincount(best, minlength=len(self.sections))
+        for s in np.unique(best):
+            hits = frames[best == s]
+            if self._section_first[s] < 0:
+                self._section_first[s] = hits[0]
+            self._section_last[s] = hits[-1]
+
+    def _update_top_k(self, scores, frame_no, valid, frame_ids):
+        if not self.top_k:
+            return
+        scores = np.where(valid[:, None], scores, -np.inf)
+        k = min(self.top_k, len(scores))
+        # Best k of the batch per finding, then merge with the running top-K.
+        # Ties go to the earlier frame, so results don't depend on how the study was batched
+        frames_2d = np.broadcast_to(frame_no[:, None], scores.shape)
+        cand = np.lexsort((frames_2d, -scores), axis=0)[:k]
+        all_scores = np.concatenate([self._top_scores, np.take_along_axis(scores, cand, axis=0)], axis=0)
+        all_frames = np.concatenate([self._top_frames, frame_no[cand]], axis=0)
+        order = np.lexsort((np.where(all_frames < 0, np.iinfo(np.int64).max, all_frames), -all_scores), axis=0)[:self.top_k]
+        self._top_scores = np.take_along_axis(all_scores, order, axis=0)
+        self._top_frames = np.take_along_axis(all_frames, order, axis=0)
+        if frame_ids is not None:
+            # Only ids of frames currently in some top-K are kept
+            for i in np.unique(cand):
+                self._frame_ids[int(frame_no[i])] = frame_ids[i]
+            keep = set(self._top_frames.ravel().tolist())
+            self._frame_ids = {f: fid for f, fid in self._frame_ids.items() if f in keep}
+
+    def report(self):
+        """Clinical summary of everything fed so far; open segments are included with "open": true."""
+        if self.classes is None:
+            return {"frames": 0}
+        segments = {}
+        for j, key in enumerate(self.findings):
+            segs = list(self._segments[key])
+            if self._open[j]:
+                segs.append({**self._segment(j, self.frames - 1), "open": True})
+            segments[key] = segs
+
+        seen = [i for i in np.argsort(self._section_first) if self._section_first[i] >= 0]
+        sections = {}
+        # Transit is measured between lag-corrected first frames (the clamp at frame 0 included)
+        firsts = [max(int(self._section_first[i]) - self.lag, 0) for i in seen]
+        for pos, i in enumerate(seen):
+            first = firsts[pos]
+            nxt = firsts[pos + 1] if pos + 1 < len(seen) else None
+            entry = {
+                "first_frame": first,
+                "last_frame": max(int(self._section_last[i]) - self.lag, 0),
+                "frames": int(self._section_frames[i]),
+                "transit_frames": nxt - first if nxt is not None else None
+            }
+            if self.fps:
+                entry["transit_seconds"] = round(entry["transit_frames"] / self.fps, 1) if nxt is not None else None
+            sections[self.sections[i]] = entry
+
+        top_frames = {}
+        for j, key in enumerate(self.findings):
+            top_frames[key] = [
+                {"frame": int(f), "frame_id": self._frame_ids.get(int(f)), "score": round(float(s), 4)}
+                for s, f in zip(self._top_scores[:, j], self._top_frames[:, j]) if f >= 0 and np.isfinite(s)
+            ]
+
+        return {
+            "frames": self.frames,
+            "non_diagnostic_frames": self.non_diagnostic,
+            "threshold": self.threshold,
+            "smoothing_window": self.window,
+            "abnormal_segments": segments,
+            "sections": sections,
+            "top_frames": top_frames
+        }
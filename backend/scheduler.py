@@ -0,0 +1,158 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MicroBatchScheduler:
+    """
+    In-process inference scheduler. Requests are queued and gathered into
+    micro-batches bounded by `max_batch_size` and `max_wait_ms`, the batch is
+    run off the event loop, and each request's future is resolved with its result.
+
+    `process_batch` is a blocking callable taking a list of payloads and
+    returning a list of results in the same order.
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, max_wait_ms=10, max_concurrent_batches=1):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_concurrent_batches = max_concurrent_batches
+
+        self._queue = None
+        self._getter = None
+        self._task = None
+        self._slots = None
+        self._executor = None
+        self._collecting = []     # items of the batch being gathered, failed on stop()
+        self._inflight = set()    # dispatched batches, referenced so they can't be garbage-collected
+
+        # Simple counters so batch occupancy can be checked from outside
+        self.batches_run = 0
+        self.items_run = 0
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue else 0
+
+    @property
+    def mean_batch_size(self):
+        return self.items_run / self.batches_run if self.batches_run else 0.0
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent_batches, thread_name_prefix="inference")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops batching; every request still waiting is failed, batches already running
+        are allowed to finish and resolve their requests, then the executor is released.
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        stranded = self._collecting
+        self._collecting = []
+        if self._getter:
+            # A get() that already completed holds an item nobody else will see
+            if self._getter.done() and not self._getter.cancelled():
+                stranded.append(self._getter.result())
+            else:
+                self._getter.cancel()
+            self._getter = None
+        while self._queue and not self._queue.empty():
+            stranded.append(self._queue.get_nowait())
+        # Fail whatever never reached a batch instead of leaving callers hanging
+        for _, fut in stranded:
+            if not fut.done():
+                fut.set_exception(RuntimeError("Scheduler stopped"))
+
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        if self._executor:
+            # Nothing is running any more, so this doesn't block the loop
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    async def submit(self, payload):
+        """Queues one payload and waits for its result."""
+        if self._task is None:
+            raise RuntimeError("Scheduler is not running")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((payload, future))
+        return await future
+
+    async def _next_item(self, timeout=None):
+        # The pending get() is kept across calls instead of being cancelled on
+        # timeout, so an item that arrives right at the deadline is never lost.
+        if self._getter is None:
+            self._getter = asyncio.ensure_future(self._queue.get())
+        done, _ = await asyncio.wait({self._getter}, timeout=timeout)
+        if not done:
+            return None
+        item = self._getter.result()
+        self._getter = None
+        return item
+
+    async def _collect_batch(self):
+        loop = asyncio.get_running_loop()
+        # Gathered in place so stop() can fail the items if it cancels us mid-batch
+        batch = self._collecting = [await self._next_item()]
+        deadline = loop.time() + self.max_wait
+
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            item = await self._next_item(timeout)
+            if item is None:
+                break
+            batch.append(item)
+        self._collecting = []
+        return batch
+
+    async def _run(self):
+        while True:
+            await self._slots.acquire()
+            try:
+                batch = await self._collect_batch()
+            except asyncio.CancelledError:
+                self._slots.release()
+                raise
+            # Requests whose client went away don't need a forward pass
+            batch = [(payload, fut) for payload, fut in batch if not fut.cancelled()]
+            if not batch:
+                self._slots.release()
+                continue
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch):
+        loop = asyncio.get_running_loop()
+        payloads = [payload for payload, _ in batch]
+        try:
+            results = await loop.run_in_executor(self._executor, self.process_batch, payloads)
+        except Exception as e:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+        else:
+            self.batches_run += 1
+            self.items_run += len(batch)
+            for (_, fut), result in zip(batch, results):
+                if not fut.done():
+                    fut.set_result(result)
+        finally:
+            self._slots.release()
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import random
+import time
+
+
+class SimulatedPill:
+    """Simulated real-time pill telemetry, advanced by wall-clock time so the tick rate doesn't change the physics."""
+
+    def __init__(self):
+        self.state = {
+            "ph": 6.5,
+            "temperature": 37.0,
+            "pressure": 1013,
+            "location": "Duodenum L2",
+            "battery": 85.0,
+            "uptime": 15120, # seconds
+            "connection_strength": 94
+        }
+        self._uptime = float(self.state["uptime"])
+
+    def step(self, dt):
+        # Add slight variation
+        s = self.state
+        s["ph"] = round(max(1.5, min(8.5, s["ph"] + random.uniform(-0.1, 0.1) * min(dt, 1.0))), 2)
+        s["temperature"] = round(36.8 + random.uniform(0, 0.5), 1)
+        s["battery"] = round(s["battery"] - 0.01 * dt, 3)
+        self._uptime += dt
+        s["uptime"] = int(self._uptime)
+        return dict(s)
+
+
+class Subscriber:
+    """
+    One viewer: a bounded queue of (seq, delta_text, full_text) messages. When the queue
+    is full the oldest message is dropped, so a slow client never holds up the producer;
+    it just receives a full snapshot instead of a delta after the gap.
+    """
+
+    def __init__(self, queue_size, min_interval):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.min_interval = min_interval
+        self.last_seq = None
+        self.next_due = 0.0
+        self.dropped = 0
+        self.sent = 0
+
+    def offer(self, message):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(message)
+
+    async def next_message(self):
+        """Waits for the next message due for this client, coalescing anything older under its rate."""
+        message = await self.queue.get()
+        wait = self.next_due - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        # Skip to the newest sample; a gap in sequence numbers means the client gets a full snapshot
+        while not self.queue.empty():
+            message = self.queue.get_nowait()
+        seq, delta_text, full_text = message
+        text = delta_text if self.last_seq is not None and seq == self.last_seq + 1 else full_text
+        self.last_seq = seq
+        self.next_due = time.monotonic() + self.min_interval
+        self.sent += 1
+        return text
+
+
+class TelemetryHub:
+    """
+    Single producer for /ws/telemetry. Each sample is produced (or ingested via publish)
+    once, diffed against the previous one and JSON-encoded once as both a delta (changed
+    fields only) and a full snapshot; fan-out to subscribers is just queueing those shared
+    strings, so CPU per sample doesn't grow with the number of viewers beyond a queue put.
+    The producer rate follows the `telemetry_rate` setting (samples per second).
+    """
+
+    def __init__(self, get_rate, source=None, queue_size=8, settings_refresh_s=5.0):
+        self.get_rate = get_rate
+        self.source = source or SimulatedPill()
+        self.queue_size = queue_size
+        self.settings_refresh_s = settings_refresh_s
+        self.rate = 1.0
+        self.subscribers = set()
+        self.seq = 0
+        self.last_sample = None
+        self.last_full = None
+        self.samples = 0
+
+    def subscribe(self, rate=None):
+        """Registers a viewer; `rate` (updates/s) can only lower the hub rate for this client."""
+        min_interval = 1.0 / rate if rate and rate > 0 else 0.0
+        sub = Subscriber(self.queue_size, min_interval)
+        if self.last_full is not None:
+            # New viewers start from the current snapshot instead of waiting for the next tick
+            sub.offer((self.seq, self.last_full, self.last_full))
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        self.subscribers.discard(sub)
+
+    def publish(self, sample):
+        """Ingests one telemetry sample and fans it out to every subscriber."""
+        previous = self.last_sample or {}
+        delta = {k: v for k, v in sample.items() if previous.get(k) != v}
+        self.seq += 1
+        self.samples += 1
+        self.last_sample = sample
+        self.last_full = json.dumps(sample)
+        if not self.subscribers:
+            return
+        message = (self.seq, json.dumps(delta), self.last_full)
+        for sub in self.subscribers:
+            sub.offer(message)
+
+    async def _refresh_rate(self):
+        try:
+            rate = float(await asyncio.to_thread(self.get_rate))
+            self.rate = max(0.1, rate)
+        except Exception as e:
+            print(f"Could not read telemetry rate: {e}")
+
+    async def run(self):
+        """Producer loop; run as one background task for the whole app."""
+        await self._refresh_rate()
+        last = time.monotonic()
+        last_refresh = last
+        while True:
+            now = time.monotonic()
+            if now - last_refresh >= self.settings_refresh_s:
+                await self._refresh_rate()
+                last_refresh = now
+            self.publish(self.source.step(now - last))
+            last = now
+            await asyncio.sleep(max(0.0, 1.0 / self.rate - (time.monotonic() - now)))
+
+    def stats(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "rate_hz": self.rate,
+            "samples": self.samples,
+            "dropped": sum(s.dropped for s in self.subscribers),
+            "max_queue_depth": max((s.queue.qsize() for s in self.subscribers), default=0)
+        }
@@ -1,85 +1,340 @@
 import argparse
+import hashlib
 import sys
 import os
+import time
 
-# Robustly find GalarCapsuleML lib
+import numpy as np
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset, WeightedRandomSampler
+
+# Robustly find GalarCapsuleML lib (and data_pipeline.py at the project root)
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+from data_pipeline import load_manifest
+
 lib_path = os.path.join(project_root, 'lib', 'GalarCapsuleML')
+prepare_model = None
 if os.path.exists(lib_path):
     sys.path.append(lib_path)
     try:
         from model import prepare_model
         from utils import ClassificationType
-        from dataset import get_dataloaders
-        # They might have trainers but let's implement the imbalance features as requested
     except ImportError:
-        pass
+        prepare_model = None
+
+# Label columns of data_pipeline.py / preprocess.py manifests per problem type
+PROBLEM_COLUMNS = {
+    "section": ["outside", "mouth", "esophagus", "stomach", "small intestine", "colon"],
+    "abnormality": ["polyp", "ulcer", "blood", "erosion", "clear"],
+    "technical": ["bubbles", "dirt", "good view", "reduced view", "no view"],
+}
+CACHE_RESOLUTIONS = [224, 300, 384]
+# Architectures both GalarCapsuleML's prepare_model and torchvision.models provide
+MODELS = ['resnet18', 'resnet34', 'resnet50', 'resnet101', 'resnet152',
+          'vit_b_16', 'vit_l_32', 'efficientnet_v2_s', 'efficientnet_v2_m']
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+def model_resolution(model_name):
+    # Same choice as GalarMLWrapper
+    if 'vit' in model_name:
+        return 224
+    if 'efficientnet' in model_name:
+        return 384 if 'm' in model_name else 300
+    return 224
+
+def load_labels(csv_path, problem_type, image_root=None):
+    """Returns (frame paths, label columns, N x C one-hot label array) from a training manifest."""
+    df = load_manifest(csv_path)
+    columns = [c for c in PROBLEM_COLUMNS.get(problem_type, [problem_type]) if c in df.columns]
+    if not columns:
+        raise ValueError(f"No label columns for problem type '{problem_type}' in {csv_path}")
+    image_root = image_root or os.path.dirname(os.path.abspath(csv_path))
+    path_column = 'path' if 'path' in df.columns else 'filename'
+    paths = [os.path.join(image_root, p) for p in df[path_column]]
+    return paths, columns, df[columns].to_numpy(dtype=np.float32)
+
+def class_weights(labels, multiclass):
+    """
+    Class counts from the manifest turned into loss weights: inverse frequency for
+    CrossEntropyLoss, negatives/positives as BCEWithLogitsLoss pos_weight.
+    """
+    counts = labels.sum(axis=0)
+    n = len(labels)
+    if multiclass:
+        weights = n / (len(counts) * np.maximum(counts, 1))
+    else:
+        weights = (n - counts) / np.maximum(counts, 1)
+    return counts, torch.tensor(weights, dtype=torch.float32)
+
+def sample_weights(labels, multiclass):
+    """Per-frame WeightedRandomSampler weights: inverse count of the frame's (rarest positive) class."""
+    inv = 1.0 / np.maximum(labels.sum(axis=0), 1)
+    if multiclass:
+        return inv[labels.argmax(axis=1)]
+    per_frame = (labels * inv).max(axis=1)
+    # Frames without any positive label are weighted like the most common class
+    per_frame[per_frame == 0] = inv.min()
+    return per_frame
+
+def _load_resized(path, res):
+    img = Image.open(path)
+    img.draft('RGB', (res, res))  # JPEG: decode at reduced scale straight away, no-op for PNG
+    return np.asarray(img.convert('RGB').resize((res, res), Image.BILINEAR), dtype=np.uint8)
+
+class _DecodeDataset(Dataset):
+    def __init__(self, paths, res):
+        self.paths = paths
+        self.res = res
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, i):
+        return i, _load_resized(self.paths[i], self.res)
+
+def build_image_cache(paths, res, cache_dir, num_workers=4):
+    """
+    Decodes and resizes every frame once into a uint8 N x res x res x 3 .npy memmap.
+    The cache is keyed by the frame list (path, size and mtime of every file) and resolution
+    and only marked complete at the end, so an interrupted build is redone and a changed
+    manifest or an edited image gets its own file.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    h = hashlib.blake2b(digest_size=8)
+    for path in paths:
+        st = os.stat(path)
+        h.update(f"{path}\0{st.st_size}\0{st.st_mtime_ns}\n".encode('utf-8'))
+    key = h.hexdigest()
+    cache_path = os.path.join(cache_dir, f"frames_{key}_{res}.npy")
+    done_marker = f"{cache_path}.done"
+    if os.path.exists(cache_path) and os.path.exists(done_marker):
+        return cache_path
+
+    print(f"Building {res}px image cache for {len(paths)} frames at {cache_path}")
+    start = time.perf_counter()
+    cache = np.lib.format.open_memmap(cache_path, mode='w+', dtype=np.uint8, shape=(len(paths), res, res, 3))
+    loader = DataLoader(_DecodeDataset(paths, res), batch_size=64, num_workers=num_workers)
+    for idx, imgs in loader:
+        cache[idx.numpy()] = imgs.numpy()
+    cache.flush()
+    del cache
+    open(done_marker, 'w').close()
+    print(f"Image cache built in {time.perf_counter() - start:.1f}s")
+    return cache_path
+
+class FrameDataset(Dataset):
+    """
+    Yields (uint8 3 x res x res tensor, label). Frames come from the memmap cache when one
+    is given, otherwise they are decoded and resized on the fly. Float conversion and
+    normalization happen per batch on the training device, so workers ship 4x fewer bytes.
+    """
+
+    def __init__(self, paths, labels, res, cache_path=None):
+        self.paths = paths
+        self.labels = labels
+        self.res = res
+        self.cache_path = cache_path
+        self._cache = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, i):
+        if self.cache_path:
+            if self._cache is None:
+                # Opened lazily so every DataLoader worker maps the file itself instead of pickling it
+                self._cache = np.load(self.cache_path, mmap_mode='r')
+            img = np.array(self._cache[i])
+        else:
+            img = _load_resized(self.paths[i], self.res)
+        return torch.from_numpy(img).permute(2, 0, 1), self.labels[i]
+
+def _build_model(args, problem_type, num_outputs, multiclass, device):
+    """GalarCapsuleML's prepare_model when the lib is available, torchvision with a fresh head otherwise."""
+    if prepare_model is not None:
+        class DummyArgs:
+            def __init__(self):
+                self.model = args.model
+                self.pretrained = args.pretrained
+                self.freeze = 1 if args.freeze else 0
+                self.learning_rate = args.lr
+                self.optimizer = 'adam'
+                self.dual_output = False
+                self.dropout = 0.2
+                self.weight_decay = 1e-5
+        model, _, optimizer = prepare_model(
+            DummyArgs(),
+            print,
+            features=[problem_type],
+            classification_type=ClassificationType.MULTICLASS if multiclass else ClassificationType.MULTILABEL,
+            device=device
+        )
+        return model, optimizer
+
+    import torchvision
+    print("GalarCapsuleML lib not found, training a torchvision model instead.")
+    constructor = getattr(torchvision.models, args.model)
+    model = None
+    if args.pretrained:
+        # Downloads ImageNet weights unless they're already in the torch hub cache
+        try:
+            model = constructor(weights='DEFAULT')
+        except Exception as e:
+            print(f"Warning: could not load pretrained {args.model} weights ({e}), training from scratch.")
+    if model is None:
+        model = constructor(weights=None)
+    if args.freeze:
+        for p in model.parameters():
+            p.requires_grad = False
+    # Replace the classification head for our label set
+    if hasattr(model, 'fc'):
+        model.fc = torch.nn.Linear(model.fc.in_features, num_outputs)
+    elif hasattr(model, 'heads'):
+        model.heads.head = torch.nn.Linear(model.heads.head.in_features, num_outputs)
+    else:
+        model.classifier[-1] = torch.nn.Linear(model.classifier[-1].in_features, num_outputs)
+    model = model.to(device)
+    optimizer = torch.optim.Adam([p for p in model.parameters() if p.requires_grad], lr=args.lr)
+    return model, optimizer
+
+def _make_loader(dataset, args, sampler=None, shuffle=False, device='cpu'):
+    return DataLoader(
+        dataset,
+        batch_size=args.batch_size,
+        sampler=sampler,
+        shuffle=shuffle and sampler is None,
+        num_workers=args.num_workers,
+        pin_memory=device == 'cuda',
+        persistent_workers=args.num_workers > 0,
+        prefetch_factor=args.prefetch_factor if args.num_workers > 0 else None,
+        drop_last=False,
+    )
+
+def run_epoch(model, loader, criterion, optimizer, device, multiclass, train=True):
+    """One pass over `loader`; returns (mean loss, images, data-wait seconds, compute seconds)."""
+    model.train(train)
+    mean = torch.tensor(IMAGENET_MEAN, device=device).view(1, 3, 1, 1) * 255
+    std = torch.tensor(IMAGENET_STD, device=device).view(1, 3, 1, 1) * 255
+    total_loss, images, data_wait, compute = 0.0, 0, 0.0, 0.0
+
+    end = time.perf_counter()
+    for x, y in loader:
+        fetched = time.perf_counter()
+        data_wait += fetched - end
+
+        x = (x.to(device, non_blocking=True).float() - mean) / std
+        y = y.to(device, non_blocking=True)
+        target = y.argmax(dim=1) if multiclass else y
+        with torch.set_grad_enabled(train):
+            if train and torch.rand(1).item() < 0.5:
+                x = x.flip(3)  # cheap batch-level horizontal flip augmentation
+            loss = criterion(model(x), target)
+            if train:
+                optimizer.zero_grad(set_to_none=True)
+                loss.backward()
+                optimizer.step()
+        total_loss += loss.item() * len(x)  # .item() syncs, so compute time below is honest on GPU too
+        images += len(x)
+
+        end = time.perf_counter()
+        compute += end - fetched
+    return total_loss / max(images, 1), images, data_wait, compute
 
 def train_galar(args):
     """
-    Sets up GalarCapsuleML training on synthetic/real data.
-    Implements dataset imbalance options as outlined in the repo documentation.
+    Fine-tunes a GalarCapsuleML classifier on a data_pipeline.py / preprocess.py manifest.
+    Implements the dataset imbalance options outlined in the repo documentation.
     """
     print(f"--- Initializing GalarCapsuleML Training ---")
     print(f"Model: {args.model}")
     print(f"Problem Type: {args.problem_type}")
-    
-    device = 'cuda' # Assuming CUDA for training
-    
+
+    device = args.device or ('cuda' if torch.cuda.is_available() else 'cpu')
+    if device == 'cpu' and args.threads:
+        torch.set_num_threads(args.threads)
+    print(f"Device: {device}")
+
+    paths, columns, labels = load_labels(args.dataset_csv, args.problem_type, args.image_root)
+    multiclass = args.problem_type == "section"
+    res = args.img_res or model_resolution(args.model)
+    counts, weights = class_weights(labels, multiclass)
+    print("Class counts: " + ", ".join(f"{c}={int(n)}" for c, n in zip(columns, counts)))
+
     # 1. Dataset Imbalance Handlers
     print("Dataset Imbalance Strategy:")
+    sampler = None
     if args.weighted_loss:
         print("- Using Weighted Loss")
-        # In a full train loop, you would compute class counts from CSV and pass weights to BCEWithLogitsLoss / CrossEntropyLoss
-    elif args.weighted_sampling:
-        print("- Using Weighted Sampling (Resampling batches)")
-        # In a full train loop, you would pass a WeightedRandomSampler to the PyTorch DataLoader
+        weights = weights.to(device)
+        criterion = torch.nn.CrossEntropyLoss(weight=weights) if multiclass else torch.nn.BCEWithLogitsLoss(pos_weight=weights)
     else:
+        criterion = torch.nn.CrossEntropyLoss() if multiclass else torch.nn.BCEWithLogitsLoss()
+    if args.weighted_sampling:
+        print("- Using Weighted Sampling (Resampling batches)")
+        sampler = WeightedRandomSampler(torch.as_tensor(sample_weights(labels, multiclass), dtype=torch.double),
+                                        num_samples=len(labels), replacement=True)
+    if not (args.weighted_loss or args.weighted_sampling):
         print("- Do nothing about it")
-    
-    # Normally we would call prepare_model here
-    class DummyArgs:
-        def __init__(self):
-            self.model = args.model
-            self.pretrained = True
-            self.freeze = 1 if args.freeze else 0
-            self.learning_rate = args.lr
-            self.optimizer = 'adam'
-            self.dual_output = False
-            self.dropout = 0.2
-            
-    c_args = DummyArgs()
-    
-    try:
-        model, criterion, optimizer = prepare_model(
-            c_args, 
-            print, 
-            features=[args.problem_type], 
-            classification_type=ClassificationType.MULTICLASS if args.problem_type == "section" else ClassificationType.MULTILABEL,
-            device=device
-        )
-        print("Model generated successfully using GalarCapsuleML internals.")
-        # Proceed to actual PyTorch training loop here...
-        
-    except Exception as e:
-        print("Running in dry-run mode since GalarCapsuleML library is not fully initialized in this environment.")
-        print(f"Captured intent: Train {args.model} on {args.dataset_csv} with freeze={args.freeze}.")
+
+    cache_path = build_image_cache(paths, res, args.cache_dir, args.num_workers) if args.cache_dir else None
+    train_loader = _make_loader(FrameDataset(paths, labels, res, cache_path), args, sampler, shuffle=True, device=device)
+
+    val_loader = None
+    if args.val_csv:
+        val_paths, _, val_labels = load_labels(args.val_csv, args.problem_type, args.image_root)
+        val_cache = build_image_cache(val_paths, res, args.cache_dir, args.num_workers) if args.cache_dir else None
+        val_loader = _make_loader(FrameDataset(val_paths, val_labels, res, val_cache), args, device=device)
+
+    model, optimizer = _build_model(args, args.problem_type, len(columns), multiclass, device)
+
+    for epoch in range(1, args.epochs + 1):
+        start = time.perf_counter()
+        loss, images, data_wait, compute = run_epoch(model, train_loader, criterion, optimizer, device, multiclass)
+        elapsed = time.perf_counter() - start
+        line = (f"Epoch {epoch}/{args.epochs} | loss {loss:.4f} | {images / elapsed:.1f} images/s | "
+                f"data wait {data_wait:.1f}s ({100 * data_wait / elapsed:.0f}%) | compute {compute:.1f}s")
+        if val_loader is not None:
+            val_loss, _, _, _ = run_epoch(model, val_loader, criterion, optimizer, device, multiclass, train=False)
+            line += f" | val loss {val_loss:.4f}"
+        print(line)
+
+    output = args.output or f"galar_{args.model}_{args.problem_type}.pth"
+    torch.save(model.state_dict(), output)
+    print(f"Saved weights to {output}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Train GalarCapsuleML Models")
     parser.add_argument("--dataset_csv", type=str, required=True, help="Path to the training CSV generated by data_pipeline.py")
-    parser.add_argument("--model", type=str, default="resnet18", choices=["resnet18", "resnet50", "vit_s_16", "vit_b_16", "efficientnet_v2_s"], help="Architecture to fine-tune")
+    parser.add_argument("--val_csv", type=str, default=None, help="Optional validation manifest, evaluated every epoch")
+    parser.add_argument("--image_root", type=str, default=None, help="Root the manifest paths are relative to (default: manifest directory)")
+    parser.add_argument("--model", type=str, default="resnet18", choices=MODELS, help="Architecture to fine-tune")
+    parser.add_argument("--pretrained", action=argparse.BooleanOptionalAction, default=True, help="Start from ImageNet weights (--no-pretrained for offline runs)")
     parser.add_argument("--problem_type", type=str, default="section", help="Classification problem (e.g., section, blood, technical)")
     parser.add_argument("--freeze", action="store_true", help="Freeze backbone (leave only classification head)")
     parser.add_argument("--lr", type=float, default=1e-4, help="Learning Rate")
-    
+    parser.add_argument("--epochs", type=int, default=10, help="Training epochs")
+    parser.add_argument("--batch_size", type=int, default=32, help="Training batch size")
+    parser.add_argument("--device", type=str, default=None, help="cuda or cpu (default: cuda when available)")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads on CPU")
+    parser.add_argument("--output", type=str, default=None, help="Where to save the trained state_dict")
+
+    # Input pipeline
+    parser.add_argument("--num_workers", type=int, default=4, help="DataLoader worker processes")
+    parser.add_argument("--prefetch_factor", type=int, default=4, help="Batches prefetched per worker")
+    parser.add_argument("--img_res", type=int, default=None, choices=CACHE_RESOLUTIONS, help="Training resolution (default: per architecture)")
+    parser.add_argument("--cache_dir", type=str, default=None, help="Build/reuse a pre-resized uint8 memmap image cache here")
+
     # Dataset Imbalance Handlers
     parser.add_argument("--weighted_loss", action="store_true", help="Handle dataset imbalance using Weighted Loss")
     parser.add_argument("--weighted_sampling", action="store_true", help="Handle dataset imbalance using Weighted Sampling")
-    
+
     args = parser.parse_args()
-    
+
     if args.weighted_loss and args.weighted_sampling:
         print("Warning: Typically use either weighted loss OR weighted sampling, not both.")
-        
+
     train_galar(args)
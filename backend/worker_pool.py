@@ -0,0 +1,222 @@
+import itertools
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+import torch.multiprocessing as mp
+
+from models.pipeline import run_policies
+
+
+def load_shared_state_dicts(model_spec):
+    """
+    Loads each torch checkpoint named in `model_spec` once, in the API process, and moves its
+    tensors to shared memory. Passed to the spawned workers through torch.multiprocessing they
+    arrive as handles to the same pages, which build_models assigns into the modules.
+    The ONNX runtime keeps its weights inside the ORT session, so there is nothing to share there.
+    """
+    from models.endo_l2h_wrapper import load_generator_state
+    endo, galar = model_spec["endo"], model_spec["galar"]
+    state_dicts = {}
+    if endo.get("runtime", "torch") == "torch" and endo.get("model_path") and os.path.exists(endo["model_path"]):
+        state_dicts["endo"] = load_generator_state(endo["model_path"])
+    if galar.get("weights_path") and os.path.exists(galar["weights_path"]):
+        state_dicts["galar"] = torch.load(galar["weights_path"], map_location="cpu")
+    for state_dict in state_dicts.values():
+        for tensor in state_dict.values():
+            if isinstance(tensor, torch.Tensor):
+                tensor.share_memory_()
+    return state_dicts
+
+def build_models(model_spec, num_threads, state_dicts=None):
+    """
+    Constructs the wrappers from {"endo": EndoL2HWrapper kwargs, "galar": GalarMLWrapper kwargs}
+    and the shared state_dicts of load_shared_state_dicts (models without one load their files).
+    Runs inside each worker, so no torch/OpenMP/ORT state is ever inherited from the API process.
+    """
+    from models.endo_l2h_wrapper import EndoL2HWrapper
+    from models.galar_ml_wrapper import GalarMLWrapper
+    state_dicts = state_dicts or {}
+    endo_model = EndoL2HWrapper(**{**model_spec["endo"], "num_threads": num_threads, "state_dict": state_dicts.get("endo")})
+    galar_model = GalarMLWrapper(**{**model_spec["galar"], "state_dict": state_dicts.get("galar")})
+    return endo_model, galar_model
+
+def _worker_main(worker_id, model_spec, state_dicts, num_threads, triage_threshold, as_numpy, tasks, results, status):
+    """Worker loop: loads the models, then pulls (task_id, payloads) batches and pushes back (task_id, results, error)."""
+    torch.set_num_threads(num_threads)
+    status["pid"].value = os.getpid()
+    endo_model, galar_model = build_models(model_spec, num_threads, state_dicts)
+    status["loaded"].set()
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        task_id, payloads = task
+        status["busy"].value = 1
+        try:
+            images = [image for image, _ in payloads]
+            policies = [policy for _, policy in payloads]
+            out = run_policies(endo_model, galar_model, images, policies, triage_threshold, as_numpy)
+            results.put((task_id, worker_id, out, None))
+        except Exception as e:
+            results.put((task_id, worker_id, None, f"{type(e).__name__}: {e}"))
+        status["busy"].value = 0
+        status["processed"].value += len(payloads)
+        status["last_active"].value = time.time()
+
+
+class InferencePool:
+    """
+    Process-based inference workers. Workers are spawned (not forked: the API process
+    already runs uvicorn, the event loop, thread pools and initialised torch/OpenMP/ORT
+    threads, whose locks a forked child could inherit held) and each builds its own models
+    from `model_spec`. The weights are loaded once, into shared memory, by start() and assigned
+    into every worker's modules, so N workers map a single copy (see load_shared_state_dicts);
+    ONNX sessions and the non-eager classifier backends, which derive their own weights, are per worker.
+    Each worker runs with its own intra-op thread budget so workers don't fight over cores.
+    """
+
+    def __init__(self, model_spec, num_workers=2, threads_per_worker=1, triage_threshold=0.5, as_numpy=True,
+                 load_timeout=600):
+        self.model_spec = model_spec
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.triage_threshold = triage_threshold
+        self.as_numpy = as_numpy
+        self.load_timeout = load_timeout
+
+        self._ctx = mp.get_context("spawn")
+        self._workers = []
+        self._task_ids = itertools.count()
+        self._pending = {}  # task_id -> (worker_id, Future)
+        self._lock = threading.Lock()
+        self._results = None
+        self._collector = None
+        self._running = False
+
+    def start(self):
+        """Spawns the workers and blocks until every one has loaded its models (run it off the event loop)."""
+        # Kept referenced until the workers have loaded: the parent serves the shared-memory handles
+        state_dicts = load_shared_state_dicts(self.model_spec)
+        self._results = self._ctx.Queue()
+        for worker_id in range(self.num_workers):
+            tasks = self._ctx.Queue()
+            status = {
+                "pid": self._ctx.Value("i", 0),
+                "busy": self._ctx.Value("i", 0),
+                "processed": self._ctx.Value("q", 0),
+                "last_active": self._ctx.Value("d", time.time()),
+                "loaded": self._ctx.Event(),
+            }
+            proc = self._ctx.Process(
+                target=_worker_main,
+                args=(worker_id, self.model_spec, state_dicts, self.threads_per_worker,
+                      self.triage_threshold, self.as_numpy, tasks, self._results, status),
+                daemon=True,
+                name=f"inference-worker-{worker_id}"
+            )
+            proc.start()
+            self._workers.append({"proc": proc, "tasks": tasks, "status": status, "outstanding": 0, "alive": True})
+
+        deadline = time.monotonic() + self.load_timeout
+        for worker_id, w in enumerate(self._workers):
+            while not w["status"]["loaded"].wait(0.5):
+                if not w["proc"].is_alive() or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError(f"Inference worker {worker_id} failed to load its models "
+                                       f"(exit code {w['proc'].exitcode})")
+
+        self._running = True
+        self._collector = threading.Thread(target=self._collect, daemon=True, name="inference-pool-collector")
+        self._collector.start()
+
+    def stop(self):
+        self._running = False
+        for w in self._workers:
+            if w["alive"]:
+                w["tasks"].put(None)
+        for w in self._workers:
+            w["proc"].join(timeout=5)
+            if w["proc"].is_alive():
+                w["proc"].terminate()
+        if self._collector:
+            self._collector.join(timeout=5)
+        self._fail_pending(lambda worker_id: True, RuntimeError("Inference pool stopped"))
+
+    def submit(self, payloads, worker_id=None):
+        """Dispatches a batch of (image, policy) payloads, to the least loaded live worker by default."""
+        future = Future()
+        with self._lock:
+            if worker_id is None:
+                live = [i for i, w in enumerate(self._workers) if w["alive"]]
+                if not live:
+                    raise RuntimeError("No live inference workers")
+                worker_id = min(live, key=lambda i: self._workers[i]["outstanding"])
+            elif not self._workers[worker_id]["alive"]:
+                raise RuntimeError(f"Inference worker {worker_id} is not alive")
+            task_id = next(self._task_ids)
+            self._pending[task_id] = (worker_id, future)
+            self._workers[worker_id]["outstanding"] += 1
+        self._workers[worker_id]["tasks"].put((task_id, list(payloads)))
+        return future
+
+    def run_batch(self, payloads):
+        """Blocking helper, usable as a MicroBatchScheduler process_batch."""
+        return self.submit(payloads).result()
+
+    def _collect(self):
+        while self._running:
+            # Liveness is checked on every iteration: with other workers still returning
+            # results, waiting for a quiet period would leave a dead worker's callers hanging
+            self._check_workers()
+            try:
+                task_id, worker_id, out, error = self._results.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            with self._lock:
+                entry = self._pending.pop(task_id, None)
+                self._workers[worker_id]["outstanding"] -= 1
+            if entry is None:
+                continue
+            _, future = entry
+            if error:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(out)
+
+    def _check_workers(self):
+        # A crashed worker would otherwise leave its callers waiting forever
+        for worker_id, w in enumerate(self._workers):
+            if w["alive"] and not w["proc"].is_alive():
+                w["alive"] = False
+                print(f"Inference worker {worker_id} died (exit code {w['proc'].exitcode})")
+                self._fail_pending(lambda wid: wid == worker_id, RuntimeError(f"Inference worker {worker_id} died"))
+
+    def _fail_pending(self, match, error):
+        with self._lock:
+            failed = [(tid, fut) for tid, (wid, fut) in self._pending.items() if match(wid)]
+            for tid, _ in failed:
+                self._pending.pop(tid)
+        for _, fut in failed:
+            if not fut.done():
+                fut.set_exception(error)
+
+    def stats(self):
+        now = time.time()
+        return [
+            {
+                "worker_id": worker_id,
+                "pid": w["status"]["pid"].value,
+                "alive": w["alive"] and w["proc"].is_alive(),
+                "busy": bool(w["status"]["busy"].value),
+                "queue_depth": w["outstanding"],
+                "frames_processed": w["status"]["processed"].value,
+                "idle_seconds": round(now - w["status"]["last_active"].value, 1),
+                "torch_threads": self.threads_per_worker
+            }
+            for worker_id, w in enumerate(self._workers)
+        ]
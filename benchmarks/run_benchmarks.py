@@ -0,0 +1,278 @@
+"""
+SmartPill inference benchmark suite.
+
+Runs fully offline: without weights (or without lib/) the wrappers fall back to
+their untrained / dummy modes and /process runs in simulated mode, so the numbers
+track pipeline overhead; with real weights in ./weights the same suite measures
+the real models. Results are written as JSON so runs can be diffed across commits:
+
+    python benchmarks/run_benchmarks.py --output benchmarks/results/$(git rev-parse --short HEAD).json
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/old.json benchmarks/results/new.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+from PIL import Image
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+BACKEND_DIR = os.path.join(PROJECT_ROOT, 'backend')
+WEIGHTS_DIR = os.path.join(PROJECT_ROOT, 'weights')
+ENDO_WEIGHTS = os.path.join(WEIGHTS_DIR, 'endol2h_v2.pth')
+GALAR_WEIGHTS = os.path.join(WEIGHTS_DIR, 'galar_resnet50.pth')
+
+sys.path.insert(0, PROJECT_ROOT)
+
+
+def current_rss_mb():
+    # Resident set right now (Linux /proc); ru_maxrss can't be used per benchmark since it
+    # is the process-wide high-water mark and never comes back down
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024.0 * 1024.0)
+    except (OSError, ValueError):
+        return None
+
+class RssSampler:
+    """Samples the resident set every `interval` seconds while active: start, peak and peak - start."""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.start_mb = self.peak_mb = None
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = current_rss_mb()
+        if self.start_mb is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self.start_mb is not None:
+            self._thread.join()
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+        return False
+
+    def stats(self):
+        if self.start_mb is None:
+            return {"peak_rss_mb": None, "rss_growth_mb": None}
+        return {"peak_rss_mb": round(self.peak_mb, 1), "rss_growth_mb": round(self.peak_mb - self.start_mb, 1)}
+
+def summarize(measurement, frames):
+    """(latencies in seconds (one per call), RssSampler) from timed(); frames = total frames processed by those calls."""
+    latencies, rss = measurement
+    lat = np.asarray(latencies) * 1000.0
+    total = float(np.sum(latencies))
+    return {
+        "calls": len(latencies),
+        "frames": frames,
+        "frames_per_second": round(frames / total, 2) if total > 0 else 0.0,
+        "p50_ms": round(float(np.percentile(lat, 50)), 3),
+        "p95_ms": round(float(np.percentile(lat, 95)), 3),
+        "p99_ms": round(float(np.percentile(lat, 99)), 3),
+        **rss.stats()
+    }
+
+def timed(fn, repeats, warmup=1):
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    # Memory is sampled over the measured calls only, so each benchmark reports its own peak
+    with RssSampler() as rss:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            fn()
+            latencies.append(time.perf_counter() - start)
+    return latencies, rss
+
+def synthetic_frames(n, size=336, seed=0):
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 256, (size, size, 3), dtype=np.uint8) for _ in range(n)]
+
+# --- BENCHMARKS ---
+def bench_wrappers(args, results):
+    from backend.models.endo_l2h_wrapper import EndoL2HWrapper
+    from backend.models.galar_ml_wrapper import GalarMLWrapper
+
+    endo = EndoL2HWrapper(ENDO_WEIGHTS)
+    galar = GalarMLWrapper('resnet50', GALAR_WEIGHTS)
+    frames = synthetic_frames(args.frames)
+
+    results["endo_single"] = summarize(timed(lambda: endo.upscale(frames[0]), args.frames), args.frames)
+    results["galar_single"] = summarize(timed(lambda: galar.predict(frames[0]), args.frames), args.frames)
+
+    for batch_size in args.batch_sizes:
+        batch = frames[:batch_size]
+        repeats = max(1, args.frames // batch_size)
+        results[f"endo_batch_{batch_size}"] = summarize(
+            timed(lambda: endo.upscale_batch(batch, batch_size=batch_size), repeats), repeats * len(batch))
+        results[f"galar_batch_{batch_size}"] = summarize(
+            timed(lambda: galar.predict_batch(batch, batch_size=batch_size), repeats), repeats * len(batch))
+
+def bench_pipeline(args, results, workdir):
+    import main_inference
+
+    frame_dir = os.path.join(workdir, "study")
+    os.makedirs(frame_dir, exist_ok=True)
+    for i, frame in enumerate(synthetic_frames(args.frames)):
+        Image.fromarray(frame).save(os.path.join(frame_dir, f"frame_{i:05d}.png"))
+    first_frame = os.path.join(frame_dir, "frame_00000.png")
+    out_dir = os.path.join(workdir, "pipeline_out")
+
+    # run_pipeline rebuilds both wrappers per call, which is exactly the per-frame CLI cost
+    repeats = max(1, args.frames // 8)
+    results["run_pipeline"] = summarize(
+        timed(lambda: main_inference.run_pipeline(first_frame, ENDO_WEIGHTS, GALAR_WEIGHTS, out_dir), repeats, warmup=0),
+        repeats)
+    results["run_study"] = summarize(
+        timed(lambda: main_inference.run_study(frame_dir, ENDO_WEIGHTS, GALAR_WEIGHTS, out_dir), 1, warmup=0),
+        args.frames)
+
+def bench_database(args, results):
+    import database
+
+    for history in args.history_sizes:
+        # Fresh table per size, pre-filled in one transaction
+        with database.transaction() as conn:
+            conn.execute("DELETE FROM missions")
+            rows = []
+            for i in range(history):
+                mission = {"id": f"seed-{i}", "timestamp": f"2024-01-01T00:00:00.{i:06d}", "type": "AI_ANALYSIS",
+                           "source": f"seed_{i}.png", "results": {"polyp": 0.1}}
+                rows.append(database._mission_row(mission))
+            conn.executemany(
+                "INSERT INTO missions (id, timestamp, type, source, patient_id, data) VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+        mission = lambda: database.add_mission({"type": "AI_ANALYSIS", "source": "bench.png",
+                                                "results": {"polyp": 0.5}, "image": "/results/bench_hr.png"})
+        results[f"add_mission_history_{history}"] = summarize(timed(mission, args.db_writes), args.db_writes)
+
+def bench_http(args, results):
+    from fastapi.testclient import TestClient
+    import main
+
+    payload = Image.fromarray(synthetic_frames(1)[0])
+    path = os.path.join(main.UPLOAD_DIR, "bench_source.png")
+    payload.save(path)
+    with open(path, "rb") as f:
+        body = f.read()
+
+    with TestClient(main.app) as client:
+        deadline = time.time() + args.ready_timeout
+        while client.get("/health/ready").status_code != 200:
+            if time.time() > deadline:
+                raise RuntimeError("Backend did not become ready in time")
+            time.sleep(0.1)
+
+        def one_request(_):
+            start = time.perf_counter()
+            resp = client.post("/process", files={"file": ("bench.png", body, "image/png")})
+            resp.raise_for_status()
+            return time.perf_counter() - start
+
+        for concurrency in args.concurrency:
+            n = max(args.frames, concurrency)
+            with ThreadPoolExecutor(max_workers=concurrency) as pool, RssSampler() as rss:
+                start = time.perf_counter()
+                latencies = list(pool.map(one_request, range(n)))
+                wall = time.perf_counter() - start
+            stats = summarize((latencies, rss), n)
+            # Under concurrency throughput is frames over wall time, not over summed latency
+            stats["frames_per_second"] = round(n / wall, 2)
+            stats["mode"] = main.model_state["status"]
+            results[f"process_concurrency_{concurrency}"] = stats
+
+# --- REPORTING ---
+def environment():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=PROJECT_ROOT, text=True).strip()
+    except Exception:
+        commit = None
+    try:
+        import torch
+        torch_version, torch_threads = torch.__version__, torch.get_num_threads()
+    except ImportError:
+        torch_version, torch_threads = None, None
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch_version,
+        "torch_threads": torch_threads,
+        "real_weights": os.path.exists(ENDO_WEIGHTS) and os.path.exists(GALAR_WEIGHTS)
+    }
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)["results"]
+    with open(new_path) as f:
+        new = json.load(f)["results"]
+    print(f"{'benchmark':36s} {'fps old':>10s} {'fps new':>10s} {'p99 old':>10s} {'p99 new':>10s} {'fps delta':>10s}")
+    for name in sorted(set(old) & set(new)):
+        o, n = old[name], new[name]
+        delta = (n["frames_per_second"] / o["frames_per_second"] - 1) * 100 if o["frames_per_second"] else 0.0
+        print(f"{name:36s} {o['frames_per_second']:10.2f} {n['frames_per_second']:10.2f} "
+              f"{o['p99_ms']:10.2f} {n['p99_ms']:10.2f} {delta:+9.1f}%")
+
+SUITES = ["wrappers", "pipeline", "database", "http"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SmartPill inference benchmarks")
+    parser.add_argument("--suites", nargs="+", default=SUITES, choices=SUITES, help="Which benchmark groups to run")
+    parser.add_argument("--frames", type=int, default=32, help="Frames per measurement")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4, 8, 16], help="Batch sizes for the batched wrapper calls")
+    parser.add_argument("--history_sizes", type=int, nargs="+", default=[0, 1000, 10000, 100000], help="Mission history sizes for add_mission")
+    parser.add_argument("--db_writes", type=int, default=200, help="add_mission calls per history size")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Concurrent /process clients")
+    parser.add_argument("--ready_timeout", type=float, default=600, help="Seconds to wait for the backend to become ready")
+    parser.add_argument("--output", default=None, help="JSON results path (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Diff two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    output = os.path.abspath(args.output) if args.output else os.path.join(PROJECT_ROOT, "benchmarks", "results", f"{datetime.now():%Y%m%d_%H%M%S}.json")
+    results = {}
+
+    # Everything the backend writes (database, uploads, results, cache) goes to a scratch dir
+    with tempfile.TemporaryDirectory(prefix="smartpill_bench_") as workdir:
+        os.environ["SMARTPILL_DATA_DIR"] = os.path.join(workdir, "data")
+        os.environ["SMARTPILL_CACHE"] = "0"
+        os.chdir(workdir)
+        sys.path.insert(0, BACKEND_DIR)
+
+        for suite in args.suites:
+            print(f"--- Running {suite} benchmarks ---")
+            if suite == "wrappers":
+                bench_wrappers(args, results)
+            elif suite == "pipeline":
+                bench_pipeline(args, results, workdir)
+            elif suite == "database":
+                bench_database(args, results)
+            elif suite == "http":
+                bench_http(args, results)
+        os.chdir(PROJECT_ROOT)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"environment": environment(), "results": results}, f, indent=4)
+    print(f"Benchmark results saved to {output}")
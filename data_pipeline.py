@@ -1,6 +1,8 @@
 import os
-import glob
 import argparse
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 from PIL import Image
 
@@ -9,62 +11,316 @@ SECTIONS = ["outside", "mouth", "esophagus", "stomach", "small intestine", "colo
 ABNORMALITIES = ["polyp", "ulcer", "blood", "erosion", "clear"]
 TECHNICAL = ["bubbles", "dirt", "good view", "reduced view", "no view"]
 
+MANIFEST_FORMATS = ["csv", "parquet", "arrow"]
+FILE_COLUMNS = ["frame_id", "file_size", "width", "height"]
+STAT_COLUMNS = ["brightness", "blur_score", "bubble_score"]
+
+def manifest_format(path):
+    """Manifest format implied by a file extension (.parquet, .arrow/.feather, anything else is CSV)."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".parquet":
+        return "parquet"
+    if ext in (".arrow", ".feather", ".ipc"):
+        return "arrow"
+    return "csv"
+
+def frame_id(relative_path):
+    """Stable 64-bit id from the dataset-relative path, independent of row order or ingestion run."""
+    digest = hashlib.blake2b(relative_path.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+def frame_statistics(path, with_stats=False, stats_size=256):
+    """
+    File size and image dimensions (header only), plus optionally cheap quality stats
+    on a downsampled grayscale copy: mean brightness, Laplacian variance (low = blurry)
+    and the fraction of near-saturated pixels (specular highlights from bubbles).
+    """
+    row = {"file_size": -1, "width": -1, "height": -1}
+    if with_stats:
+        row.update({c: np.nan for c in STAT_COLUMNS})
+    try:
+        row["file_size"] = os.path.getsize(path)
+        with Image.open(path) as img:
+            row["width"], row["height"] = img.size
+            if with_stats:
+                gray = img.convert("L")
+                gray.thumbnail((stats_size, stats_size))
+                a = np.asarray(gray, dtype=np.float32)
+                lap = 4 * a[1:-1, 1:-1] - a[:-2, 1:-1] - a[2:, 1:-1] - a[1:-1, :-2] - a[1:-1, 2:]
+                row["brightness"] = float(a.mean())
+                row["blur_score"] = float(lap.var())
+                row["bubble_score"] = float((a >= 240).mean())
+    except OSError as e:
+        print(f"Could not read {path}: {e}")
+    return row
+
+def _frame_statistics_stats(path):
+    return frame_statistics(path, with_stats=True)
+
+def describe_frames(paths, with_stats=False, pool=None, workers=None, chunksize=64):
+    """Per-frame file columns (and stats) for `paths`, computed in parallel across processes."""
+    fn = _frame_statistics_stats if with_stats else frame_statistics
+    if pool is not None:
+        rows = list(pool.map(fn, paths, chunksize=chunksize))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows = list(pool.map(fn, paths, chunksize=chunksize))
+    columns = ["file_size", "width", "height"] + (STAT_COLUMNS if with_stats else [])
+    df = pd.DataFrame(rows, columns=columns)
+    return df.astype({"file_size": np.int64, "width": np.int32, "height": np.int32})
+
+def typed_manifest(df):
+    """Casts one-hot label columns to uint8 so Parquet/Arrow store them compactly."""
+    onehot = [c for c in SECTIONS + ABNORMALITIES + TECHNICAL if c in df.columns]
+    return df.astype({c: np.uint8 for c in onehot})
+
+# Declared Arrow types of the manifest columns this module writes, so the schema never
+# depends on what the first chunk happens to contain (e.g. an all-None depth_map column)
+STRING_COLUMNS = ["path", "filename", "depth_map"]
+COLUMN_TYPES = {"frame_id": "int64", "file_size": "int64", "width": "int32", "height": "int32",
+                **{c: "float64" for c in STAT_COLUMNS}}
+
+def _arrow_schema(df):
+    import pyarrow as pa
+    onehot = set(SECTIONS + ABNORMALITIES + TECHNICAL)
+    fields = []
+    for c in df.columns:
+        if c in onehot:
+            t = pa.uint8()
+        elif c in STRING_COLUMNS:
+            t = pa.string()
+        elif c in COLUMN_TYPES:
+            t = pa.type_for_alias(COLUMN_TYPES[c])
+        else:
+            # Other columns (e.g. label CSVs in preprocess.py): object columns are always strings
+            t = pa.string() if df[c].dtype == object else pa.from_numpy_dtype(df[c].dtype)
+        fields.append(pa.field(c, t))
+    return pa.schema(fields)
+
+def _scan_run(unity_export_dir):
+    """
+    Lists one VR-Caps export with a single directory scan per folder.
+    Returns (frame_dir, sorted frame names, depth_dir, set of depth map names).
+    """
+    rgb_dir = os.path.join(unity_export_dir, "RGB")
+    frame_dir = rgb_dir if os.path.isdir(rgb_dir) else unity_export_dir
+    names = sorted(e.name for e in os.scandir(frame_dir) if e.is_file() and e.name.endswith(".png"))
+    if frame_dir != rgb_dir:
+        names = [n for n in names if not n.endswith("_depth.png")]
+    
+    depth_dir = os.path.join(unity_export_dir, "Depth") if frame_dir == rgb_dir else frame_dir
+    depth_names = set()
+    if os.path.isdir(depth_dir):
+        depth_names = {e.name for e in os.scandir(depth_dir) if e.name.endswith("_depth.png")}
+    return frame_dir, names, depth_dir, depth_names
+
+def _frames_chunk(names, dataset_name, default_section, frame_dir, depth_dir, depth_names, with_file_info=False,
+                  with_stats=False, pool=None):
+    """
+    Builds the Galar-format rows for a chunk of frame names with column-wise arrays instead of per-row dicts.
+    Frame files are only opened when file info or stats are requested.
+    """
+    n = len(names)
+    columns = {}
+    # 1. Section (Multiclass)
+    for s in SECTIONS:
+        columns[s] = np.full(n, 1 if s == default_section else 0, dtype=np.uint8)
+    # 2. Path (Galar docs show 'path' at the end of the section problem:
+    # "outside,mouth,esophagus,stomach,small intestine,colon,path")
+    # We need relative paths for GalarCapsuleML datasets usually
+    columns["path"] = [f"{dataset_name}/{name}" for name in names]
+    # Abnormalities (multi-label): we assume clean synthetic data by default
+    for a in ABNORMALITIES:
+        columns[a] = np.full(n, 1 if a == "clear" else 0, dtype=np.uint8)
+    # Optional depth map linking for our own records, matched by name against the Depth listing
+    depth = [name.replace(".png", "_depth.png") for name in names]
+    columns["depth_map"] = [os.path.join(depth_dir, d) if d in depth_names else None for d in depth]
+    if with_file_info:
+        columns["frame_id"] = np.array([frame_id(p) for p in columns["path"]], dtype=np.int64)
+    df = pd.DataFrame(columns)
+    if not with_file_info:
+        return df
+    info = describe_frames([os.path.join(frame_dir, name) for name in names], with_stats, pool=pool)
+    return pd.concat([df, info], axis=1)
+
+class ManifestWriter:
+    """
+    Appends DataFrame chunks to a CSV, Parquet or Arrow IPC file so memory stays flat.
+    Parquet chunks become row groups (so filtered reads can skip them), Arrow chunks
+    become record batches of an IPC file that load_manifest memory-maps.
+    """
+    
+    def __init__(self, path, fmt=None):
+        self.path = path
+        self.fmt = fmt or manifest_format(path)
+        if self.fmt not in MANIFEST_FORMATS:
+            raise ValueError(f"Unknown manifest format '{self.fmt}', expected one of {MANIFEST_FORMATS}")
+        self.rows = 0
+        self._schema = None
+        self._writer = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if self.fmt == "csv" and os.path.exists(path):
+            os.remove(path)
+    
+    def write(self, df):
+        if self.fmt == "csv":
+            df.to_csv(self.path, mode="a", header=self.rows == 0, index=False)
+        else:
+            import pyarrow as pa
+            if self._schema is None:
+                self._schema = _arrow_schema(df)
+                if self.fmt == "parquet":
+                    import pyarrow.parquet as pq
+                    self._writer = pq.ParquetWriter(self.path, self._schema)
+                else:
+                    self._writer = pa.ipc.new_file(self.path, self._schema)
+            table = pa.Table.from_pandas(df, schema=self._schema, preserve_index=False)
+            self._writer.write_table(table)
+        self.rows += len(df)
+    
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+def write_manifest(df, path, fmt=None, chunk_size=50000):
+    """Writes a whole manifest DataFrame (typed one-hot columns) as CSV, Parquet or Arrow IPC."""
+    df = typed_manifest(df)
+    writer = ManifestWriter(path, fmt)
+    try:
+        for i in range(0, max(len(df), 1), chunk_size):
+            writer.write(df.iloc[i:i + chunk_size])
+    finally:
+        writer.close()
+    return writer.rows
+
+def load_manifest(path, columns=None, sections=None, abnormalities=None, min_brightness=None, min_blur=None,
+                  max_bubbles=None, as_table=False):
+    """
+    Loads a manifest, keeping only rows labelled with any of `sections` / any of
+    `abnormalities` and passing the optional stat thresholds. Arrow IPC files are
+    memory-mapped and Parquet files are read with row-group pruning, so selecting a
+    subset does not parse the whole file. CSV manifests are still supported (full read).
+    Returns a DataFrame, or a pyarrow Table with as_table=True (Arrow/Parquet only).
+    """
+    fmt = manifest_format(path)
+    if fmt == "csv":
+        df = pd.read_csv(path)
+        mask = np.ones(len(df), dtype=bool)
+        if sections:
+            mask &= (df[sections] == 1).any(axis=1).to_numpy()
+        if abnormalities:
+            mask &= (df[abnormalities] == 1).any(axis=1).to_numpy()
+        if min_brightness is not None:
+            mask &= (df["brightness"] >= min_brightness).to_numpy()
+        if min_blur is not None:
+            mask &= (df["blur_score"] >= min_blur).to_numpy()
+        if max_bubbles is not None:
+            mask &= (df["bubble_score"] <= max_bubbles).to_numpy()
+        df = df[mask]
+        return df[columns] if columns else df
+    
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    
+    expr = None
+    def _and(e):
+        return e if expr is None else expr & e
+    def _any(names):
+        e = pc.field(names[0]) == 1
+        for name in names[1:]:
+            e = e | (pc.field(name) == 1)
+        return e
+    if sections:
+        expr = _and(_any(sections))
+    if abnormalities:
+        expr = _and(_any(abnormalities))
+    if min_brightness is not None:
+        expr = _and(pc.field("brightness") >= min_brightness)
+    if min_blur is not None:
+        expr = _and(pc.field("blur_score") >= min_blur)
+    if max_bubbles is not None:
+        expr = _and(pc.field("bubble_score") <= max_bubbles)
+    
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        table = pq.read_table(path, columns=columns, filters=expr, memory_map=True)
+    else:
+        # Zero-copy: record batches point straight into the mapped file
+        table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        if expr is not None:
+            table = table.filter(expr)
+        if columns:
+            table = table.select(columns)
+    return table if as_table else table.to_pandas()
+
+def IngestVRCapsRuns(unity_export_dirs, output_path, default_section="small intestine", dataset_names=None,
+                     output_format=None, chunk_size=50000, workers=4, with_stats=False, with_file_info=None):
+    """
+    Ingests several VR-Caps export directories (runs) into one GalarCapsuleML manifest.
+    Runs are scanned in parallel; rows are then generated and written in chunks
+    (CSV, Parquet or Arrow IPC, picked from the extension unless output_format is given).
+    with_file_info adds a stable frame_id, file size and image dimensions (default: on
+    for Parquet/Arrow, off for CSV, whose columns stay the classic Galar layout);
+    with_stats adds brightness / blur / bubble scores and implies with_file_info.
+    Either one opens every frame, in a process pool.
+    """
+    # Same name space as the single-run CLI always used, so regenerated manifests keep their paths
+    dataset_names = dataset_names or [f"vrcaps_run{i + 1}" for i in range(len(unity_export_dirs))]
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        scans = list(pool.map(_scan_run, unity_export_dirs))
+    
+    writer = ManifestWriter(output_path, output_format)
+    if with_file_info is None:
+        with_file_info = writer.fmt != "csv"
+    with_file_info = with_file_info or with_stats
+    
+    # Column set has to be fixed before the first chunk is written
+    has_depth = any(depth_names for _, _, _, depth_names in scans)
+    cols = SECTIONS + ["path"] + ABNORMALITIES + (["depth_map"] if has_depth else [])
+    cols += (FILE_COLUMNS if with_file_info else []) + (STAT_COLUMNS if with_stats else [])
+    
+    # The process pool is only started when frames have to be opened
+    pool = ProcessPoolExecutor(max_workers=workers) if with_file_info else None
+    try:
+        for (frame_dir, names, depth_dir, depth_names), dataset_name in zip(scans, dataset_names):
+            for i in range(0, len(names), chunk_size):
+                chunk = _frames_chunk(names[i:i + chunk_size], dataset_name, default_section, frame_dir,
+                                      depth_dir, depth_names, with_file_info, with_stats, pool)
+                writer.write(chunk[cols])
+            print(f"Run {dataset_name}: {len(names)} frames from {frame_dir}")
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.shutdown()
+    
+    print(f"Synthetic data ingested: {writer.rows} frames.")
+    print(f"Formatted metadata saved to: {output_path}")
+    return writer.rows
+
 def IngestVRCaps(unity_export_dir, output_meta_csv, default_section="small intestine", dataset_name="vrcaps"):
     """
     Ingests synthetic sequences from VR-Caps and formats to GalarCapsuleML specification.
     Format expects one-hot encoding for the classes + a path column at the end.
     Example: outside,mouth,esophagus,stomach,small intestine,colon,path
     """
-    frames = sorted(glob.glob(os.path.join(unity_export_dir, "RGB", "*.png")))
-    if not frames:
-        frames = sorted(glob.glob(os.path.join(unity_export_dir, "*.png")))
-        
-    data = []
-    
-    for frame_path in frames:
-        # We need relative paths for GalarCapsuleML datasets usually
-        rel_path = f"{dataset_name}/{os.path.basename(frame_path)}"
-        
-        row = {}
-        # 1. Section (Multiclass)
-        for s in SECTIONS:
-            row[s] = 1 if s == default_section else 0
-            
-        # 2. Path (Must be the last column as per Galar schema usually, or we can just emit one large CSV)
-        # Note: Galar docs show 'path' at the end of the section problem: 
-        # "outside,mouth,esophagus,stomach,small intestine,colon,path"
-        row["path"] = rel_path
-        
-        # Optionally add abnormalities if needed (multi-label)
-        # We assume clean synthetic data by default unless specified
-        for a in ABNORMALITIES:
-            row[a] = 1 if a == "clear" else 0
-            
-        # Optional depth map linking for our own records
-        depth_path = frame_path.replace("RGB", "Depth").replace(".png", "_depth.png")
-        if os.path.exists(depth_path):
-            row["depth_map"] = depth_path
-            
-        data.append(row)
-        
-    df = pd.DataFrame(data)
-    
-    # Reorder columns to ensure 'path' is placed where Galar code expects it for the 'section' problem
-    # For a general dataset file, we can keep them all.
-    cols = SECTIONS + ["path"] + ABNORMALITIES + ([c for c in df.columns if c == "depth_map"])
-    df = df[cols]
-    
-    os.makedirs(os.path.dirname(os.path.abspath(output_meta_csv)), exist_ok=True)
-    df.to_csv(output_meta_csv, index=False)
-    print(f"Synthetic data ingested: {len(df)} frames.")
-    print(f"Formatted metadata saved to: {output_meta_csv}")
+    return IngestVRCapsRuns([unity_export_dir], output_meta_csv, default_section, [dataset_name])
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Ingest VR-Caps synthetic data for ML pipeline")
-    parser.add_argument("--input_dir", type=str, required=True, help="Directory containing RGB frames from Unity")
-    parser.add_argument("--output_csv", type=str, default="./synthetic_dataset.csv", help="Output CSV path")
+    parser.add_argument("--input_dir", type=str, nargs="+", required=True, help="Directory (or directories, one per run) containing RGB frames from Unity")
+    parser.add_argument("--output_csv", type=str, default="./synthetic_dataset.csv", help="Output manifest path (.csv, .parquet or .arrow)")
+    parser.add_argument("--output_format", type=str, default=None, choices=MANIFEST_FORMATS, help="Override the format implied by the output extension")
     parser.add_argument("--section", type=str, default="small intestine", choices=SECTIONS, help="Default anatomical section")
-    parser.add_argument("--dataset_name", type=str, default="vrcaps_run1", help="Dataset name space for relative paths")
+    parser.add_argument("--dataset_name", type=str, nargs="+", default=None, help="Dataset name space(s) for relative paths, one per input dir (default: vrcaps_run1, vrcaps_run2, ...)")
+    parser.add_argument("--chunk_size", type=int, default=50000, help="Rows generated and written per chunk")
+    parser.add_argument("--workers", type=int, default=4, help="Runs scanned / frames described in parallel")
+    parser.add_argument("--with_stats", action="store_true", help="Precompute brightness, blur and bubble scores per frame")
+    parser.add_argument("--with_file_info", action=argparse.BooleanOptionalAction, default=None,
+                        help="Add frame_id, file size and image dimensions (default: on for .parquet/.arrow, off for CSV)")
     
     args = parser.parse_args()
-    IngestVRCaps(args.input_dir, args.output_csv, args.section, args.dataset_name)
+    if args.dataset_name and len(args.dataset_name) != len(args.input_dir):
+        parser.error("--dataset_name needs one name per --input_dir")
+    IngestVRCapsRuns(args.input_dir, args.output_csv, args.section, args.dataset_name,
+                     args.output_format, args.chunk_size, args.workers, args.with_stats, args.with_file_info)
@@ -1,42 +1,67 @@
 import os
+import glob
+import time
+import queue
 import argparse
+import itertools
+import threading
 import json
 from backend.models.endo_l2h_wrapper import EndoL2HWrapper
 from backend.models.galar_ml_wrapper import GalarMLWrapper
+from backend.models.pipeline import (POLICIES, POLICY_FULL, chunks, POLICY_TRIAGE, ABNORMALITY_KEYS, find_abnormalities,
+                                     first_passes, gate_policies, second_passes, run_policy)
+from backend.models.frame_quality import QualityGate
+from backend.models.study_aggregator import StudyAggregator
+from backend.models.frame_dedup import DEDUP_METHODS, KeyframeSelector, iter_keyframe_groups
 from PIL import Image
 
-def run_pipeline(image_path, endo_weights, galar_weights, output_dir, galar_model_arch='resnet50', upscaling_factor=8):
-    os.makedirs(output_dir, exist_ok=True)
-    
-    print("--- Initializing End-to-End SmartPill Pipeline ---")
-    
-    # 1. Initialize Wrappers
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+VIDEO_EXTS = ('.mp4', '.avi', '.mov', '.mkv')
+
+def load_models(endo_weights, galar_weights, galar_model_arch='resnet50', upscaling_factor=8):
     print(f"Loading EndoL2H (Upsampling factor: {upscaling_factor}x)...")
     endo_model = EndoL2HWrapper(endo_weights, scale_factor=upscaling_factor)
     
     print(f"Loading GalarCapsuleML ({galar_model_arch})...")
     galar_model = GalarMLWrapper(galar_model_arch, galar_weights)
+    return endo_model, galar_model
+
+def run_pipeline(image_path, endo_weights, galar_weights, output_dir, galar_model_arch='resnet50', upscaling_factor=8,
+                 policy=POLICY_FULL, triage_threshold=0.5, tiled=False, tile_size=128, tile_overlap=16, max_tile_memory_mb=1024):
+    if tiled and policy != POLICY_FULL:
+        raise ValueError(f"Tiled SR only applies to the '{POLICY_FULL}' policy (got '{policy}')")
+    os.makedirs(output_dir, exist_ok=True)
+    
+    print("--- Initializing End-to-End SmartPill Pipeline ---")
     
-    print(f"--- Processing Image: {image_path} ---")
+    # 1. Initialize Wrappers
+    endo_model, galar_model = load_models(endo_weights, galar_weights, galar_model_arch, upscaling_factor)
     
-    # 2. Image Enhancement
-    hr_img = endo_model.upscale(image_path)
-    hr_path = os.path.join(output_dir, "enhanced_hr.png")
-    hr_img.save(hr_path)
-    print(f"Enhanced High-Resolution image saved to {hr_path}")
+    print(f"--- Processing Image: {image_path} (policy: {policy}) ---")
     
-    # 3. Disease Classification & Localization
-    predictions = galar_model.predict(hr_img)
+    # 2. Image Enhancement + 3. Disease Classification & Localization, ordered by the policy
+    if tiled and policy == POLICY_FULL:
+        # Native-resolution SR in overlapping tiles instead of downscaling to 128 px first
+        hr_img = endo_model.upscale_tiled(image_path, tile_size, tile_overlap, max_memory_mb=max_tile_memory_mb)
+        predictions = galar_model.predict(hr_img)
+    else:
+        hr_img, predictions = run_policy(endo_model, galar_model, [image_path], policy, triage_threshold)[0]
+    hr_path = None
+    if hr_img is not None:
+        hr_path = os.path.join(output_dir, "enhanced_hr.png")
+        hr_img.save(hr_path)
+        print(f"Enhanced High-Resolution image saved to {hr_path}")
     
     # 4. Generate Clinical Report
     # Check for abnormalities thresholding > 0.5 probability
-    abnormalities = {k: v for k, v in predictions.items() if k in ['polyp', 'ulcer', 'blood', 'erosion'] and v > 0.5}
+    abnormalities = find_abnormalities(predictions)
     
     report = {
         "metadata": {
             "pipeline_version": "2.4.0",
             "input_file": image_path,
             "enhanced_file": hr_path,
+            "pipeline_policy": policy,
             "super_resolution_model": "EndoL2H",
             "classification_model": f"GalarCapsuleML_{galar_model_arch}"
         },
@@ -54,19 +79,257 @@ def run_pipeline(image_path, endo_weights, galar_weights, output_dir, galar_mode
     print(f"Clinical report generated at {report_path}")
     return report
 
+# --- STUDY MODE ---
+def iter_study_frames(source):
+    """
+    Yields (frame_id, PIL image) for every frame of a study.
+    `source` can be a directory of frames, a glob pattern or a video file.
+    """
+    if os.path.isdir(source):
+        paths = sorted(e.path for e in os.scandir(source) if e.is_file() and e.name.lower().endswith(IMAGE_EXTS))
+    elif source.lower().endswith(VIDEO_EXTS):
+        import cv2
+        cap = cv2.VideoCapture(source)
+        try:
+            for idx in itertools.count():
+                ok, frame = cap.read()
+                if not ok:
+                    return
+                yield f"frame_{idx:06d}", Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        finally:
+            cap.release()
+        return
+    else:
+        paths = sorted(glob.glob(source))
+    
+    for path in paths:
+        yield os.path.basename(path), Image.open(path).convert('RGB')
+
+_STAGE_DONE = object()
+
+class _StageError:
+    def __init__(self, exc):
+        self.exc = exc
+
+def _threaded_stage(iterable, maxsize):
+    """
+    Drains `iterable` on a background thread into a bounded queue and yields its items.
+    Chaining these lets decode, SR and classification overlap while the queue
+    bound keeps memory constant regardless of study length.
+    """
+    q = queue.Queue(maxsize=maxsize)
+    
+    def worker():
+        try:
+            for item in iterable:
+                q.put(item)
+            q.put(_STAGE_DONE)
+        except BaseException as e:
+            q.put(_StageError(e))
+    
+    threading.Thread(target=worker, daemon=True).start()
+    while True:
+        item = q.get()
+        if item is _STAGE_DONE:
+            return
+        if isinstance(item, _StageError):
+            raise item.exc
+        yield item
+
+class _TimedSR:
+    """
+    Proxy for the SR model that times upscale_batch calls, whichever pass or policy makes them.
+    Used to estimate what the quality gate saved; gated frames never reach it.
+    """
+    def __init__(self, model):
+        self._model = model
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.seconds = 0.0
+    
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+    
+    def upscale_batch(self, images, **kwargs):
+        t0 = time.perf_counter()
+        out = self._model.upscale_batch(images, **kwargs)
+        with self._lock:
+            self.frames += len(images)
+            self.seconds += time.perf_counter() - t0
+        return out
+
+def run_study(source, endo_weights, galar_weights, output_dir, galar_model_arch='resnet50', upscaling_factor=8,
+              batch_size=8, queue_size=4, save_hr=False, policy=POLICY_FULL, triage_threshold=0.5,
+              dedup=False, dedup_threshold=0.95, dedup_max_skip=30, dedup_method="dhash",
+              quality_gate=False, quality_threshold=0.3, fps=None, smoothing_window=5, top_k=5):
+    """
+    Streams a whole study through decode -> upscale -> classify -> report with
+    bounded queues between stages, and writes one aggregated report
+    (per-frame rows plus a study summary) incrementally.
+    With `dedup`, runs of near-identical frames only send their keyframe through
+    the models; the other frames reuse its predictions and point to it with "duplicate_of".
+    With `quality_gate`, frames below `quality_threshold` skip SR, are classified on the
+    raw frame and reported as non-diagnostic (no findings).
+    The summary's clinical_aggregation (abnormal segments, section transit times,
+    top-K frames per finding) is built incrementally as rows are written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    hr_dir = os.path.join(output_dir, "enhanced")
+    if save_hr:
+        os.makedirs(hr_dir, exist_ok=True)
+    
+    print("--- Initializing SmartPill Study Pipeline ---")
+    endo_model, galar_model = load_models(endo_weights, galar_weights, galar_model_arch, upscaling_factor)
+    
+    print(f"--- Processing Study: {source} ---")
+    start = time.perf_counter()
+    
+    # 1. Decode -> 2. First model pass -> 3. Second model pass, each stage on its own thread.
+    # With the default policy that's upscale then classify; triage classifies first.
+    # Batches are made of (frame_id, image, duplicate ids) groups; without dedup every group is a single frame
+    selector = KeyframeSelector(dedup_threshold, dedup_max_skip, dedup_method) if dedup else None
+    frames = iter_study_frames(source)
+    groups = iter_keyframe_groups(frames, selector) if dedup else ((fid, img, []) for fid, img in frames)
+    decoded = _threaded_stage(chunks(groups, batch_size), queue_size)
+    
+    gate = QualityGate(quality_threshold) if quality_gate else None
+    sr_model = _TimedSR(endo_model) if gate else endo_model
+    
+    def first_stage(chunk):
+        images = [img for _, img, _ in chunk]
+        policies, assessments = gate_policies(gate, images, [policy] * len(images))
+        state = first_passes(sr_model, galar_model, images, policies)
+        return [(fid, dups, a) for (fid, _, dups), a in zip(chunk, assessments)], state
+    
+    first = _threaded_stage((first_stage(chunk) for chunk in decoded), queue_size)
+    classified = _threaded_stage(
+        ((ids, second_passes(sr_model, galar_model, state, triage_threshold)) for ids, state in first), queue_size)
+    
+    metadata = {
+        "pipeline_version": "2.4.0",
+        "input_source": source,
+        "pipeline_policy": policy,
+        "super_resolution_model": "EndoL2H",
+        "classification_model": f"GalarCapsuleML_{galar_model_arch}"
+    }
+    aggregator = StudyAggregator(galar_model.classes, window=smoothing_window, top_k=top_k, fps=fps)
+    finding_counts = {k: 0 for k in ABNORMALITY_KEYS}
+    abnormal_frames = 0
+    n_frames = 0
+    
+    # 4. Report: rows are written as they arrive so memory stays flat
+    report_path = os.path.join(output_dir, "study_report.json")
+    with open(report_path, "w") as f:
+        f.write('{\n"metadata": ' + json.dumps(metadata) + ',\n"frames": [\n')
+        
+        for ids, results in classified:
+            chunk_preds, chunk_ids, chunk_diagnostic = [], [], []
+            for (frame_id, duplicates, assessment), (hr_img, preds) in zip(ids, results):
+                non_diagnostic = bool(assessment and assessment["non_diagnostic"])
+                findings = {} if non_diagnostic else find_abnormalities(preds)
+                # Skipped duplicates are still frames of the study and count towards the findings
+                for k in findings:
+                    finding_counts[k] += 1 + len(duplicates)
+                abnormal_frames += bool(findings) * (1 + len(duplicates))
+                
+                row = {"frame_id": frame_id, "predictions": preds, "findings": findings}
+                if assessment:
+                    row["quality"] = assessment
+                    if non_diagnostic:
+                        row["non_diagnostic"] = True
+                if duplicates:
+                    row["duplicates"] = duplicates
+                if save_hr and hr_img is not None:
+                    row["enhanced_file"] = os.path.join(hr_dir, f"{os.path.splitext(frame_id)[0]}_hr.png")
+                    hr_img.save(row["enhanced_file"])
+                
+                f.write((",\n" if n_frames else "") + json.dumps(row))
+                n_frames += 1
+                for dup_id in duplicates:
+                    dup_row = {"frame_id": dup_id, "duplicate_of": frame_id, "predictions": preds, "findings": findings}
+                    if non_diagnostic:
+                        dup_row["non_diagnostic"] = True
+                    f.write(",\n" + json.dumps(dup_row))
+                    n_frames += 1
+                
+                for fid in [frame_id] + duplicates:
+                    chunk_preds.append(preds)
+                    chunk_ids.append(fid)
+                    chunk_diagnostic.append(not non_diagnostic)
+            # One vectorized aggregation step per model batch
+            aggregator.update_dicts(chunk_preds, chunk_ids, chunk_diagnostic)
+        
+        elapsed = time.perf_counter() - start
+        summary = {
+            "status": "ALERT - Abnormalities Detected" if abnormal_frames else "CLEAN - No Significant Findings",
+            "frames_processed": n_frames,
+            "abnormal_frames": abnormal_frames,
+            "finding_counts": finding_counts,
+            "elapsed_seconds": round(elapsed, 2),
+            "frames_per_second": round(n_frames / elapsed, 2) if elapsed > 0 else 0.0
+        }
+        summary["clinical_aggregation"] = aggregator.report()
+        if selector:
+            summary["deduplication"] = selector.stats()
+        if gate:
+            gate_stats = gate.stats()
+            # Measured SR seconds per upscaled frame times the frames the gate kept away from SR
+            if sr_model.frames:
+                gate_stats["estimated_sr_seconds_saved"] = round(
+                    gate_stats["sr_frames_skipped"] * sr_model.seconds / sr_model.frames, 2)
+                if policy == POLICY_TRIAGE:
+                    gate_stats["estimate_note"] = "upper bound: under triage only flagged frames would have been upscaled"
+            else:
+                gate_stats["estimated_sr_seconds_saved"] = None
+                gate_stats["estimate_note"] = "no frame was upscaled, so there is no SR time to extrapolate from"
+            summary["quality_gate"] = gate_stats
+        f.write('\n],\n"study_summary": ' + json.dumps(summary, indent=4) + '\n}\n')
+    
+    print(f"Processed {n_frames} frames ({summary['frames_per_second']} frames/s)")
+    print(f"Study report generated at {report_path}")
+    return summary
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Capsule Endoscopy End-to-End Pipeline")
-    parser.add_argument("--input", required=True, help="Path to raw image frame")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--input", help="Path to raw image frame")
+    source.add_argument("--study", help="Study to process: a directory of frames, a glob pattern or a video file")
     parser.add_argument("--endo_weights", required=True, help="Path to EndoL2H weights")
     parser.add_argument("--galar_weights", required=True, help="Path to GalarML weights")
     parser.add_argument("--galar_arch", default="resnet50", help="Architecture for GalarML (resnet18, resnet50, vit_b_16...)")
     parser.add_argument("--upscale", type=int, default=8, help="Upscaling factor for EndoL2H")
     parser.add_argument("--output", default="./output", help="Output directory")
+    parser.add_argument("--batch_size", type=int, default=8, help="Frames per forward pass in study mode")
+    parser.add_argument("--queue_size", type=int, default=4, help="Batches buffered between study pipeline stages")
+    parser.add_argument("--save_hr", action="store_true", help="Also save every enhanced frame in study mode")
+    parser.add_argument("--policy", default=POLICY_FULL, choices=POLICIES, help="When to run super-resolution relative to classification")
+    parser.add_argument("--triage_threshold", type=float, default=0.5, help="Abnormality probability that triggers full SR in triage mode")
+    parser.add_argument("--dedup", action="store_true", help="Study mode: only run keyframes of near-duplicate runs through the models")
+    parser.add_argument("--dedup_threshold", type=float, default=0.95, help="Similarity (0-1) at which a frame counts as a duplicate of its keyframe")
+    parser.add_argument("--dedup_max_skip", type=int, default=30, help="Max consecutive frames reusing one keyframe before a new one is forced")
+    parser.add_argument("--dedup_method", default="dhash", choices=DEDUP_METHODS, help="Perceptual hash or downsampled difference")
+    parser.add_argument("--quality_gate", action="store_true", help="Study mode: skip SR on technically unusable frames and mark them non-diagnostic")
+    parser.add_argument("--quality_threshold", type=float, default=0.3, help="Technical quality score (0-1) below which a frame is non-diagnostic")
+    parser.add_argument("--fps", type=float, default=None, help="Study frame rate, to report section transit times in seconds")
+    parser.add_argument("--smoothing_window", type=int, default=5, help="Frames averaged when smoothing probabilities for segment detection")
+    parser.add_argument("--top_k", type=int, default=5, help="Most suspicious frames reported per finding")
+    parser.add_argument("--tiled", action="store_true", help="Single-image mode: run SR in overlapping tiles at native resolution")
+    parser.add_argument("--tile_size", type=int, default=128, help="Tile size in input pixels for --tiled")
+    parser.add_argument("--tile_overlap", type=int, default=16, help="Tile overlap in input pixels for --tiled")
+    parser.add_argument("--max_tile_memory_mb", type=int, default=1024, help="Peak memory budget for tiled SR")
     
     args = parser.parse_args()
+    if args.tiled and (args.study or args.policy != POLICY_FULL):
+        parser.error(f"--tiled is single-image only and needs --policy {POLICY_FULL}")
     
     try:
-        run_pipeline(args.input, args.endo_weights, args.galar_weights, args.output, args.galar_arch, args.upscale)
+        if args.study:
+            run_study(args.study, args.endo_weights, args.galar_weights, args.output, args.galar_arch, args.upscale,
+                      args.batch_size, args.queue_size, args.save_hr, args.policy, args.triage_threshold,
+                      args.dedup, args.dedup_threshold, args.dedup_max_skip, args.dedup_method,
+                      args.quality_gate, args.quality_threshold, args.fps, args.smoothing_window, args.top_k)
+        else:
+            run_pipeline(args.input, args.endo_weights, args.galar_weights, args.output, args.galar_arch, args.upscale,
+                         args.policy, args.triage_threshold, args.tiled, args.tile_size, args.tile_overlap, args.max_tile_memory_mb)
     except Exception as e:
         print(f"Pipeline Execution Failed: {str(e)}")
-
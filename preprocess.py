@@ -1,40 +1,332 @@
 import os
 import shutil
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
 from sklearn.model_selection import train_test_split
 
-def prepare_galar_dataset(image_dir, labels_csv, output_dir):
+from data_pipeline import MANIFEST_FORMATS, describe_frames, frame_id, load_manifest, write_manifest
+
+MANIFEST_EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "arrow": ".arrow"}
+
+# How images end up in output_dir/images. The sources are immutable, so links are safe
+MATERIALIZE = ["symlink", "hardlink", "reflink", "copy"]
+VERIFY = ["size_mtime", "hash"]
+
+FICLONE = 0x40049409  # linux/fs.h: share extents on btrfs / XFS (reflink=1) / bcachefs
+
+def _file_hash(path, block_size=1 << 20):
+    h = hashlib.blake2b()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _already_materialized(src, dst, mode, verify):
+    """True when dst is already the result of materializing src, so a rerun can skip it."""
+    if not os.path.lexists(dst):
+        return False
+    if mode == "symlink":
+        return os.path.islink(dst) and os.readlink(dst) == os.path.abspath(src)
+    if os.path.islink(dst):
+        return False
+    if mode == "hardlink":
+        return os.path.samefile(src, dst)
+    src_stat, dst_stat = os.stat(src), os.stat(dst)
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    if verify == "hash":
+        return _file_hash(src) == _file_hash(dst)
+    # copy2 / copystat carry the mtime over, so an identical copy has the same one
+    return int(src_stat.st_mtime) == int(dst_stat.st_mtime)
+
+def _reflink(src, dst):
+    import fcntl
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+def _materialize_one(src, dst, mode, verify):
+    """Returns 'skipped', or the mode actually used (reflink/hardlink fall back to copy)."""
+    if _already_materialized(src, dst, mode, verify):
+        return "skipped"
+    # Write next to the target and rename, so an interrupted run never leaves a half-written image behind
+    tmp = f"{dst}.tmp"
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    used = mode
+    if mode == "symlink":
+        os.symlink(os.path.abspath(src), tmp)
+    elif mode == "hardlink":
+        try:
+            os.link(src, tmp)
+        except OSError:
+            # Cross-device or unsupported filesystem
+            shutil.copy2(src, tmp)
+            used = "copy"
+    elif mode == "reflink":
+        try:
+            _reflink(src, tmp)
+        except (OSError, ImportError):
+            shutil.copy2(src, tmp)
+            used = "copy"
+    else:
+        shutil.copy2(src, tmp)
+    os.replace(tmp, dst)
+    return used
+
+def materialize_images(image_dir, names, images_out, mode="copy", verify="size_mtime", workers=8, progress_every=5.0):
+    """
+    Links or copies `names` from image_dir into images_out through a thread pool.
+    Files already present and identical are skipped, so an interrupted run can simply
+    be restarted. Progress is printed every `progress_every` seconds.
+    """
+    if mode not in MATERIALIZE:
+        raise ValueError(f"Unknown materialization mode '{mode}', expected one of {MATERIALIZE}")
+    if verify not in VERIFY:
+        raise ValueError(f"Unknown verification '{verify}', expected one of {VERIFY}")
+    
+    counts = {"skipped": 0, "failed": 0}
+    total = len(names)
+    start = last_report = time.time()
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_materialize_one, os.path.join(image_dir, name), os.path.join(images_out, name), mode, verify): name
+            for name in names
+        }
+        for future in as_completed(futures):
+            try:
+                used = future.result()
+            except OSError as e:
+                used = "failed"
+                print(f"Failed to materialize {futures[future]}: {e}")
+            counts[used] = counts.get(used, 0) + 1
+            done += 1
+            now = time.time()
+            if now - last_report >= progress_every or done == total:
+                last_report = now
+                rate = done / max(now - start, 1e-6)
+                print(f"[{mode}] {done}/{total} images ({rate:.0f}/s) {counts}")
+    
+    if counts.get("copy") and mode in ("hardlink", "reflink"):
+        print(f"{mode} unsupported for {counts['copy']} files, fell back to copy")
+    return counts
+
+def train_val_test_split(items):
+    """
+    80/10/10 split with random_state=42 of a list or DataFrame. Sets too small for
+    train_test_split to produce every split leave the missing ones empty instead of raising.
+    """
+    if len(items) < 2:
+        return items, items[:0], items[:0]
+    train, rest = train_test_split(items, test_size=0.2, random_state=42)
+    if len(rest) < 2:
+        return train, rest, rest[:0]
+    val, test = train_test_split(rest, test_size=0.5, random_state=42)
+    return train, val, test
+
+def prepare_galar_dataset(image_dir, labels_csv, output_dir, manifest_format="csv", with_stats=False, workers=None,
+                          materialize="copy", verify="size_mtime", copy_workers=8):
     """
     Creates the folder structure and CSVs expected by GalarCapsuleML.
+    With manifest_format="parquet"/"arrow" the splits are written as typed columnar
+    manifests instead, each row carrying frame_id, file size and image dimensions
+    (plus brightness/blur/bubble scores with with_stats).
+    Images are materialized with `materialize` (symlink, hardlink, reflink or copy);
+    rerunning skips images already in place, so an interrupted run resumes.
     """
+    if manifest_format not in MANIFEST_FORMATS:
+        raise ValueError(f"Unknown manifest format '{manifest_format}', expected one of {MANIFEST_FORMATS}")
     os.makedirs(output_dir, exist_ok=True)
     images_out = os.path.join(output_dir, "images")
     os.makedirs(images_out, exist_ok=True)
     
-    df = pd.read_csv(labels_csv)
-    train_df, test_df = train_test_split(df, test_size=0.2, random_state=42)
-    val_df, test_df = train_test_split(test_df, test_size=0.5, random_state=42)
+    df = load_manifest(labels_csv)
+    if manifest_format != "csv":
+        df["frame_id"] = [frame_id(name) for name in df['filename']]
+        info = describe_frames([os.path.join(image_dir, name) for name in df['filename']], with_stats, workers=workers)
+        df = pd.concat([df.reset_index(drop=True), info], axis=1)
+    train_df, val_df, test_df = train_val_test_split(df)
     
-    train_df.to_csv(os.path.join(output_dir, "train.csv"), index=False)
-    val_df.to_csv(os.path.join(output_dir, "val.csv"), index=False)
-    test_df.to_csv(os.path.join(output_dir, "test.csv"), index=False)
+    ext = MANIFEST_EXTENSIONS[manifest_format]
+    for split, split_df in [("train", train_df), ("val", val_df), ("test", test_df)]:
+        if manifest_format == "csv":
+            split_df.to_csv(os.path.join(output_dir, f"{split}{ext}"), index=False)
+        else:
+            write_manifest(split_df, os.path.join(output_dir, f"{split}{ext}"), manifest_format)
     
-    # Copy images to output image dir
-    for img_name in df['filename']:
-        shutil.copy(os.path.join(image_dir, img_name), os.path.join(images_out, img_name))
+    # Link / copy images to output image dir
+    materialize_images(image_dir, list(df['filename']), images_out, materialize, verify, copy_workers)
     
     print(f"Dataset prepared at {output_dir}")
 
-def prepare_pix2pix_folders(lr_dir, hr_dir, output_dir):
+PAIR_FORMATS = ["png", "tar", "memmap"]
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+def _index_by_stem(directory):
+    """
+    {filename stem: filename} for every image in directory, from a single scan.
+    Stems shared by several files (x.png and x.jpg) would silently pair the wrong image, so they are rejected.
+    """
+    index, clashes = {}, {}
+    for e in os.scandir(directory):
+        if e.is_file() and e.name.lower().endswith(IMAGE_EXTENSIONS):
+            stem = os.path.splitext(e.name)[0]
+            if stem in index:
+                clashes.setdefault(stem, [index[stem]]).append(e.name)
+            index[stem] = e.name
+    if clashes:
+        examples = "; ".join(", ".join(sorted(names)) for names in list(clashes.values())[:5])
+        raise ValueError(f"{len(clashes)} filename stems in {directory} match more than one image ({examples})")
+    return index
+
+def _build_pair(task):
+    """
+    Loads one LR/HR pair, brings both to the pair size (HR size by default, LR upsampled bicubic)
+    and concatenates them side by side (A = LR on the left, B = HR on the right) like pix2pix's aligned mode.
+    Returns PNG bytes, or the raw HxWx3 array when `encode` is False.
+    """
+    import io
+    import numpy as np
+    from PIL import Image
+    
+    lr_path, hr_path, size, encode = task
+    hr = Image.open(hr_path).convert("RGB")
+    size = tuple(size) if size else hr.size
+    if hr.size != size:
+        hr = hr.resize(size, Image.BICUBIC)
+    lr = Image.open(lr_path).convert("RGB").resize(size, Image.BICUBIC)
+    ab = np.concatenate([np.asarray(lr), np.asarray(hr)], axis=1)
+    if not encode:
+        return ab
+    buf = io.BytesIO()
+    Image.fromarray(ab).save(buf, format="PNG", compress_level=1)
+    return buf.getvalue()
+
+def _write_png_split(pool, tasks, stems, split_dir, chunksize):
+    # Resumable: pairs already on disk are not rebuilt
+    todo = [(t, stem) for t, stem in zip(tasks, stems) if not os.path.exists(os.path.join(split_dir, f"{stem}.png"))]
+    for (_, stem), data in zip(todo, pool.map(_build_pair, [t for t, _ in todo], chunksize=chunksize)):
+        path = os.path.join(split_dir, f"{stem}.png")
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.tmp", path)
+    return len(todo)
+
+def _write_tar_split(pool, tasks, stems, split_dir, chunksize, shard_size):
+    """WebDataset-style shards: split/shard-000000.tar, each member '<stem>.png'."""
+    import io
+    import tarfile
+    
+    tar, written = None, 0
+    try:
+        for i, data in enumerate(pool.map(_build_pair, tasks, chunksize=chunksize)):
+            if i % shard_size == 0:
+                if tar is not None:
+                    tar.close()
+                tar = tarfile.open(os.path.join(split_dir, f"shard-{i // shard_size:06d}.tar"), "w")
+            info = tarfile.TarInfo(f"{stems[i]}.png")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+            written += 1
+    finally:
+        if tar is not None:
+            tar.close()
+    return written
+
+def _write_memmap_split(pool, tasks, stems, split_dir, chunksize, size):
+    """One N x H x 2W x 3 uint8 .npy per split (np.load(..., mmap_mode='r')) plus the stem order."""
+    import numpy as np
+    
+    w, h = size
+    pairs = np.lib.format.open_memmap(os.path.join(split_dir, "pairs.npy"), mode="w+", dtype=np.uint8,
+                                      shape=(len(tasks), h, 2 * w, 3))
+    for i, ab in enumerate(pool.map(_build_pair, tasks, chunksize=chunksize)):
+        pairs[i] = ab
+    pairs.flush()
+    with open(os.path.join(split_dir, "pairs_index.txt"), "w") as f:
+        f.write("\n".join(stems))
+    return len(tasks)
+
+def prepare_pix2pix_folders(lr_dir, hr_dir, output_dir, pair_format="png", size=None, workers=None,
+                            shard_size=1000, chunksize=16):
     """
     Prepares A/B folders for pix2pix (EndoL2H) training.
+    LR and HR frames are matched by filename stem, split 80/10/10 with random_state=42
+    (same as prepare_galar_dataset) and turned into side-by-side AB pairs on a process pool.
+    pair_format:
+      png    - one AB png per pair in output_dir/<split>/ (pix2pix aligned dataset layout, resumable)
+      tar    - packed shards of `shard_size` pngs, output_dir/<split>/shard-NNNNNN.tar
+      memmap - a single uint8 output_dir/<split>/pairs.npy array to memory-map (needs a fixed size)
+    size is the (width, height) of each half; defaults to the HR size.
     """
-    for split in ['train', 'val', 'test']:
-        os.makedirs(os.path.join(output_dir, split), exist_ok=True)
-        # pix2pix expects images concatenated side-by-side or in A/B folders
-        # Here we just setup the structure
+    from concurrent.futures import ProcessPoolExecutor
+    from PIL import Image
+    
+    if pair_format not in PAIR_FORMATS:
+        raise ValueError(f"Unknown pair format '{pair_format}', expected one of {PAIR_FORMATS}")
+    
+    lr_index, hr_index = _index_by_stem(lr_dir), _index_by_stem(hr_dir)
+    stems = sorted(set(lr_index) & set(hr_index))
+    if not stems:
+        raise ValueError(f"No LR/HR pairs with matching filename stems in {lr_dir} and {hr_dir}")
+    unmatched = len(lr_index) + len(hr_index) - 2 * len(stems)
+    if unmatched:
+        print(f"Skipping {unmatched} frames without a counterpart")
+    
+    if pair_format == "memmap" and size is None:
+        with Image.open(os.path.join(hr_dir, hr_index[stems[0]])) as img:
+            size = img.size
+    
+    train, val, test = train_val_test_split(stems)
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for split, split_stems in [("train", train), ("val", val), ("test", test)]:
+            split_dir = os.path.join(output_dir, split)
+            os.makedirs(split_dir, exist_ok=True)
+            tasks = [(os.path.join(lr_dir, lr_index[s]), os.path.join(hr_dir, hr_index[s]), size, pair_format != "memmap")
+                     for s in split_stems]
+            if pair_format == "png":
+                written = _write_png_split(pool, tasks, split_stems, split_dir, chunksize)
+            elif pair_format == "tar":
+                written = _write_tar_split(pool, tasks, split_stems, split_dir, chunksize, shard_size)
+            else:
+                written = _write_memmap_split(pool, tasks, split_stems, split_dir, chunksize, size)
+            print(f"{split}: {len(split_stems)} pairs ({written} built)")
     print(f"Pix2Pix structure ready at {output_dir}")
 
 if __name__ == "__main__":
-    # Example usage
-    pass
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Prepare GalarCapsuleML / pix2pix datasets")
+    sub = parser.add_subparsers(dest="command", required=True)
+    
+    galar = sub.add_parser("galar", help="GalarCapsuleML splits")
+    galar.add_argument("--image_dir", type=str, required=True, help="Directory with the source frames")
+    galar.add_argument("--labels_csv", type=str, required=True, help="Labels manifest with a 'filename' column")
+    galar.add_argument("--output_dir", type=str, required=True, help="Output dataset directory")
+    galar.add_argument("--manifest_format", type=str, default="csv", choices=MANIFEST_FORMATS, help="Split manifest format")
+    galar.add_argument("--with_stats", action="store_true", help="Precompute brightness, blur and bubble scores (columnar manifests)")
+    galar.add_argument("--materialize", type=str, default="copy", choices=MATERIALIZE, help="How images are placed in output_dir/images")
+    galar.add_argument("--verify", type=str, default="size_mtime", choices=VERIFY, help="How existing files are recognised as identical")
+    galar.add_argument("--copy_workers", type=int, default=8, help="Threads used to link/copy images")
+    
+    pix2pix = sub.add_parser("pix2pix", help="EndoL2H AB training pairs")
+    pix2pix.add_argument("--lr_dir", type=str, required=True, help="Low-resolution frames")
+    pix2pix.add_argument("--hr_dir", type=str, required=True, help="High-resolution frames (same filename stems)")
+    pix2pix.add_argument("--output_dir", type=str, required=True, help="Output dataset directory")
+    pix2pix.add_argument("--pair_format", type=str, default="png", choices=PAIR_FORMATS, help="Loose pngs, tar shards or one memmap array per split")
+    pix2pix.add_argument("--size", type=int, nargs=2, default=None, metavar=("W", "H"), help="Size of each half (default: HR size)")
+    pix2pix.add_argument("--workers", type=int, default=None, help="Pair-building processes (default: CPU count)")
+    pix2pix.add_argument("--shard_size", type=int, default=1000, help="Pairs per tar shard")
+    args = parser.parse_args()
+    
+    if args.command == "galar":
+        prepare_galar_dataset(args.image_dir, args.labels_csv, args.output_dir, args.manifest_format, args.with_stats,
+                              materialize=args.materialize, verify=args.verify, copy_workers=args.copy_workers)
+    else:
+        prepare_pix2pix_folders(args.lr_dir, args.hr_dir, args.output_dir, args.pair_format, args.size,
+                                args.workers, args.shard_size)
@@ -40,8 +40,9 @@ export default function LiveFeedDashboard() {
 
         ws.onmessage = (event) => {
             try {
+                // First message is a full snapshot, later ones only carry changed fields
                 const data = JSON.parse(event.data);
-                setTelemetry(data);
+                setTelemetry((prev: any) => ({ ...prev, ...data }));
             } catch (e) {
                 console.error("Failed to parse telemetry", e);
             }
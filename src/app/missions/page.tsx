@@ -16,20 +16,23 @@ import { cn } from "@/lib/utils";
 
 export default function MissionHistory() {
     const [missions, setMissions] = useState<any[]>([]);
+    const [total, setTotal] = useState(0);
     const [loading, setLoading] = useState(true);
 
     useEffect(() => {
-        fetch("http://localhost:8000/api/missions")
+        // First page only, projected to the columns the table shows
+        fetch("http://localhost:8000/api/missions?limit=50&fields=id,timestamp,type,source&include_total=true")
             .then(res => res.json())
             .then(data => {
-                setMissions(data);
+                setMissions(data.items);
+                setTotal(data.total);
                 setLoading(false);
             })
             .catch(err => console.error("Failed to fetch missions", err));
     }, []);
 
     const stats = [
-        { label: "Total Missions", val: missions.length.toString(), icon: History, color: "text-accent" },
+        { label: "Total Missions", val: total.toString(), icon: History, color: "text-accent" },
         { label: "Avg Mission Duration", val: "06:14:02", icon: Clock, color: "text-primary" },
         { label: "AI Detection Accuracy", val: "99.8%", icon: Target, color: "text-stable" },
     ];
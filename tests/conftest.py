@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The backend runs from backend/ (`import database`, `from models.X import ...`),
+# root scripts import it as `backend.models.X`; make both resolvable
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "backend")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# database.py opens (and initialises) its store at import; keep it out of backend/data
+os.environ.setdefault("SMARTPILL_DATA_DIR", tempfile.mkdtemp(prefix="smartpill-test-"))
+
+
+@pytest.fixture(scope="session")
+def api(tmp_path_factory):
+    """
+    backend/main.py run from a scratch directory (it writes uploads/ and results/ relative to
+    the working directory), forced into simulated mode so no weights are loaded.
+    """
+    for name in ("fastapi", "httpx", "torch", "PIL"):
+        pytest.importorskip(name)
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("api"))
+    try:
+        import main
+        main.endo_weights = main.endo_onnx = main.galar_weights = os.path.join(os.getcwd(), "missing.pth")
+        yield main
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from cache import ResultCache
+
+
+@pytest.fixture
+def weights(tmp_path):
+    path = tmp_path / "model.pth"
+    path.write_bytes(b"weights-v1")
+    return str(path)
+
+
+def test_memory_then_disk_hits(tmp_path, weights):
+    cache = ResultCache(str(tmp_path / "cache"), [weights], max_memory_entries=1)
+    assert cache.get("aa11") is None
+    cache.put("aa11", {"results": {"polyp": 0.9}})
+    cache.put("bb22", {"results": {"polyp": 0.1}})  # pushes aa11 out of memory
+
+    assert cache.get("bb22") == {"results": {"polyp": 0.1}}
+    assert cache.get("aa11") == {"results": {"polyp": 0.9}}
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["memory_entries"] == 1
+    assert stats["disk_entries"] == 2
+
+
+def test_disk_entries_survive_a_restart(tmp_path, weights):
+    ResultCache(str(tmp_path / "cache"), [weights]).put("cc33", {"v": 1})
+    cache = ResultCache(str(tmp_path / "cache"), [weights])
+    assert cache.stats()["disk_entries"] == 1
+    assert cache.get("cc33") == {"v": 1}
+
+
+def test_entry_with_deleted_hr_image_is_a_miss(tmp_path, weights):
+    hr_path = tmp_path / "frame_hr.png"
+    hr_path.write_bytes(b"png")
+    cache = ResultCache(str(tmp_path / "cache"), [weights])
+    cache.put("dd44", {"hr_path": str(hr_path)})
+    assert cache.get("dd44") is not None
+
+    os.remove(hr_path)
+    assert cache.get("dd44") is None
+    assert cache.stats()["memory_entries"] == 0
+
+
+def test_disk_store_is_bounded(tmp_path, weights):
+    cache = ResultCache(str(tmp_path / "cache"), [weights], max_memory_entries=1, max_disk_entries=10)
+    for i in range(30):
+        cache.put(f"{i:04x}", {"i": i})
+    assert sum(1 for _ in cache._iter_disk_files()) <= 11
+
+
+def test_fingerprint_follows_weight_contents_and_model_tag(tmp_path, weights):
+    np = pytest.importorskip("numpy")
+    pixels = np.zeros((4, 4, 3), dtype=np.uint8)
+    base = ResultCache(str(tmp_path / "a"), [weights], model_tag="m1")
+    key = base.key(pixels, "full")
+
+    assert ResultCache(str(tmp_path / "b"), [weights], model_tag="m1").key(pixels, "full") == key
+    assert ResultCache(str(tmp_path / "c"), [weights], model_tag="m2").key(pixels, "full") != key
+    assert base.key(pixels, "triage") != key
+    assert base.key(np.ones_like(pixels), "full") != key
+
+    # Same size, different bytes: a retrained checkpoint must not reuse results
+    with open(weights, "wb") as f:
+        f.write(b"weights-v2")
+    assert ResultCache(str(tmp_path / "d"), [weights], model_tag="m1").key(pixels, "full") != key
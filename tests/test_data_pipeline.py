@@ -0,0 +1,56 @@
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("PIL")
+
+import data_pipeline
+from data_pipeline import ManifestWriter, frame_id, load_manifest, manifest_format, write_manifest
+
+
+def manifest(n=6):
+    df = pd.DataFrame({
+        "path": [f"vrcaps_run1/frame_{i:04d}.png" for i in range(n)],
+        "filename": [f"frame_{i:04d}.png" for i in range(n)],
+        "brightness": [float(i * 10) for i in range(n)],
+    })
+    for name in data_pipeline.SECTIONS + data_pipeline.ABNORMALITIES + data_pipeline.TECHNICAL:
+        df[name] = 0
+    df["stomach"] = [1, 1, 1, 0, 0, 0][:n]
+    df["colon"] = [0, 0, 0, 1, 1, 1][:n]
+    df["polyp"] = [0, 1, 0, 0, 1, 0][:n]
+    return df
+
+
+def test_manifest_format_from_extension():
+    assert manifest_format("m.parquet") == "parquet"
+    assert manifest_format("m.feather") == "arrow"
+    assert manifest_format("m.csv") == "csv"
+    with pytest.raises(ValueError):
+        ManifestWriter("m.csv", fmt="xlsx")
+
+
+def test_frame_id_is_stable_and_path_dependent():
+    assert frame_id("run1/a.png") == frame_id("run1/a.png")
+    assert frame_id("run1/a.png") != frame_id("run2/a.png")
+
+
+def test_chunked_csv_writer_appends_one_header(tmp_path):
+    path = str(tmp_path / "manifest.csv")
+    (tmp_path / "manifest.csv").write_text("stale\n")
+    assert write_manifest(manifest(), path, chunk_size=4) == 6
+
+    df = load_manifest(path)
+    assert len(df) == 6
+    assert list(df["path"]) == list(manifest()["path"])
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".parquet", ".arrow"])
+def test_filtered_load(tmp_path, suffix):
+    if suffix != ".csv":
+        pytest.importorskip("pyarrow")
+    path = str(tmp_path / f"manifest{suffix}")
+    write_manifest(manifest(), path, chunk_size=4)
+
+    df = load_manifest(path, columns=["path"], sections=["colon"], abnormalities=["polyp"])
+    assert list(df["path"]) == ["vrcaps_run1/frame_0004.png"]
+    assert len(load_manifest(path, min_brightness=30)) == 3
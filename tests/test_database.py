@@ -0,0 +1,100 @@
+import json
+import os
+import threading
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """database module pointed at an empty data dir, with a fresh per-thread connection."""
+    monkeypatch.setattr(database, "DB_FILE", str(tmp_path / "smartpill.db"))
+    monkeypatch.setattr(database, "MISSIONS_FILE", str(tmp_path / "missions.json"))
+    monkeypatch.setattr(database, "PATIENTS_FILE", str(tmp_path / "patients.json"))
+    monkeypatch.setattr(database, "SETTINGS_FILE", str(tmp_path / "settings.json"))
+    monkeypatch.setattr(database, "_local", threading.local())
+    yield database
+    conn = getattr(database._local, "conn", None)
+    if conn is not None:
+        conn.close()
+
+
+def write_json(path, value):
+    with open(path, "w") as f:
+        json.dump(value, f)
+
+
+def test_fresh_database_gets_default_patients(db):
+    db.init_db()
+    assert [p["id"] for p in db.get_patients()] == [p["id"] for p in db.DEFAULT_PATIENTS]
+    assert db.get_settings() == db.DEFAULT_SETTINGS
+
+
+def test_legacy_files_are_imported_then_retired(db):
+    missions = [  # newest first, like the old JSON store
+        {"id": "m2", "timestamp": "2024-02-02T00:00:00", "type": "image", "results": {"polyp": 0.9}},
+        {"id": "m1", "timestamp": "2024-02-01T00:00:00", "type": "image", "results": {"polyp": 0.1}},
+    ]
+    write_json(db.MISSIONS_FILE, missions)
+    write_json(db.PATIENTS_FILE, [{"id": "PX-1", "name": "Test"}])
+    write_json(db.SETTINGS_FILE, {"operator_id": "OP-7"})
+
+    db.init_db()
+
+    assert [m["id"] for m in db.get_missions()] == ["m2", "m1"]
+    assert [p["id"] for p in db.get_patients()] == ["PX-1"]
+    assert db.get_settings()["operator_id"] == "OP-7"
+    assert db.count_missions(finding="polyp") == 1
+    for path in (db.MISSIONS_FILE, db.PATIENTS_FILE, db.SETTINGS_FILE):
+        assert not os.path.exists(path)
+        assert os.path.exists(path + ".migrated")
+
+
+def test_rerun_import_keeps_newer_rows(db):
+    write_json(db.SETTINGS_FILE, {"operator_id": "OP-7"})
+    db.init_db()
+    db.update_settings({"operator_id": "OP-8"})
+
+    # An interrupted import leaves the file behind; running it again must not undo later edits
+    os.replace(db.SETTINGS_FILE + ".migrated", db.SETTINGS_FILE)
+    db.init_db()
+    assert db.get_settings()["operator_id"] == "OP-8"
+
+
+def test_unreadable_legacy_file_is_left_in_place(db):
+    with open(db.PATIENTS_FILE, "w") as f:
+        f.write("{not json")
+    write_json(db.SETTINGS_FILE, {"telemetry_rate": 1})
+
+    db.init_db()
+
+    assert os.path.exists(db.PATIENTS_FILE)
+    assert not os.path.exists(db.PATIENTS_FILE + ".migrated")
+    assert os.path.exists(db.SETTINGS_FILE + ".migrated")
+    assert db.get_settings()["telemetry_rate"] == 1
+
+
+def test_query_missions_pages_newest_first(db):
+    db.init_db()
+    ids = [db.add_mission({"type": "image" if i % 2 else "video"})["id"] for i in range(5)]
+
+    page, cursor = db.query_missions(limit=2)
+    assert [m["id"] for m in page] == ids[::-1][:2]
+    assert cursor is not None
+    assert [m["id"] for m in db.iter_missions(page_size=2)] == ids[::-1]
+    assert db.count_missions(mission_type="image") == 2
+    with pytest.raises(ValueError):
+        db.decode_cursor("not-a-cursor")
+
+
+def test_date_only_until_covers_the_whole_day(db):
+    db.init_db()
+    for ts in ("2024-04-30T23:59:59", "2024-05-01T00:00:00", "2024-05-01T23:59:59.5", "2024-05-02T00:00:00"):
+        with db.transaction() as conn:
+            conn.execute("INSERT INTO missions (id, timestamp, data) VALUES (?, ?, ?)", (ts, ts, "{}"))
+
+    assert db.count_missions(until="2024-05-01") == 3
+    assert db.count_missions(until="2024-05-01T12:00:00") == 2
+    assert db.count_missions(since="2024-05-01", until="2024-05-01") == 2
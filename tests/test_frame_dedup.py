@@ -0,0 +1,35 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+
+from models.frame_dedup import KeyframeSelector, iter_keyframe_groups
+
+
+def frame(seed):
+    return np.random.default_rng(seed).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+
+
+@pytest.mark.parametrize("method", ["dhash", "diff"])
+def test_repeated_frames_collapse_onto_their_keyframe(method):
+    a = frame(1)
+    b = 255 - a
+    stream = [("f0", a), ("f1", a), ("f2", a), ("f3", b), ("f4", b)]
+    selector = KeyframeSelector(threshold=0.95, method=method)
+
+    groups = [(fid, dups) for fid, _, dups in iter_keyframe_groups(stream, selector)]
+
+    assert groups == [("f0", ["f1", "f2"]), ("f3", ["f4"])]
+    assert selector.stats()["frames_skipped"] == 3
+
+
+def test_max_skip_forces_a_new_keyframe():
+    a = frame(1)
+    selector = KeyframeSelector(max_skip=2)
+    groups = [(fid, dups) for fid, _, dups in iter_keyframe_groups(((f"f{i}", a) for i in range(7)), selector)]
+    assert groups == [("f0", ["f1", "f2"]), ("f3", ["f4", "f5"]), ("f6", [])]
+
+
+def test_unknown_method_is_rejected():
+    with pytest.raises(ValueError):
+        KeyframeSelector(method="ssim")
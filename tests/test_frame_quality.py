@@ -0,0 +1,38 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+
+from models.frame_quality import QualityGate
+
+
+def textured(mean=128, amplitude=60, size=128, seed=0):
+    rng = np.random.default_rng(seed)
+    gray = np.clip(mean + rng.uniform(-amplitude, amplitude, (size, size)), 0, 255).astype(np.uint8)
+    return np.repeat(gray[:, :, None], 3, axis=2)
+
+
+def test_well_exposed_textured_frame_is_diagnostic():
+    assessment = QualityGate().assess(textured())
+    assert not assessment["non_diagnostic"]
+    assert assessment["quality"] == min(assessment[k] for k in ("exposure", "sharpness", "specular", "contrast"))
+
+
+@pytest.mark.parametrize("frame, weakest", [
+    (np.zeros((128, 128, 3), dtype=np.uint8), "exposure"),                 # no view
+    (np.full((128, 128, 3), 128, dtype=np.uint8), "sharpness"),            # flat / blurred
+    (textured(mean=245, amplitude=10), "specular"),                       # bubble highlights
+])
+def test_bad_frames_are_non_diagnostic(frame, weakest):
+    assessment = QualityGate().assess(frame)
+    assert assessment["non_diagnostic"]
+    assert assessment[weakest] == assessment["quality"]
+
+
+def test_record_counts_skipped_sr():
+    gate = QualityGate()
+    gate.record({"non_diagnostic": True}, skipped_sr=True)
+    gate.record({"non_diagnostic": True}, skipped_sr=False)
+    gate.record({"non_diagnostic": False}, skipped_sr=False)
+    stats = gate.stats()
+    assert (stats["frames_scored"], stats["non_diagnostic_frames"], stats["sr_frames_skipped"]) == (3, 2, 1)
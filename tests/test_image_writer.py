@@ -0,0 +1,70 @@
+import os
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+Image = pytest.importorskip("PIL.Image")
+
+from image_writer import ImageWriter
+
+
+@pytest.mark.parametrize("fmt", ["png", "webp", "jpeg"])
+def test_arrays_are_encoded_in_the_configured_format(tmp_path, fmt):
+    writer = ImageWriter(fmt)
+    writer.start()
+    path = str(tmp_path / f"frame.{writer.ext}")
+    writer.submit(path, np.full((8, 8, 3), 200, dtype=np.uint8))
+    writer.stop()
+
+    with Image.open(path) as img:
+        assert img.format == {"png": "PNG", "webp": "WEBP", "jpeg": "JPEG"}[fmt]
+        assert img.size == (8, 8)
+    assert not [p for p in os.listdir(tmp_path) if p.endswith(".tmp")]
+
+
+def test_not_started_writes_inline(tmp_path):
+    writer = ImageWriter()
+    done = []
+    writer.submit_bytes(str(tmp_path / "raw.png"), b"bytes", on_written=lambda: done.append(True))
+    assert (tmp_path / "raw.png").read_bytes() == b"bytes"
+    assert done == [True]
+
+
+def test_queue_is_bounded_in_bytes(tmp_path):
+    """Past the byte budget the caller writes inline instead of queueing more."""
+    writer = ImageWriter(max_queue_bytes=10)
+    release = threading.Event()
+    writers = {}
+    write = writer._write
+
+    def tracked_write(item):
+        if item[1].endswith("first"):
+            release.wait(5)  # holds the only writer thread, so the queue stays occupied
+        writers[os.path.basename(item[1])] = threading.current_thread().name
+        write(item)
+
+    writer._write = tracked_write
+    writer.start()
+    writer.submit_bytes(str(tmp_path / "first"), b"123456")   # queued (6 bytes)
+    writer.submit_bytes(str(tmp_path / "second"), b"123456")  # 12 > 10: written by the caller
+    assert writers.get("second") == threading.current_thread().name
+    writer.submit_bytes(str(tmp_path / "third"), b"1234")     # 10 <= 10: queued
+    assert "third" not in writers
+    assert writer.queued_bytes == 10
+
+    release.set()
+    writer.stop()
+    assert writers["first"].startswith("image-writer") and writers["third"].startswith("image-writer")
+    assert writer.queued_bytes == 0
+    assert writer.written == 3
+    assert sorted(os.listdir(tmp_path)) == ["first", "second", "third"]
+
+
+def test_callback_only_runs_after_a_successful_write(tmp_path):
+    writer = ImageWriter()
+    calls = []
+    writer.submit_bytes(str(tmp_path / "missing_dir" / "x.png"), b"x", on_written=lambda: calls.append("bad"))
+    writer.submit_bytes(str(tmp_path / "ok.png"), b"x", on_written=lambda: calls.append("ok"))
+    assert calls == ["ok"]
+    assert writer.failed == 1
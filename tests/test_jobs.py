@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("numpy")  # jobs aggregates studies with models.study_aggregator
+
+from jobs import LANE_BULK, LANE_INTERACTIVE, JobQueue
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def wait_finished(job):
+    while not job.finished:
+        await asyncio.sleep(0.001)
+
+
+def test_interactive_frames_overtake_queued_bulk_frames():
+    order = []
+
+    async def process_frame(frame_id, filename, data, policy):
+        order.append(filename)
+        await asyncio.sleep(0)
+        return {"results": {"polyp": 0.1}}
+
+    async def main():
+        queue = JobQueue(process_frame, max_concurrency=1)
+        await queue.start()
+        try:
+            bulk = queue.submit([(f"b{i}.png", b"x") for i in range(5)], "full")
+            single = queue.submit([("one.png", b"x")], "full")
+            await wait_finished(bulk)
+            await wait_finished(single)
+            assert queue.pending_bytes == 0
+        finally:
+            await queue.stop()
+        return bulk, single
+
+    bulk, single = run(main())
+    assert (bulk.lane, single.lane) == (LANE_BULK, LANE_INTERACTIVE)
+    assert order[0] == "one.png"
+    assert single.frames[0]["job_id"] == single.id
+    assert bulk.status == "done"
+    assert bulk.summary()["aggregation"]["frames"] == 5
+
+
+def test_failed_frames_mark_the_job_partial():
+    async def process_frame(frame_id, filename, data, policy):
+        if filename == "bad.png":
+            raise ValueError("cannot decode")
+        return {"results": {"polyp": 0.1}}
+
+    async def main():
+        queue = JobQueue(process_frame, max_concurrency=2)
+        await queue.start()
+        try:
+            job = queue.submit([("ok.png", b"x"), ("bad.png", b"x")], "full")
+            await wait_finished(job)
+        finally:
+            await queue.stop()
+        return job
+
+    job = run(main())
+    assert job.status == "partial"
+    assert job.frames[1]["error"] == "ValueError: cannot decode"
+
+
+def test_admission_is_bounded_by_frames_and_bytes():
+    async def main():
+        queue = JobQueue(None, max_concurrency=0, max_pending_frames=3, max_pending_bytes=10)
+        await queue.start()
+        queue.submit([("a.png", b"12345")], "full")
+        assert queue.pending_bytes == 5
+        with pytest.raises(OverflowError):
+            queue.submit([("b.png", b"123456")], "full")
+        with pytest.raises(OverflowError):
+            queue.submit([("c.png", b""), ("d.png", b""), ("e.png", b"")], "full")
+        queue.submit([("f.png", b"12345")], "full")
+        assert queue.stats()["pending_frames"] == 2
+
+    run(main())
+
+
+def test_subscribers_get_every_frame_then_the_job():
+    async def process_frame(frame_id, filename, data, policy):
+        return {"results": {}}
+
+    async def main():
+        queue = JobQueue(process_frame, max_concurrency=1)
+        await queue.start()
+        try:
+            job = queue.submit([("a.png", b"x"), ("b.png", b"x")], "full")
+            events = queue.subscribe(job)
+            await wait_finished(job)
+            received = []
+            while not events.empty():
+                received.append(events.get_nowait())
+        finally:
+            await queue.stop()
+        return received
+
+    received = run(main())
+    assert [e["type"] for e in received] == ["frame", "frame", "job"]
+    assert received[-1]["status"] == "done"
@@ -0,0 +1,100 @@
+import io
+import time
+import zipfile
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def client(api):
+    """App with its lifespan running (job queue, image writer, simulated models)."""
+    from fastapi.testclient import TestClient
+    with TestClient(api.app) as client:
+        deadline = time.monotonic() + 30
+        while not api.is_ready() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        yield client
+
+
+def png(seed):
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGB", (16, 16), (seed * 40 % 256, 80, 120)).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def zip_of(members, compression=zipfile.ZIP_DEFLATED):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression) as zf:
+        for name, data in members:
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+
+def wait_for(client, job_id, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("done", "partial", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_zip_study_is_expanded_in_name_order_and_processed(client):
+    study = zip_of([("b.png", png(2)), ("a.png", png(1)), ("__MACOSX/a.png", b"junk"), ("notes.txt", b"x")])
+    response = client.post("/jobs", files=[("files", ("study.zip", study, "application/zip"))])
+    assert response.status_code == 202
+    submitted = response.json()
+    assert submitted["lane"] == "bulk"
+    assert [f["filename"] for f in submitted["frames"]] == ["a.png", "b.png"]
+
+    job = wait_for(client, submitted["job_id"])
+    assert job["status"] == "done"
+    assert all(f["result"]["results"] for f in job["frames"])
+
+
+def test_single_frame_goes_to_the_interactive_lane(client):
+    response = client.post("/jobs", files=[("files", ("one.png", png(3), "image/png"))])
+    assert response.status_code == 202
+    assert response.json()["lane"] == "interactive"
+    assert wait_for(client, response.json()["job_id"])["status"] == "done"
+
+
+@pytest.mark.parametrize("files, status", [
+    ([("files", ("broken.zip", b"not a zip", "application/zip"))], 400),
+    ([("files", ("empty.zip", zip_of([("notes.txt", b"x")]), "application/zip"))], 400),
+])
+def test_unusable_uploads_are_rejected(client, files, status):
+    assert client.post("/jobs", files=files).status_code == status
+
+
+def test_unknown_policy_and_priority_are_rejected(client):
+    files = [("files", ("one.png", png(1), "image/png"))]
+    assert client.post("/jobs", params={"policy": "nope"}, files=files).status_code == 400
+    assert client.post("/jobs", params={"priority": "urgent"}, files=files).status_code == 400
+
+
+def test_zip_members_are_checked_before_anything_is_inflated(api):
+    limits = {"max_frames": 3, "max_frame_bytes": 1000, "max_total_bytes": 1500, "max_ratio": 50}
+    ok = zip_of([("a.png", b"x" * 10), ("b.png", b"y" * 10)], zipfile.ZIP_STORED)
+    assert [name for name, _ in api.unpack_uploads([("s.zip", io.BytesIO(ok))], **limits)] == ["a.png", "b.png"]
+
+    too_large = [
+        zip_of([(f"{i}.png", b"x") for i in range(4)], zipfile.ZIP_STORED),             # frame count
+        zip_of([("a.png", bytes(range(256)) * 5)], zipfile.ZIP_STORED),                 # one frame
+        zip_of([(f"{i}.png", bytes(range(256)) * 3) for i in range(2)], zipfile.ZIP_STORED),  # total
+        zip_of([("bomb.png", b"\0" * 1000)]),                                            # ratio
+    ]
+    for data in too_large:
+        with pytest.raises(api.UploadTooLarge):
+            api.unpack_uploads([("s.zip", io.BytesIO(data))], **limits)
+    with pytest.raises(api.UploadTooLarge):
+        api.unpack_uploads([("a.png", io.BytesIO(b"x" * 1001))], **limits)
+
+
+def test_zip_bomb_gets_413(client):
+    bomb = zip_of([("bomb.png", b"\0" * (4 << 20))])
+    response = client.post("/jobs", files=[("files", ("bomb.zip", bomb, "application/zip"))])
+    assert response.status_code == 413
+    assert "compression ratio" in response.json()["detail"]
@@ -0,0 +1,41 @@
+import metrics
+
+
+def test_counters_and_gauge_callbacks_render_at_scrape_time():
+    lookups = metrics.Counter("test_lookups_total", "Lookups", ["result"])
+    lookups.inc("hit", amount=3)
+    lookups.inc("miss")
+    totals = {("hit",): 5}
+    metrics.Counter("test_cached_total", "Cached lookups", ["result"], callback=lambda: totals)
+    metrics.Gauge("test_depth", "Depth", callback=lambda: 7)
+    metrics.Gauge("test_unavailable", "Not wired yet", callback=lambda: None)
+
+    text = metrics.render()
+    assert "# TYPE test_lookups_total counter" in text
+    assert 'test_lookups_total{result="hit"} 3' in text
+    assert "# TYPE test_cached_total counter" in text
+    assert 'test_cached_total{result="hit"} 5' in text
+    assert "test_depth 7" in text
+    assert "test_unavailable" not in text
+
+
+def test_histogram_buckets_are_cumulative():
+    hist = metrics.Histogram("test_seconds", "Latency", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 5.0):
+        hist.observe(value, "decode")
+
+    lines = hist.render()
+    assert 'test_seconds_bucket{stage="decode",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{stage="decode",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{stage="decode",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{stage="decode"} 3' in lines
+
+
+def test_profiler_folds_stacks_by_function_and_file():
+    profiler = metrics.SamplingProfiler(interval=0.001).start()
+    sum(i * i for i in range(200000))
+    samples = profiler.stop()
+    assert samples
+    for stack in samples:
+        for frame in stack.split(";")[1:]:
+            assert ":" not in frame.rsplit("(", 1)[-1]
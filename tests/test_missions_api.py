@@ -0,0 +1,65 @@
+import pytest
+
+
+@pytest.fixture
+def client(api):
+    from fastapi.testclient import TestClient
+    return TestClient(api.app)
+
+
+@pytest.fixture
+def missions():
+    """Five missions under a source of their own, oldest first."""
+    import uuid
+
+    import database
+    source = f"test-{uuid.uuid4()}"
+    return source, [
+        database.add_mission({"type": "image" if i % 2 else "video", "source": source, "results": {"polyp": i / 5}})["id"]
+        for i in range(5)
+    ]
+
+
+def test_pages_follow_the_cursor_newest_first(client, missions):
+    source, ids = missions
+    seen, cursor = [], None
+    while True:
+        params = {"source": source, "limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/api/missions", params=params).json()
+        seen += [m["id"] for m in page["items"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == ids[::-1]
+
+
+def test_filters_projection_and_total(client, missions):
+    source, ids = missions
+    page = client.get("/api/missions", params={"source": source, "type": "image", "fields": "id,type",
+                                               "include_total": True}).json()
+    assert page["total"] == 2
+    assert page["items"] == [{"id": ids[3], "type": "image"}, {"id": ids[1], "type": "image"}]
+
+    polyps = client.get("/api/missions", params={"source": source, "finding": "polyp", "min_prob": 0.5}).json()
+    assert [m["id"] for m in polyps["items"]] == [ids[4], ids[3]]
+
+
+@pytest.mark.parametrize("params", [{"cursor": "not-a-cursor"}, {"finding": 'polyp"'}, {"limit": 0}])
+def test_bad_queries_are_rejected(client, params):
+    assert client.get("/api/missions", params=params).status_code in (400, 422)
+
+
+def test_export_streams_every_match_as_ndjson(client, missions):
+    import json
+    source, ids = missions
+    response = client.get("/api/missions/export", params={"source": source, "fields": "id"})
+    assert response.status_code == 200
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == ids[::-1]
+    assert client.get("/api/missions/export", params={"finding": 'a"b'}).status_code == 400
+
+
+@pytest.mark.parametrize("path", ["/api/missions", "/api/missions/export"])
+def test_min_prob_needs_a_finding(client, path):
+    response = client.get(path, params={"min_prob": 0.5})
+    assert response.status_code == 400
+    assert "finding" in response.json()["detail"]
@@ -0,0 +1,98 @@
+import pytest
+
+from models.pipeline import (POLICY_CLASSIFY_ONLY, POLICY_FULL, POLICY_SR_AT_CLASSIFIER_RES, POLICY_TRIAGE, chunks,
+                             find_abnormalities, first_passes, gate_policies, run_policies, run_policy, second_passes)
+
+
+class FakeSR:
+    def __init__(self):
+        self.calls = []
+        self.sizes = []
+
+    def upscale_batch(self, images, output_size=None, as_numpy=False):
+        self.calls.append(list(images))
+        self.sizes.append(output_size)
+        return [f"hr:{image}" for image in images]
+
+
+class FakeClassifier:
+    img_res = 224
+
+    def predict_batch(self, images):
+        # Raw frames ending in "!" look abnormal
+        return [{"polyp": 0.9 if str(image).endswith("!") else 0.1} for image in images]
+
+
+class FakeGate:
+    def __init__(self, bad):
+        self.bad = bad
+        self.recorded = []
+
+    def assess(self, image):
+        return {"non_diagnostic": image in self.bad}
+
+    def record(self, assessment, skipped_sr):
+        self.recorded.append((assessment["non_diagnostic"], skipped_sr))
+
+
+def test_chunks_consumes_generators_lazily():
+    assert list(chunks((i for i in range(7)), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(chunks([], 3)) == []
+
+
+
+def test_find_abnormalities_ignores_other_classes():
+    assert find_abnormalities({"polyp": 0.7, "blood": 0.2, "colon": 0.99}) == {"polyp": 0.7}
+
+
+def test_full_and_classify_only():
+    sr, clf = FakeSR(), FakeClassifier()
+    assert [e for e, _ in run_policy(sr, clf, ["a", "b"], POLICY_FULL)] == ["hr:a", "hr:b"]
+    assert [e for e, _ in run_policy(sr, clf, ["a", "b"], POLICY_CLASSIFY_ONLY)] == [None, None]
+    assert sr.calls == [["a", "b"]]
+
+
+def test_sr_at_classifier_res_renders_at_the_classifier_input_size():
+    sr, clf = FakeSR(), FakeClassifier()
+    run_policy(sr, clf, ["a"], POLICY_SR_AT_CLASSIFIER_RES)
+    assert sr.sizes == [224]
+
+
+def test_triage_upscales_only_flagged_frames():
+    sr, clf = FakeSR(), FakeClassifier()
+    results = run_policy(sr, clf, ["a", "b!", "c"], POLICY_TRIAGE)
+    assert [e for e, _ in results] == [None, "hr:b!", None]
+    assert sr.calls == [["b!"]]
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        run_policy(FakeSR(), FakeClassifier(), ["a"], "sr_twice")
+
+
+def test_mixed_policies_come_back_in_input_order():
+    results = run_policies(FakeSR(), FakeClassifier(), ["a", "b!", "c"], [POLICY_FULL, POLICY_TRIAGE, POLICY_CLASSIFY_ONLY])
+    assert [enhanced for enhanced, _ in results] == ["hr:a", "hr:b!", None]
+
+
+def test_gate_downgrades_non_diagnostic_frames():
+    gate = FakeGate(bad={"b"})
+    policies, assessments = gate_policies(gate, ["a", "b", "c"], [POLICY_FULL, POLICY_FULL, POLICY_CLASSIFY_ONLY])
+    assert policies == [POLICY_FULL, POLICY_CLASSIFY_ONLY, POLICY_CLASSIFY_ONLY]
+    assert [a["non_diagnostic"] for a in assessments] == [False, True, False]
+    assert gate.recorded == [(False, False), (True, True), (False, False)]
+
+    assert gate_policies(None, ["a"], [POLICY_FULL]) == ([POLICY_FULL], [None])
+
+
+
+def test_mixed_batch_shares_passes_and_keeps_input_order():
+    sr, clf = FakeSR(), FakeClassifier()
+    images = ["a", "b!", "c", "d!"]
+    policies = [POLICY_FULL, POLICY_TRIAGE, POLICY_CLASSIFY_ONLY, POLICY_TRIAGE]
+
+    results = second_passes(sr, clf, first_passes(sr, clf, images, policies))
+
+    assert [enhanced for enhanced, _ in results] == ["hr:a", "hr:b!", None, "hr:d!"]
+    # One SR call for the full group, one for the flagged triage frames
+    assert sr.calls == [["a"], ["b!", "d!"]]
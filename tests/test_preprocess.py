@@ -0,0 +1,165 @@
+import os
+import tarfile
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("sklearn")
+Image = pytest.importorskip("PIL.Image")
+
+from preprocess import (_index_by_stem, materialize_images, prepare_galar_dataset, prepare_pix2pix_folders,
+                        train_val_test_split)
+
+
+def write_image(path, size, seed=0):
+    w, h = size
+    pixels = np.random.default_rng(seed).integers(0, 256, (h, w, 3), dtype=np.uint8)
+    Image.fromarray(pixels).save(path)
+
+
+@pytest.fixture
+def frames(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    names = [f"frame_{i:02d}.png" for i in range(10)]
+    for i, name in enumerate(names):
+        write_image(src / name, (8, 8), seed=i)
+    return src, names
+
+
+@pytest.mark.parametrize("mode", ["copy", "symlink", "hardlink", "reflink"])
+def test_materialize_then_rerun_skips_everything(tmp_path, frames, mode):
+    src, names = frames
+    out = tmp_path / "out"
+
+    counts = materialize_images(str(src), names, str(out), mode=mode, workers=2)
+    assert counts["failed"] == 0 and sum(counts.values()) == len(names)
+    for name in names:
+        assert (out / name).read_bytes() == (src / name).read_bytes()
+        assert not (out / f"{name}.tmp").exists()
+    if mode == "symlink":
+        assert all(os.readlink(out / name) == str(src / name) for name in names)
+    if mode == "hardlink":
+        assert all(os.path.samefile(out / name, src / name) for name in names)
+
+    assert materialize_images(str(src), names, str(out), mode=mode, workers=2)["skipped"] == len(names)
+
+
+def test_changed_copies_are_redone(tmp_path, frames):
+    src, names = frames
+    out = tmp_path / "out"
+    materialize_images(str(src), names, str(out), workers=2)
+
+    # Same size and mtime, different bytes: only hash verification notices
+    stat = os.stat(out / names[0])
+    (out / names[0]).write_bytes(bytes(stat.st_size))
+    os.utime(out / names[0], (stat.st_atime, stat.st_mtime))
+    assert materialize_images(str(src), names, str(out), workers=2)["skipped"] == len(names)
+    counts = materialize_images(str(src), names, str(out), verify="hash", workers=2)
+    assert counts == {"skipped": len(names) - 1, "failed": 0, "copy": 1}
+    assert (out / names[0]).read_bytes() == (src / names[0]).read_bytes()
+
+    # A symlinked run over copies replaces them
+    assert materialize_images(str(src), names, str(out), mode="symlink", workers=2)["symlink"] == len(names)
+
+
+def test_materialize_rejects_unknown_modes(tmp_path, frames):
+    src, names = frames
+    with pytest.raises(ValueError):
+        materialize_images(str(src), names, str(tmp_path / "out"), mode="move")
+    with pytest.raises(ValueError):
+        materialize_images(str(src), names, str(tmp_path / "out"), verify="crc")
+
+
+def test_split_of_tiny_sets_leaves_missing_splits_empty():
+    assert train_val_test_split(["a"]) == (["a"], [], [])
+    train, val, test = train_val_test_split(["a", "b", "c"])
+    assert sorted(train + val + test) == ["a", "b", "c"] and test == []
+    train, val, test = train_val_test_split(list(range(20)))
+    assert (len(train), len(val), len(test)) == (16, 2, 2)
+
+
+def test_galar_dataset_splits_and_images(tmp_path, frames):
+    src, names = frames
+    labels = tmp_path / "labels.csv"
+    pd.DataFrame({"filename": names, "polyp": [i % 2 for i in range(len(names))]}).to_csv(labels, index=False)
+
+    out = tmp_path / "galar"
+    prepare_galar_dataset(str(src), str(labels), str(out), materialize="symlink")
+    splits = [pd.read_csv(out / f"{split}.csv") for split in ("train", "val", "test")]
+    assert sorted(name for split in splits for name in split["filename"]) == names
+    assert sorted(os.listdir(out / "images")) == names
+
+
+@pytest.fixture
+def pairs(tmp_path):
+    lr, hr = tmp_path / "lr", tmp_path / "hr"
+    lr.mkdir()
+    hr.mkdir()
+    stems = [f"f{i:02d}" for i in range(10)]
+    for i, stem in enumerate(stems):
+        write_image(lr / f"{stem}.png", (4, 3), seed=i)
+        write_image(hr / f"{stem}.jpg", (8, 6), seed=100 + i)
+    write_image(lr / "orphan.png", (4, 3))
+    return lr, hr, stems
+
+
+def split_stems(stems):
+    return dict(zip(["train", "val", "test"], train_val_test_split(stems)))
+
+
+def test_pix2pix_png_pairs_are_side_by_side(tmp_path, pairs):
+    lr, hr, stems = pairs
+    out = tmp_path / "ab"
+    prepare_pix2pix_folders(str(lr), str(hr), str(out), workers=2)
+
+    for split, expected in split_stems(stems).items():
+        assert sorted(os.listdir(out / split)) == sorted(f"{stem}.png" for stem in expected)
+    stem = split_stems(stems)["train"][0]
+    ab = np.asarray(Image.open(out / "train" / f"{stem}.png"))
+    assert ab.shape == (6, 16, 3)
+    np.testing.assert_array_equal(ab[:, 8:], np.asarray(Image.open(hr / f"{stem}.jpg").convert("RGB")))
+
+
+def test_pix2pix_tar_shards(tmp_path, pairs):
+    lr, hr, stems = pairs
+    out = tmp_path / "ab"
+    prepare_pix2pix_folders(str(lr), str(hr), str(out), pair_format="tar", workers=2, shard_size=3)
+
+    train = split_stems(stems)["train"]
+    shards = sorted(os.listdir(out / "train"))
+    assert shards == [f"shard-{i:06d}.tar" for i in range(3)]
+    members = []
+    for shard in shards:
+        with tarfile.open(out / "train" / shard) as tar:
+            members += tar.getnames()
+    assert members == [f"{stem}.png" for stem in train]
+
+
+def test_pix2pix_memmap_array(tmp_path, pairs):
+    lr, hr, stems = pairs
+    out = tmp_path / "ab"
+    prepare_pix2pix_folders(str(lr), str(hr), str(out), pair_format="memmap", size=(5, 4), workers=2)
+
+    train = split_stems(stems)["train"]
+    array = np.load(out / "train" / "pairs.npy", mmap_mode="r")
+    assert array.shape == (len(train), 4, 10, 3) and array.dtype == np.uint8
+    assert (out / "train" / "pairs_index.txt").read_text().split("\n") == train
+    hr_half = np.asarray(Image.open(hr / f"{train[0]}.jpg").convert("RGB").resize((5, 4), Image.BICUBIC))
+    np.testing.assert_array_equal(array[0, :, 5:], hr_half)
+
+
+def test_pix2pix_rejects_unknown_formats(tmp_path, pairs):
+    lr, hr, _ = pairs
+    with pytest.raises(ValueError):
+        prepare_pix2pix_folders(str(lr), str(hr), str(tmp_path / "ab"), pair_format="zip")
+
+
+def test_pix2pix_rejects_ambiguous_stems(tmp_path, pairs):
+    lr, hr, _ = pairs
+    write_image(hr / "f00.png", (8, 6))
+    with pytest.raises(ValueError, match="f00.jpg, f00.png"):
+        _index_by_stem(str(hr))
+    with pytest.raises(ValueError, match="more than one image"):
+        prepare_pix2pix_folders(str(lr), str(hr), str(tmp_path / "ab"))
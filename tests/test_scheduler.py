@@ -0,0 +1,84 @@
+import asyncio
+import threading
+
+import pytest
+
+from scheduler import MicroBatchScheduler
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_results_resolve_in_submission_order_and_batch():
+    batches = []
+
+    def process(payloads):
+        batches.append(list(payloads))
+        return [p * 10 for p in payloads]
+
+    async def main():
+        scheduler = MicroBatchScheduler(process, max_batch_size=4, max_wait_ms=50)
+        await scheduler.start()
+        try:
+            return await asyncio.gather(*(scheduler.submit(i) for i in range(10)))
+        finally:
+            await scheduler.stop()
+
+    assert run(main()) == [i * 10 for i in range(10)]
+    assert all(len(b) <= 4 for b in batches)
+    assert sum(len(b) for b in batches) == 10
+    assert len(batches) < 10
+
+
+def test_batch_failure_reaches_every_caller_in_the_batch():
+    def process(payloads):
+        raise RuntimeError("boom")
+
+    async def main():
+        scheduler = MicroBatchScheduler(process, max_batch_size=4, max_wait_ms=20)
+        await scheduler.start()
+        try:
+            return await asyncio.gather(*(scheduler.submit(i) for i in range(3)), return_exceptions=True)
+        finally:
+            await scheduler.stop()
+
+    results = run(main())
+    assert len(results) == 3
+    assert all(isinstance(r, RuntimeError) and str(r) == "boom" for r in results)
+
+
+def test_submit_before_start_raises():
+    async def main():
+        await MicroBatchScheduler(lambda p: p).submit(1)
+
+    with pytest.raises(RuntimeError):
+        run(main())
+
+
+def test_stop_fails_waiting_requests_and_lets_running_batch_finish():
+    release = threading.Event()
+    started = threading.Event()
+
+    def process(payloads):
+        started.set()
+        release.wait(5)
+        return list(payloads)
+
+    async def main():
+        scheduler = MicroBatchScheduler(process, max_batch_size=1, max_wait_ms=1)
+        await scheduler.start()
+        running = asyncio.ensure_future(scheduler.submit("running"))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        waiting = [asyncio.ensure_future(scheduler.submit(i)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        stopping = asyncio.ensure_future(scheduler.stop())
+        await asyncio.sleep(0.01)
+        release.set()
+        await stopping
+        return await running, await asyncio.gather(*waiting, return_exceptions=True)
+
+    running, waiting = run(main())
+    assert running == "running"
+    assert len(waiting) == 3
+    assert all(isinstance(r, RuntimeError) and "stopped" in str(r) for r in waiting)
@@ -0,0 +1,78 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from models.study_aggregator import StudyAggregator
+
+CLASSES = ["polyp", "blood", "stomach", "small_bowel"]
+
+
+def study(n=40):
+    """Stomach for the first half, small bowel after; a polyp run at frames 10-19."""
+    probs = np.zeros((n, len(CLASSES)))
+    probs[:, 2] = np.where(np.arange(n) < n // 2, 0.9, 0.1)
+    probs[:, 3] = 1.0 - probs[:, 2]
+    probs[10:20, 0] = 0.95
+    probs[15, 0] = 0.99
+    return probs
+
+
+def feed(probs, batch, **kwargs):
+    agg = StudyAggregator(CLASSES, window=1, top_k=3, **kwargs)
+    for i in range(0, len(probs), batch):
+        agg.update(probs[i:i + batch], frame_ids=[f"f{j}" for j in range(i, min(i + batch, len(probs)))])
+    return agg.report()
+
+
+def test_segments_sections_and_top_frames():
+    report = feed(study(), batch=40, fps=2)
+
+    assert report["frames"] == 40
+    assert report["abnormal_segments"]["polyp"] == [
+        {"start_frame": 10, "end_frame": 19, "peak_score": 0.99, "peak_frame": 15}]
+    assert report["abnormal_segments"]["blood"] == []
+    assert report["sections"]["stomach"]["first_frame"] == 0
+    assert report["sections"]["stomach"]["transit_frames"] == 20
+    assert report["sections"]["stomach"]["transit_seconds"] == 10.0
+    assert report["sections"]["small_bowel"]["transit_frames"] is None
+    assert report["top_frames"]["polyp"][0] == {"frame": 15, "frame_id": "f15", "score": 0.99}
+
+
+@pytest.mark.parametrize("batch", [1, 3, 7, 16])
+def test_report_does_not_depend_on_batching(batch):
+    assert feed(study(), batch=batch) == feed(study(), batch=40)
+
+
+def test_open_segment_is_reported_while_streaming():
+    agg = StudyAggregator(CLASSES, window=1)
+    agg.update(study()[:15])
+    (segment,) = agg.report()["abnormal_segments"]["polyp"]
+    assert segment["open"] is True
+    assert segment["start_frame"] == 10
+
+
+def test_non_diagnostic_frames_do_not_count():
+    probs = study()
+    diagnostic = np.ones(len(probs), dtype=bool)
+    diagnostic[10:20] = False
+    agg = StudyAggregator(CLASSES, window=1)
+    agg.update(probs, diagnostic=diagnostic)
+    report = agg.report()
+    assert report["non_diagnostic_frames"] == 10
+    assert report["abnormal_segments"]["polyp"] == []
+    assert all(f["frame"] not in range(10, 20) for f in report["top_frames"]["polyp"])
+
+
+def test_smoothing_lag_is_corrected():
+    agg = StudyAggregator(CLASSES, window=5)
+    agg.update(study())
+    (segment,) = agg.report()["abnormal_segments"]["polyp"]
+    # Shifted back by (window - 1) // 2 so the segment sits on the raw run, not after it
+    assert abs(segment["start_frame"] - 10) <= 1
+    assert abs(segment["end_frame"] - 19) <= 2
+
+
+def test_update_dicts_takes_classes_from_first_prediction():
+    agg = StudyAggregator()
+    agg.update_dicts([{"polyp": 0.9, "ulcer": 0.1}] * 3)
+    assert agg.report()["abnormal_segments"]["polyp"][0]["open"] is True
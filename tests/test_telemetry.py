@@ -0,0 +1,71 @@
+import asyncio
+import json
+
+from telemetry import SimulatedPill, TelemetryHub
+
+
+def hub(queue_size=8):
+    return TelemetryHub(lambda: 5, queue_size=queue_size)
+
+
+def test_first_message_is_a_snapshot_then_deltas():
+    async def main():
+        h = hub()
+        sub = h.subscribe()
+        h.publish({"ph": 6.5, "battery": 85.0})
+        first = json.loads(await sub.next_message())
+        h.publish({"ph": 6.5, "battery": 84.9})
+        second = json.loads(await sub.next_message())
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first == {"ph": 6.5, "battery": 85.0}
+    assert second == {"battery": 84.9}
+
+
+def test_slow_viewer_drops_oldest_and_resyncs_with_a_snapshot():
+    async def main():
+        h = hub(queue_size=2)
+        sub = h.subscribe()
+        h.publish({"ph": 6.5, "battery": 85.0})
+        await sub.next_message()
+        for battery in (84.9, 84.8, 84.7):
+            h.publish({"ph": 6.5, "battery": battery})
+        # The first of the three was dropped; the viewer skips to the newest sample
+        message = json.loads(await sub.next_message())
+        return h, sub, message
+
+    h, sub, message = asyncio.run(main())
+    assert sub.dropped == 1
+    assert h.stats()["dropped"] == 1
+    assert message == {"ph": 6.5, "battery": 84.7}  # a gap in sequence numbers means a full snapshot
+    assert sub.queue.empty()
+
+
+def test_late_viewer_starts_from_the_current_snapshot():
+    async def main():
+        h = hub()
+        h.publish({"ph": 6.5, "battery": 85.0})
+        h.publish({"ph": 6.4, "battery": 85.0})
+        sub = h.subscribe()
+        return json.loads(await sub.next_message())
+
+    assert asyncio.run(main()) == {"ph": 6.4, "battery": 85.0}
+
+
+def test_samples_are_encoded_once_for_every_viewer():
+    async def main():
+        h = hub()
+        subs = [h.subscribe() for _ in range(3)]
+        h.publish({"ph": 6.5})
+        return [sub.queue.get_nowait() for sub in subs]
+
+    messages = asyncio.run(main())
+    assert all(m is messages[0] for m in messages)
+
+
+def test_simulated_pill_advances_by_elapsed_time():
+    pill = SimulatedPill()
+    start = pill.state["uptime"]
+    pill.step(2.0)
+    assert pill.step(0.5)["uptime"] == int(start + 2.5)
@@ -0,0 +1,86 @@
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+pytest.importorskip("PIL")
+
+from worker_pool import InferencePool, load_shared_state_dicts
+
+
+def spec(tmp_path):
+    # Missing weights: the workers build the wrappers in dummy mode
+    return {
+        "endo": {"model_path": str(tmp_path / "endo.pth"), "runtime": "torch", "onnx_path": str(tmp_path / "endo.onnx"),
+                 "scale_factor": 2},
+        "galar": {"model_type": "resnet50", "weights_path": str(tmp_path / "galar.pth"), "backend": "eager"}
+    }
+
+
+def frame(seed=0):
+    return np.random.default_rng(seed).integers(0, 256, (32, 32, 3), dtype=np.uint8)
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = InferencePool(spec(tmp_path), num_workers=2, threads_per_worker=1, load_timeout=120)
+    pool.start()
+    yield pool
+    pool.stop()
+
+
+def test_batches_are_dispatched_and_counted(pool):
+    results = pool.run_batch([(frame(0), "full"), (frame(1), "classify_only")])
+    assert len(results) == 2
+    enhanced, classification = results[0]
+    assert enhanced.shape[2] == 3 and "polyp" in classification
+    assert results[1][0] is None
+
+    # Both workers take work when addressed directly
+    for worker_id in (0, 1):
+        pool.submit([(frame(), "classify_only")], worker_id=worker_id).result(timeout=60)
+
+    stats = pool.stats()
+    assert [s["worker_id"] for s in stats] == [0, 1]
+    assert all(s["alive"] and s["pid"] > 0 and s["queue_depth"] == 0 for s in stats)
+    assert sum(s["frames_processed"] for s in stats) == 4
+
+
+def test_dead_worker_fails_its_callers_and_stops_taking_work(pool):
+    victim = pool._workers[0]["proc"]
+    future = pool.submit([(frame(i), "full") for i in range(16)], worker_id=0)
+    victim.kill()
+
+    with pytest.raises(RuntimeError, match="died"):
+        future.result(timeout=30)
+    wait_for(lambda: not pool.stats()[0]["alive"])
+    with pytest.raises(RuntimeError, match="not alive"):
+        pool.submit([(frame(), "full")], worker_id=0)
+
+    # The survivor takes everything else
+    assert len(pool.run_batch([(frame(), "triage")])) == 1
+    assert pool.stats()[1]["alive"]
+
+
+def test_weights_are_loaded_once_into_shared_memory(tmp_path):
+    model_spec = spec(tmp_path)
+    torch.save({"fc.weight": torch.ones(2, 2)}, model_spec["galar"]["weights_path"])
+    torch.save({"module.conv.weight": torch.ones(3, 3)}, model_spec["endo"]["model_path"])
+
+    state_dicts = load_shared_state_dicts(model_spec)
+    assert list(state_dicts["endo"]) == ["conv.weight"]
+    assert all(t.is_shared() for sd in state_dicts.values() for t in sd.values())
+
+    # ONNX sessions hold their own weights
+    model_spec["endo"]["runtime"] = "onnx"
+    assert "endo" not in load_shared_state_dicts(model_spec)